@@ -1,9 +1,22 @@
 from django.contrib import admin
 
-from .models import Comment, Group, Post
+from . import search
+from .models import Comment, Group, ImageJob, Post
 
 
-class PostAdmin(admin.ModelAdmin):
+class IndexedSearchMixin:
+    """Answer admin searches from the full-text index, not LIKE scans"""
+
+    search_kind = search.POST
+
+    def get_search_results(self, request, queryset, search_term):
+        ids = search.search_ids(self.search_kind, search_term)
+        if not search_term or ids is None:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(pk__in=ids), False
+
+
+class PostAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ("pk", "text", "pub_date", "author", "group")
     search_fields = ("text",)
     list_filter = ("pub_date",)
@@ -17,13 +30,22 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = "-пусто-"
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    search_kind = search.COMMENT
     list_display = ("pk", "post", "author", "text", "created")
     search_fields = ("text",)
     list_filter = ("post",)
     empty_value_display = "-пусто-"
 
 
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ("pk", "post", "kind", "status", "attempts", "updated")
+    list_filter = ("status", "kind")
+    readonly_fields = ("error",)
+    empty_value_display = "-пусто-"
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(ImageJob, ImageJobAdmin)
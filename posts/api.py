@@ -0,0 +1,201 @@
+"""Read-only JSON API for the feeds, posts and comments, version 1.
+
+Every list is keyset paginated like the HTML feeds: ``?cursor=`` takes
+the "next" or "previous" cursor of the response. ``?fields=id,text``
+picks the attributes of each item, and only the columns and joins those
+need are loaded. Responses are validated with the same ETags as the
+pages, and serialized with orjson when it is installed.
+"""
+import functools
+import json
+
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition, require_safe
+
+from . import timeline
+from .cache import FEED, FOLLOW, GROUP, page_etag
+from .models import Group, Post, User
+from .paginator import COMMENTS_PER_PAGE, CursorPaginator, paginate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Attribute -> (columns to load, related objects to join, serializer).
+POST_FIELDS = {
+    "id": ((), (), lambda post: post.pk),
+    "text": (("text",), (), lambda post: post.text),
+    "text_html": (("text_html",), (), lambda post: post.text_html),
+    "pub_date": ((), (), lambda post: post.pub_date.isoformat()),
+    "author": (
+        ("author__username",),
+        ("author",),
+        lambda post: post.author.username,
+    ),
+    "group": (
+        ("group__slug",),
+        ("group",),
+        lambda post: post.group.slug if post.group_id else None,
+    ),
+    "image": (
+        ("image",),
+        (),
+        lambda post: post.image.url if post.image else None,
+    ),
+    "thumbnails": (("thumbnails",), (), lambda post: post.thumbnails),
+    "comment_count": (
+        ("comment_count",),
+        (),
+        lambda post: post.comment_count,
+    ),
+}
+COMMENT_FIELDS = {
+    "id": ((), (), lambda comment: comment.pk),
+    "post": (("post",), (), lambda comment: comment.post_id),
+    "author": (
+        ("author__username",),
+        ("author",),
+        lambda comment: comment.author.username,
+    ),
+    "text": (("text",), (), lambda comment: comment.text),
+    "text_html": (("text_html",), (), lambda comment: comment.text_html),
+    "created": ((), (), lambda comment: comment.created.isoformat()),
+}
+
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _response(data, status=200):
+    return HttpResponse(
+        dumps(data), content_type="application/json", status=status
+    )
+
+
+def api_view(*versions):
+    """Serve the data a view returns as JSON, GET and HEAD only.
+
+    The response is validated by an ETag over the named generations, as
+    the pages are; errors are answered as JSON too, and values the view
+    cannot parse from the query, such as a cursor, as a 400.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            try:
+                return _response(view(request, *args, **kwargs))
+            except Http404:
+                return _response({"error": "Не найдено"}, status=404)
+            except APIError as error:
+                return _response({"error": str(error)}, status=error.status)
+            except (ValueError, ValidationError):
+                return _response({"error": "Неверный запрос"}, status=400)
+
+        wrapper = condition(etag_func=page_etag(*versions))(wrapper)
+        return require_safe(wrapper)
+
+    return decorator
+
+
+def _selected(request, available):
+    """The requested fields of ``available``, all of them by default"""
+    names = [
+        name.strip()
+        for name in request.GET.get("fields", "").split(",")
+        if name.strip()
+    ]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise APIError(f"Неизвестные поля: {', '.join(unknown)}")
+    return {name: available[name] for name in names or available}
+
+
+def _sparse(queryset, fields, required):
+    """Load the ``required`` columns and whatever ``fields`` need"""
+    columns, related = set(required), set()
+    for field_columns, field_related, _ in fields.values():
+        columns.update(field_columns)
+        related.update(field_related)
+    return (
+        queryset.select_related(None)
+        .select_related(*related)
+        .only(*columns)
+    )
+
+
+def _serialize(obj, fields):
+    return {name: field[2](obj) for name, field in fields.items()}
+
+
+def _post_page(request, queryset, follower=None):
+    fields = _selected(request, POST_FIELDS)
+    queryset = _sparse(queryset, fields, ("id", "pub_date"))
+    if follower is None:
+        page = paginate(request, queryset)
+    else:
+        page = timeline.paginate_feed(request, follower, queryset)
+    return {
+        "results": [_serialize(post, fields) for post in page],
+        "next": page.next_cursor,
+        "previous": page.previous_cursor,
+    }
+
+
+@api_view(FEED, GROUP)
+def posts(request):
+    return _post_page(request, Post.objects.for_feed())
+
+
+@api_view(FEED, GROUP)
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.only("pk"), slug=slug)
+    return _post_page(request, group.posts.for_feed())
+
+
+@api_view(FEED, GROUP)
+def author_posts(request, username):
+    author = get_object_or_404(User.objects.only("pk"), username=username)
+    return _post_page(request, author.posts.for_feed())
+
+
+@api_view(FEED, GROUP, FOLLOW)
+def follow_posts(request):
+    if not request.user.is_authenticated:
+        raise APIError("Требуется вход", status=401)
+    return _post_page(request, Post.objects.for_feed(), request.user)
+
+
+@api_view(FEED, GROUP)
+def post_detail(request, post_id):
+    fields = _selected(request, POST_FIELDS)
+    queryset = _sparse(Post.objects.for_feed(), fields, ("id", "pub_date"))
+    return _serialize(get_object_or_404(queryset, pk=post_id), fields)
+
+
+@api_view(FEED)
+def post_comments(request, post_id):
+    fields = _selected(request, COMMENT_FIELDS)
+    post = get_object_or_404(Post.objects.only("pk"), pk=post_id)
+    paginator = CursorPaginator(
+        _sparse(post.comments.all(), fields, ("id", "created")),
+        COMMENTS_PER_PAGE,
+        ordering=("created", "id"),
+    )
+    comments, next_cursor = paginator.get_window(request.GET.get("cursor"))
+    return {
+        "results": [_serialize(comment, fields) for comment in comments],
+        "next": next_cursor,
+    }
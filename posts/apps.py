@@ -3,3 +3,10 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = "posts"
+
+    def ready(self):
+        # Registers the system check and the query timing of every
+        # connection before any is opened.
+        from yatube import metrics, ratelimit  # noqa: F401
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,190 @@
+"""Async versions of the read-heavy feed views for the ASGI deployment.
+
+The ORM is synchronous, so every query runs in a bounded pool of
+ASYNC_VIEW_THREADS worker threads, and the independent ones of a page
+(for instance the follow status, author stats and posts of a profile)
+run there side by side. A slow database or storage call then holds a
+worker thread instead of the process. With ASYNC_VIEW_THREADS set to 0
+the calls run in turn on the request thread. urls.py serves these views
+in place of the ones in views.py when ASYNC_VIEWS is on.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.shortcuts import get_object_or_404, render
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from . import timeline
+from .cache import FEED, FOLLOW, GROUP, page_etag
+from .forms import CommentForm
+from .models import AuthorStats, Follow, Group, Post, User
+from .paginator import paginate
+from .views import _comment_thread
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_VIEW_THREADS,
+            thread_name_prefix="yatube-views",
+        )
+    return _executor
+
+
+def _call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Worker threads outlive requests; give the connection back.
+        close_old_connections()
+
+
+def run(func, *args, **kwargs):
+    """Run blocking ``func`` in the view threads and await its result"""
+    if not settings.ASYNC_VIEW_THREADS:
+        # One after another on the thread of the request, which is what
+        # tests wrapped in a transaction need.
+        return sync_to_async(functools.partial(func, *args, **kwargs))()
+    context = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(
+        _get_executor(),
+        functools.partial(context.run, _call, func, args, kwargs),
+    )
+
+
+def _is_authenticated(request):
+    return request.user.is_authenticated
+
+
+def login_required(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await run(_is_authenticated, request):
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def condition(etag_func):
+    """Async counterpart of django.views.decorators.http.condition"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag = quote_etag(await run(etag_func, request, *args, **kwargs))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD") and not response.has_header(
+                "ETag"
+            ):
+                response["ETag"] = etag
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _follow_page(request):
+    return timeline.paginate_feed(request, request.user)
+
+
+def _is_following(request, author):
+    return (
+        request.user.is_authenticated
+        and Follow.objects.filter(user=request.user, author=author).exists()
+    )
+
+
+@condition(etag_func=page_etag(FEED, GROUP))
+async def index(request):
+    page = await run(paginate, request, Post.objects.for_feed())
+    return await run(
+        render,
+        request,
+        "index.html",
+        {"page": page, "paginator": page.paginator},
+    )
+
+
+@condition(etag_func=page_etag(FEED, GROUP))
+async def group_posts(request, slug):
+    group = await run(
+        get_object_or_404, Group.objects.with_activity(), slug=slug
+    )
+    page = await run(paginate, request, group.posts.for_feed())
+    return await run(
+        render,
+        request,
+        "posts/group.html",
+        {"group": group, "page": page, "paginator": page.paginator},
+    )
+
+
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
+async def profile(request, username):
+    author = await run(get_object_or_404, User, username=username)
+    following, stats, page = await asyncio.gather(
+        run(_is_following, request, author),
+        run(AuthorStats.for_author, author),
+        run(paginate, request, author.posts.for_feed()),
+    )
+    return await run(
+        render,
+        request,
+        "posts/profile.html",
+        {
+            "author": author,
+            "stats": stats,
+            "page": page,
+            "paginator": page.paginator,
+            "following": following,
+        },
+    )
+
+
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
+async def post_view(request, username, post_id):
+    post = await run(get_object_or_404, Post.objects.for_feed(), id=post_id)
+    author = post.author
+    (comments, next_cursor), stats = await asyncio.gather(
+        run(_comment_thread, post, request.GET.get("comments")),
+        run(AuthorStats.for_author, author),
+    )
+    return await run(
+        render,
+        request,
+        "posts/view_post.html",
+        {
+            "author": author,
+            "stats": stats,
+            "post": post,
+            "items": comments,
+            "next_comments": next_cursor,
+            "form": CommentForm(),
+        },
+    )
+
+
+@login_required
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
+async def follow_index(request):
+    page = await run(_follow_page, request)
+    return await run(
+        render,
+        request,
+        "posts/follow.html",
+        {"page": page, "paginator": page.paginator},
+    )
@@ -0,0 +1,179 @@
+"""Latency, query and payload measurements of the posts views"""
+import math
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from yatube import ratelimit, templating
+
+from . import synthetic
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a non-empty sequence"""
+    ordered = sorted(samples)
+    rank = max(math.ceil(q / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def scenarios(reader, group, post):
+    """Requests to time, by name: method, url and a payload factory"""
+    author = post.author.username
+    return {
+        "index": ("get", reverse("index"), None),
+        "group_posts": (
+            "get",
+            reverse("group_posts", args=[group.slug]),
+            None,
+        ),
+        "profile": ("get", reverse("profile", args=[author]), None),
+        "post_view": (
+            "get",
+            reverse("post_view", args=[author, post.pk]),
+            None,
+        ),
+        "follow_index": ("get", reverse("follow_index"), None),
+        "add_comment": (
+            "post",
+            reverse("add_comment", args=[author, post.pk]),
+            lambda i: {"text": f"Комментарий из бенчмарка {i}"},
+        ),
+        "new_post": (
+            "post",
+            reverse("new_post"),
+            lambda i: {"text": f"Запись из бенчмарка {i}", "group": group.pk},
+        ),
+    }
+
+
+def measure(
+    client, method, url, payload=None, repeat=20, warmup=2, cold=False
+):
+    """Issue the request ``warmup + repeat`` times and summarize the rest.
+
+    With ``cold`` the cache is cleared before every request, so the timings
+    include rendering every fragment from the database.
+    """
+    timings, queries, sizes, statuses = [], [], [], set()
+    for i in range(warmup + repeat):
+        if cold:
+            cache.clear()
+        data = payload(i) if payload else None
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+        timings.append(elapsed * 1000)
+        queries.append(len(captured.captured_queries))
+        sizes.append(len(response.content))
+        statuses.add(response.status_code)
+    report = {"method": method.upper(), "url": url, "status": sorted(statuses)}
+    for q in PERCENTILES:
+        report[f"p{q}_ms"] = round(percentile(timings, q), 3)
+    report.update(
+        mean_ms=round(sum(timings) / len(timings), 3),
+        queries=percentile(queries, 50),
+        max_queries=max(queries),
+        bytes=percentile(sizes, 50),
+    )
+    return report
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def environment():
+    return {
+        "commit": _git_commit(),
+        "created": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+    }
+
+
+def run(repeat=20, warmup=2, cold=False):
+    """Time every scenario against the busiest rows of the database"""
+    reader, group, post = synthetic.busiest_targets()
+    client = Client()
+    client.force_login(reader)
+    return {
+        name: measure(client, method, url, payload, repeat, warmup, cold)
+        for name, (method, url, payload) in scenarios(
+            reader, group, post
+        ).items()
+    }
+
+
+def measure_ratelimit(repeat=1000):
+    """Latency of one rate-limit check on the configured counter cache"""
+    backend = type(ratelimit.counters())
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        ratelimit.check("benchmark", i % 10, "1000000/m")
+        timings.append((time.perf_counter() - start) * 1000)
+    report = {"backend": f"{backend.__module__}.{backend.__name__}"}
+    for q in PERCENTILES:
+        report[f"p{q}_ms"] = round(percentile(timings, q), 3)
+    report["mean_ms"] = round(sum(timings) / len(timings), 3)
+    return report
+
+
+def profile_templates(repeat=20, cold=False):
+    """Render cost of every GET scenario by template and node, summed"""
+    reader, group, post = synthetic.busiest_targets()
+    client = Client()
+    client.force_login(reader)
+    profiles = {}
+    for name, (method, url, _) in scenarios(reader, group, post).items():
+        if method != "get":
+            continue
+        profiles[name] = templating.RenderProfile()
+        for _ in range(repeat):
+            if cold:
+                cache.clear()
+            with templating.profile() as render_profile:
+                client.get(url)
+            profiles[name].merge(render_profile)
+    return profiles
+
+
+def compare(previous, current):
+    """Relative change of every metric between two runs, by view"""
+    changes = {}
+    for name, view in current.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        changes[name] = {
+            metric: round((view[metric] - before[metric]) / before[metric], 3)
+            if before[metric]
+            else None
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "queries", "bytes")
+        }
+    return changes
@@ -0,0 +1,62 @@
+"""Generation counters for template fragment caching.
+
+Fragment keys include the current generation of what they render, so a
+write only has to bump a counter for every stale fragment to stop being
+addressed; nothing is ever deleted or scanned. A counter that falls out
+of the cache restarts from the current time, never from a value an old
+fragment may still be keyed on. The same counters validate whole pages
+for conditional GET requests.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+# Posts, comments and groups: everything a feed page renders.
+FEED = "feed"
+# Group titles and slugs baked into per-post fragments.
+GROUP = "group"
+# Follow relations, which decide what the follow feed contains.
+FOLLOW = "follow"
+
+
+def _key(name):
+    return f"posts:version:{name}"
+
+
+def _fresh_version():
+    return time.time_ns() // 1000
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        cache.add(_key(name), _fresh_version(), None)
+        version = cache.get(_key(name))
+    return version
+
+
+def bump_version(*names):
+    for name in names:
+        try:
+            cache.incr(_key(name))
+        except ValueError:
+            cache.set(_key(name), _fresh_version(), None)
+
+
+def page_etag(*names):
+    """ETag function for ``condition()`` built from generation counters.
+
+    The tag covers the named generations, the session (pages differ per
+    viewer) and the full path with its query string. Computing it reads
+    only the cache, so a 304 never touches the database or templates.
+    The tag is weak: every render carries a fresh CSRF token.
+    """
+
+    def etag(request, *args, **kwargs):
+        versions = ".".join(str(get_version(name)) for name in names)
+        session = request.session.session_key or ""
+        key = f"{versions}:{session}:{request.get_full_path()}"
+        return 'W/"' + hashlib.md5(key.encode()).hexdigest() + '"'
+
+    return etag
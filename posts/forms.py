@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import images
 from .models import Comment, Post
 
 
@@ -8,6 +10,20 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ["group", "text", "image"]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The limits run before ImageField opens and verifies the file;
+        # wrapping to_python keeps the field itself a plain ImageField.
+        field = self.fields["image"]
+        to_python = field.to_python
+
+        def checked_to_python(data):
+            if isinstance(data, UploadedFile):
+                images.validate_upload(data)
+            return to_python(data)
+
+        field.to_python = checked_to_python
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,230 @@
+"""Out-of-band image processing for posts.
+
+Uploads are checked against byte, pixel and format limits from the image
+header alone. Saving a post with a new image only queues an ImageJob;
+the process_image_jobs worker claims queued jobs, replaces the upload
+with a downscaled JPEG without metadata stored under its content hash
+(so identical images share one file) and renders the thumbnails, so
+rendering a feed never has to resize anything.
+"""
+import hashlib
+import io
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+from sorl.thumbnail import get_thumbnail
+
+from .cache import FEED, bump_version
+from .models import ImageJob, Post
+
+# Named variants rendered for every post image: geometry and sorl options.
+THUMBNAIL_VARIANTS = {
+    "card": ("960x339", {"crop": "center", "upscale": True}),
+    "small": ("480x170", {"crop": "center", "upscale": True}),
+}
+MAX_ATTEMPTS = 3
+
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_UPLOAD_PIXELS = 40_000_000
+UPLOAD_FORMATS = {"JPEG", "PNG", "GIF", "WEBP"}
+# Stored images are re-encoded to fit into a square of this side.
+MAX_SIDE = 1600
+JPEG_QUALITY = 85
+CONTENT_PREFIX = "posts/sha256/"
+# Raw uploads land here before a job replaces them with the stored copy.
+UPLOAD_PREFIX = Post._meta.get_field("image").upload_to
+
+
+def validate_upload(upload):
+    """Refuse oversized or unexpected images without decoding the pixels.
+
+    Meant to run before forms.ImageField.to_python opens and verifies the
+    file: the byte size comes from the upload, format and dimensions from
+    the image header alone. Files Pillow cannot identify are left to the
+    field's own error.
+    """
+    if upload.size > MAX_UPLOAD_BYTES:
+        raise ValidationError(
+            "Файл больше %(limit)s МБ.",
+            code="file_too_large",
+            params={"limit": MAX_UPLOAD_BYTES // (1024 * 1024)},
+        )
+    try:
+        # Image.open reads the header only and leaves the upload open.
+        with Image.open(upload) as image:
+            image_format, (width, height) = image.format, image.size
+    except Image.DecompressionBombError:
+        # Pillow refuses the header itself, far above our own limit.
+        image_format, (width, height) = None, (MAX_UPLOAD_PIXELS + 1, 1)
+    except OSError:
+        return
+    finally:
+        upload.seek(0)
+    if width * height > MAX_UPLOAD_PIXELS:
+        raise ValidationError(
+            "Изображение больше %(limit)s мегапикселей.",
+            code="too_many_pixels",
+            params={"limit": MAX_UPLOAD_PIXELS // 1_000_000},
+        )
+    if image_format not in UPLOAD_FORMATS:
+        raise ValidationError(
+            "Загрузите изображение в формате JPEG, PNG, GIF или WebP.",
+            code="invalid_format",
+        )
+
+
+def enqueue(post, kind=ImageJob.REENCODE):
+    """Queue processing of the post image unless it is already queued"""
+    job, _ = ImageJob.objects.get_or_create(
+        post=post, kind=kind, status=ImageJob.PENDING
+    )
+    return job
+
+
+def claim(limit):
+    """Atomically move up to ``limit`` queued jobs to the running state.
+
+    Claiming is a conditional UPDATE per job, so concurrent workers on any
+    database never pick up the same job twice.
+    """
+    candidates = ImageJob.objects.filter(status=ImageJob.PENDING).order_by(
+        "created"
+    )
+    claimed = []
+    for pk in candidates.values_list("pk", flat=True)[:limit]:
+        taken = ImageJob.objects.filter(
+            pk=pk, status=ImageJob.PENDING
+        ).update(
+            status=ImageJob.RUNNING,
+            attempts=F("attempts") + 1,
+            updated=timezone.now(),
+        )
+        if taken:
+            claimed.append(pk)
+    return claimed
+
+
+def requeue_stale(older_than):
+    """Give jobs of crashed workers back to the queue"""
+    return ImageJob.objects.filter(
+        status=ImageJob.RUNNING, updated__lt=timezone.now() - older_than
+    ).update(status=ImageJob.PENDING)
+
+
+def generate_thumbnails(post):
+    if not post.image:
+        return {}
+    return {
+        name: get_thumbnail(post.image, geometry, **options).url
+        for name, (geometry, options) in THUMBNAIL_VARIANTS.items()
+    }
+
+
+def store(storage, content, extension):
+    """Save ``content`` under its hash, reusing an identical stored file"""
+    digest = hashlib.sha256(content).hexdigest()
+    name = f"{CONTENT_PREFIX}{digest[:2]}/{digest}{extension}"
+    if storage.exists(name):
+        return name
+    return storage.save(name, ContentFile(content))
+
+
+def release(storage, name):
+    """Delete a stored image unless a post still refers to it"""
+    if name and not Post.objects.filter(image=name).exists():
+        storage.delete(name)
+
+
+def discard(post, name):
+    """Drop what the image ``name`` replaced on ``post`` left behind.
+
+    A raw upload whose job never ran is released like a stored copy, and
+    pending jobs of a post without an image have nothing left to do.
+    """
+    if not post.image:
+        ImageJob.objects.filter(post=post, status=ImageJob.PENDING).delete()
+    if name and name.startswith(UPLOAD_PREFIX):
+        release(post.image.storage, name)
+
+
+def _flatten(image):
+    if image.mode in ("RGBA", "LA", "P", "PA"):
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, "white")
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return image.convert("RGB")
+
+
+def encode(source):
+    """The image in ``source`` as web-sized JPEG bytes without metadata"""
+    with Image.open(source) as image:
+        # Apply the EXIF orientation before the EXIF block is dropped.
+        image = _flatten(ImageOps.exif_transpose(image))
+    image.thumbnail((MAX_SIDE, MAX_SIDE))
+    output = io.BytesIO()
+    image.save(
+        output,
+        format="JPEG",
+        quality=JPEG_QUALITY,
+        optimize=True,
+        progressive=True,
+    )
+    return output.getvalue()
+
+
+def reencode(post):
+    """Replace the upload with its re-encoded copy, then make thumbnails"""
+    if not post.image:
+        return {}
+    original = post.image.name
+    if not original.startswith(CONTENT_PREFIX):
+        storage = post.image.storage
+        with post.image.open("rb") as source:
+            content = encode(source)
+        name = store(storage, content, ".jpg")
+        moved = Post.objects.filter(pk=post.pk, image=original).update(
+            image=name
+        )
+        if not moved:
+            # The post got another image meanwhile, with its own job.
+            release(storage, name)
+            release(storage, original)
+            return {}
+        post.image.name = name
+        release(storage, original)
+    return generate_thumbnails(post)
+
+
+HANDLERS = {
+    ImageJob.THUMBNAILS: generate_thumbnails,
+    ImageJob.REENCODE: reencode,
+}
+
+
+def run(job_id):
+    """Process a claimed job and record the outcome on it"""
+    job = ImageJob.objects.select_related("post").get(pk=job_id)
+    try:
+        result = HANDLERS[job.kind](job.post)
+    except Exception as error:
+        job.error = f"{type(error).__name__}: {error}"
+        job.status = (
+            ImageJob.FAILED
+            if job.attempts >= MAX_ATTEMPTS
+            else ImageJob.PENDING
+        )
+        job.save(update_fields=["error", "status", "updated"])
+        return False
+    # update() keeps edit_date untouched: the post itself did not change.
+    Post.objects.filter(
+        pk=job.post_id, image=job.post.image.name
+    ).update(thumbnails=result)
+    bump_version(FEED)
+    job.status = ImageJob.DONE
+    job.error = ""
+    job.save(update_fields=["error", "status", "updated"])
+    return True
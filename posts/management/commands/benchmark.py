@@ -0,0 +1,88 @@
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from posts import benchmark, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with synthetic content and report "
+        "latency percentiles, queries and response sizes of the posts views"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=500)
+        parser.add_argument("--groups", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=20000)
+        parser.add_argument("--comments", type=int, default=40000)
+        parser.add_argument("--follows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="Clear the cache before every request",
+        )
+        parser.add_argument(
+            "--output", help="Write the results to this JSON file"
+        )
+        parser.add_argument(
+            "--compare", help="Report changes against an earlier JSON run"
+        )
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        volumes = {
+            name: options[name]
+            for name in ("users", "groups", "posts", "comments", "follows")
+        }
+        with synthetic.scratch_database():
+            synthetic.seed(**volumes)
+            views = benchmark.run(
+                options["repeat"], options["warmup"], options["cold"]
+            )
+            result = {
+                "environment": benchmark.environment(),
+                "volumes": volumes,
+                "repeat": options["repeat"],
+                "cold": options["cold"],
+                "views": views,
+            }
+            try:
+                result["ratelimit"] = benchmark.measure_ratelimit()
+            except ImproperlyConfigured as error:
+                result["ratelimit"] = {"error": str(error)}
+
+        changes = {}
+        if options["compare"]:
+            with open(options["compare"]) as previous:
+                changes = benchmark.compare(
+                    json.load(previous)["views"], views
+                )
+        self.stdout.write(
+            f"{'view':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'queries':>9}{'bytes':>10}"
+        )
+        for name, view in views.items():
+            line = (
+                f"{name:<14}{view['p50_ms']:>10}{view['p95_ms']:>10}"
+                f"{view['p99_ms']:>10}{view['queries']:>9}{view['bytes']:>10}"
+            )
+            if name in changes and changes[name]["p50_ms"] is not None:
+                line += f"  p50 {changes[name]['p50_ms']:+.1%}"
+            self.stdout.write(line)
+        limit = result["ratelimit"]
+        if "error" in limit:
+            self.stdout.write(f"ratelimit check: {limit['error']}")
+        else:
+            self.stdout.write(
+                f"ratelimit check on {limit['backend']}: "
+                f"p50 {limit['p50_ms']} ms, p99 {limit['p99_ms']} ms"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(result, output, ensure_ascii=False, indent=2)
@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from posts import queryplans, synthetic
+from posts.models import Follow
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with synthetic content, record EXPLAIN "
+        "plans and timings of every feed view and fail if a hot query "
+        "falls back to a sequential scan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--groups", type=int, default=50)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--comments", type=int, default=100000)
+        parser.add_argument("--follows", type=int, default=20000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--output", help="Write the full report to this JSON file"
+        )
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        with synthetic.scratch_database():
+            synthetic.seed(
+                users=options["users"],
+                groups=options["groups"],
+                posts=options["posts"],
+                comments=options["comments"],
+                follows=options["follows"],
+            )
+            report = self.collect_reports(options["repeat"])
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, ensure_ascii=False, indent=2)
+
+        regressions = []
+        for name, view in report.items():
+            scans = sorted(
+                {t for q in view["queries"] for t in q["sequential_scans"]}
+            )
+            self.stdout.write(
+                f"{name:<14} {view['median_ms']:>9} ms "
+                f"{len(view['queries']):>3} queries"
+                + (f"  SEQ SCAN: {', '.join(scans)}" if scans else "")
+            )
+            if scans:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(
+                "Sequential scans in: " + ", ".join(regressions)
+            )
+
+    def collect_reports(self, repeat):
+        reader, group, post = synthetic.busiest_targets()
+        client = Client()
+        client.force_login(reader)
+        self.stdout.write(
+            f"Reader follows {Follow.objects.filter(user=reader).count()} "
+            "authors"
+        )
+        return {
+            name: queryplans.check_view(client, url, repeat)
+            for name, url in queryplans.view_targets(
+                reader, group, post
+            ).items()
+        }
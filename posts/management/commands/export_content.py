@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream groups, posts, comments and follows into a directory of "
+        "NDJSON or CSV files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument(
+            "--format", choices=transfer.FORMATS, default="ndjson"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=transfer.BATCH_SIZE
+        )
+        parser.add_argument(
+            "--media",
+            action="store_true",
+            help="Copy post images into the export as well",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted export from its checkpoint",
+        )
+
+    def handle(self, *args, **options):
+        transfer.export_content(
+            options["directory"],
+            fmt=options["format"],
+            batch_size=options["batch_size"],
+            media=options["media"],
+            resume=options["resume"],
+            log=self.stdout.write,
+        )
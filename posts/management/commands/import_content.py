@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = "Load a directory written by export_content with bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory")
+        parser.add_argument(
+            "--batch-size", type=int, default=transfer.BATCH_SIZE
+        )
+        parser.add_argument(
+            "--media",
+            action="store_true",
+            help="Restore bundled post images into the media storage",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import from its checkpoint",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            transfer.import_content(
+                options["directory"],
+                batch_size=options["batch_size"],
+                media=options["media"],
+                resume=options["resume"],
+                log=self.stdout.write,
+            )
+        except (FileNotFoundError, ValueError) as error:
+            raise CommandError(error)
@@ -0,0 +1,61 @@
+import datetime as dt
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from posts import images
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        return images.run(job_id)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Process queued post image jobs with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit as soon as the queue is empty",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to sleep while the queue is empty",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="Requeue jobs left running by a dead worker after N seconds",
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        stale_after = dt.timedelta(seconds=options["stale_after"])
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # A single worker runs jobs in this thread and connection.
+            run = pool.map if workers > 1 else map
+            task = _run_in_thread if workers > 1 else images.run
+            while True:
+                images.requeue_stale(stale_after)
+                job_ids = images.claim(workers * 2)
+                if not job_ids:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+                for ok in run(task, job_ids):
+                    done += ok
+                    failed += not ok
+        self.stdout.write(f"Processed {done} image jobs, {failed} failed")
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from posts import benchmark, synthetic
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with synthetic content and report "
+        "where rendering the templates of the posts views spends its time"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--groups", type=int, default=10)
+        parser.add_argument("--posts", type=int, default=2000)
+        parser.add_argument("--comments", type=int, default=4000)
+        parser.add_argument("--follows", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--limit", type=int, default=15, help="Nodes shown per view"
+        )
+        parser.add_argument(
+            "--cold",
+            action="store_true",
+            help="Clear the cache before every request",
+        )
+
+    @override_settings(DEBUG=False)
+    def handle(self, *args, **options):
+        volumes = {
+            name: options[name]
+            for name in ("users", "groups", "posts", "comments", "follows")
+        }
+        repeat = options["repeat"]
+        with synthetic.scratch_database():
+            synthetic.seed(**volumes)
+            profiles = benchmark.profile_templates(repeat, options["cold"])
+
+        for name, profile in profiles.items():
+            self.stdout.write(
+                f"\n{name}\n{'template':<34}{'node':<30}"
+                f"{'calls':>7}{'total ms':>10}{'own ms':>10}"
+            )
+            for template, node, calls, total, own in profile.top(
+                options["limit"]
+            ):
+                self.stdout.write(
+                    f"{template[-33:]:<34}{node[:29]:<30}"
+                    f"{calls / repeat:>7.1f}{total * 1000 / repeat:>10.3f}"
+                    f"{own * 1000 / repeat:>10.3f}"
+                )
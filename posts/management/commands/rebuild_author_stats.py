@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import timeline
+from posts.models import AuthorStats
+
+User = get_user_model()
+
+FIELDS = ["posts_count", "followers_count", "following_count"]
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized author counters from Post and Follow"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report authors whose counters drifted",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        created = updated = last_pk = 0
+        while True:
+            author_ids = list(
+                User.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not author_ids:
+                break
+            last_pk = author_ids[-1]
+
+            actual = AuthorStats.collect(author_ids)
+            stored = AuthorStats.objects.in_bulk(author_ids)
+            missing, drifted = [], []
+            for pk, counters in actual.items():
+                stats = stored.get(pk)
+                if stats is None:
+                    missing.append(AuthorStats(author_id=pk, **counters))
+                elif any(getattr(stats, f) != counters[f] for f in FIELDS):
+                    for field, value in counters.items():
+                        setattr(stats, field, value)
+                    drifted.append(stats)
+
+            created += len(missing)
+            updated += len(drifted)
+            if options["dry_run"]:
+                continue
+            with transaction.atomic():
+                AuthorStats.objects.bulk_create(missing, ignore_conflicts=True)
+                AuthorStats.objects.bulk_update(drifted, FIELDS)
+            # Counts that crossed the fan-out threshold switch the authors.
+            timeline.rebalance(author_ids)
+
+        verb = "Would fix" if options["dry_run"] else "Fixed"
+        self.stdout.write(
+            f"{verb} {updated} drifted and {created} missing author counters"
+        )
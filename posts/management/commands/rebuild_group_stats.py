@@ -0,0 +1,83 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts.models import Comment, Group, GroupActivity, GroupStats, Post
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily group rollups from Post and Comment"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def scan(self, queryset, batch_size):
+        """Stream (day, author) of every row without caching the queryset"""
+        rows = queryset.values_list("created", "author").iterator(
+            chunk_size=batch_size
+        )
+        for created, author_id in rows:
+            yield timezone.localdate(created), author_id
+
+    def rebuild(self, group_id, batch_size):
+        """Recount one group and swap its rollup rows in one transaction"""
+        # Memory follows the rollup rows of a single group only.
+        posts, comments, actions = Counter(), Counter(), Counter()
+        sources = [
+            (
+                posts,
+                Post.objects.filter(group_id=group_id).annotate(
+                    created=F("pub_date")
+                ),
+            ),
+            (comments, Comment.objects.filter(post__group_id=group_id)),
+        ]
+        for counter, queryset in sources:
+            for day, author_id in self.scan(queryset, batch_size):
+                counter[day] += 1
+                actions[day, author_id] += 1
+
+        authors = Counter(day for day, _ in actions)
+        stats = [
+            GroupStats(
+                group_id=group_id,
+                day=day,
+                posts_count=posts[day],
+                comments_count=comments[day],
+                authors_count=count,
+            )
+            for day, count in authors.items()
+        ]
+        activity = [
+            GroupActivity(
+                group_id=group_id, day=day, author_id=author_id, actions=count
+            )
+            for (day, author_id), count in actions.items()
+        ]
+        with transaction.atomic():
+            GroupActivity.objects.filter(group_id=group_id).delete()
+            GroupStats.objects.filter(group_id=group_id).delete()
+            GroupStats.objects.bulk_create(stats, batch_size=batch_size)
+            GroupActivity.objects.bulk_create(
+                activity, batch_size=batch_size
+            )
+        return len(stats), sum(posts.values()), sum(comments.values())
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        days = posts = comments = 0
+        # Group ids are few; each group gets its own short transaction.
+        for group_id in Group.objects.order_by("pk").values_list(
+            "pk", flat=True
+        ):
+            counts = self.rebuild(group_id, batch_size)
+            days += counts[0]
+            posts += counts[1]
+            comments += counts[2]
+        self.stdout.write(
+            f"Rebuilt {days} group days from {posts} "
+            f"posts and {comments} comments"
+        )
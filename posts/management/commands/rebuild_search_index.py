@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts import search
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of posts and comments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write("The database has no full-text index to fill")
+            return
+        batch_size = options["batch_size"]
+        sources = [
+            (search.POST, Post.objects.values_list("pk", "pk", "text")),
+            (
+                search.COMMENT,
+                Comment.objects.values_list("pk", "post_id", "text"),
+            ),
+        ]
+        with transaction.atomic():
+            search.clear()
+            total = 0
+            for kind, rows in sources:
+                batch = []
+                for pk, post_id, text in rows.iterator(chunk_size=batch_size):
+                    batch.append((kind, pk, post_id, text))
+                    if len(batch) >= batch_size:
+                        search.index_many(batch)
+                        total += len(batch)
+                        batch = []
+                search.index_many(batch)
+                total += len(batch)
+        self.stdout.write(f"Indexed {total} documents")
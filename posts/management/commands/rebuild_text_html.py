@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from posts import markup
+from posts.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Store the HTML rendition of post and comment text"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Render every row, not only those without a rendition",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for model in (Post, Comment):
+            rows = model.objects.order_by("pk").only("pk", "text")
+            if not options["all"]:
+                rows = rows.filter(text_html="")
+            rendered = last_pk = 0
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for obj in batch:
+                    obj.text_html = markup.render(obj.text)
+                # bulk_update() skips save(): edit_date stays as it was.
+                model.objects.bulk_update(batch, ["text_html"])
+                rendered += len(batch)
+            self.stdout.write(
+                f"Rendered {rendered} {model._meta.verbose_name_plural}"
+            )
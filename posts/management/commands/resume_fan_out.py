@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Push the posts of pulled authors whose follower count fell to "
+        "TIMELINE_FANOUT_RESUME_RATIO of the threshold to their followers "
+        "and fan them out again"
+    )
+
+    def handle(self, *args, **options):
+        resumed = 0
+        for author_id in list(timeline.resumable_authors()):
+            resumed += timeline.resume_fan_out(author_id)
+        self.stdout.write(f"Resumed fan-out of {resumed} authors")
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+SQLITE = [
+    "CREATE VIRTUAL TABLE posts_search USING fts5("
+    "post_id UNINDEXED, document, tokenize = 'unicode61 remove_diacritics 2')",
+]
+POSTGRESQL = [
+    "CREATE TABLE posts_search ("
+    "id bigint PRIMARY KEY, post_id integer NOT NULL, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX posts_search_document_idx "
+    "ON posts_search USING GIN (document)",
+    "CREATE INDEX posts_search_post_id_idx ON posts_search (post_id)",
+]
+
+
+def create_index(apps, schema_editor):
+    statements = {"sqlite": SQLITE, "postgresql": POSTGRESQL}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute("DROP TABLE posts_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0012_image_jobs"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
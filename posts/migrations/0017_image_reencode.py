@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_group_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagejob',
+            name='kind',
+            field=models.CharField(choices=[('thumbnails', 'Миниатюры'), ('reencode', 'Перекодирование')], max_length=20, verbose_name='Задача'),
+        ),
+    ]
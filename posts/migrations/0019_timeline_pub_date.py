@@ -0,0 +1,51 @@
+# Generated by Django 3.1.7 on 2026-10-18 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+def copy_pub_dates(apps, schema_editor):
+    Post = apps.get_model("posts", "Post")
+    TimelineEntry = apps.get_model("posts", "TimelineEntry")
+    TimelineEntry.objects.update(
+        pub_date=Subquery(
+            Post.objects.filter(pk=OuterRef("post")).values("pub_date")
+        )
+    )
+
+
+def flag_celebrities(apps, schema_editor):
+    AuthorStats = apps.get_model("posts", "AuthorStats")
+    threshold = getattr(settings, "TIMELINE_FANOUT_THRESHOLD", 5000)
+    AuthorStats.objects.filter(followers_count__gt=threshold).update(
+        celebrity=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_text_html'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorstats',
+            name='celebrity',
+            field=models.BooleanField(default=False, help_text='Записи не рассылаются подписчикам, а добавляются в их ленты при чтении', verbose_name='Записи подтягиваются при чтении'),
+        ),
+        migrations.AddField(
+            model_name='timelineentry',
+            name='pub_date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата публикации'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_pub_dates, migrations.RunPython.noop),
+        migrations.RunPython(flag_celebrities, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-post'], name='timeline_user_pub_date_idx'),
+        ),
+    ]
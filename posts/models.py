@@ -1,13 +1,45 @@
+import datetime as dt
+
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import markup
 
 User = get_user_model()
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Load everything post_item.html needs in a single query"""
+        return self.select_related("author", "group")
+
+    def refresh_comment_counts(self):
+        """Recount the comments of the selected posts in one UPDATE"""
+        comment_count = (
+            Comment.objects.filter(post=OuterRef("pk"))
+            .order_by()
+            .values("post")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return self.update(
+            comment_count=Coalesce(Subquery(comment_count), 0)
+        )
+
+
 class Post(models.Model):
     text = models.TextField("Текст публикации", help_text="Текст публикации")
+    text_html = models.TextField(
+        "Текст публикации в HTML",
+        blank=True,
+        editable=False,
+        help_text="Готовая к выводу разметка текста",
+    )
     pub_date = models.DateTimeField(
         "Дата публикации", auto_now_add=True, help_text="Дата публикации"
     )
@@ -33,9 +65,38 @@ class Post(models.Model):
         help_text="Группа для публикации",
     )
     image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    thumbnails = models.JSONField(
+        "Миниатюры",
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Адреса заранее подготовленных миниатюр изображения",
+    )
+    comment_count = models.PositiveIntegerField(
+        "Комментариев",
+        default=0,
+        editable=False,
+        help_text="Число комментариев, обновляется вместе с ними",
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ["-pub_date"]
+        # Back the (pub_date, id) keyset of every feed.
+        indexes = [
+            models.Index(
+                fields=["pub_date", "id"], name="post_pub_date_idx"
+            ),
+            models.Index(
+                fields=["author", "pub_date", "id"],
+                name="post_author_pub_date_idx",
+            ),
+            models.Index(
+                fields=["group", "pub_date", "id"],
+                name="post_group_pub_date_idx",
+            ),
+        ]
 
     def __str__(self):
         fragment = (
@@ -45,11 +106,80 @@ class Post(models.Model):
         author = self.author
         return f"{author} - {date} - {fragment}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super().from_db(db, field_names, values)
+        # Lets the group rollup notice a post moving between groups.
+        post._loaded_group_id = post.__dict__.get("group_id")
+        return post
+
+    def save(self, *args, **kwargs):
+        self.text_html = markup.render(self.text)
+        update_fields = kwargs.get("update_fields")
+        # comment_count only moves through F() updates: writing back the
+        # value loaded with the instance would undo concurrent comments.
+        if not self._state.adding and update_fields is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "comment_count"
+            ]
+        elif update_fields is not None and "text" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "text_html"}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_comment_count(cls, post_id, delta):
+        cls.objects.filter(pk=post_id).update(
+            comment_count=Greatest(F("comment_count") + delta, 0)
+        )
+
 
 @receiver(post_delete, sender=Post)
 def post_image_delete(sender, instance, **kwargs):
     """Delete image from server if corresponding Post entry is deleted"""
-    instance.image.delete(False)
+    # Re-encoded images are shared by every post with the same content.
+    if not Post.objects.filter(image=instance.image.name).exists():
+        instance.image.delete(False)
+
+
+class GroupQuerySet(models.QuerySet):
+    def with_activity(self, days=7):
+        """Annotate posts, comments and authors of the last ``days`` days.
+
+        Every figure comes from the daily rollups, so the cost follows
+        the number of groups and days rather than the number of posts.
+        """
+        since = timezone.localdate() - dt.timedelta(days=days - 1)
+        daily = (
+            GroupStats.objects.filter(group=OuterRef("pk"), day__gte=since)
+            .order_by()
+            .values("group")
+        )
+        authors = (
+            GroupActivity.objects.filter(group=OuterRef("pk"), day__gte=since)
+            .order_by()
+            .values("group")
+            .annotate(count=Count("author", distinct=True))
+            .values("count")
+        )
+        return self.annotate(
+            recent_posts=Coalesce(
+                Subquery(
+                    daily.annotate(total=Sum("posts_count")).values("total")
+                ),
+                0,
+            ),
+            recent_comments=Coalesce(
+                Subquery(
+                    daily.annotate(total=Sum("comments_count")).values(
+                        "total"
+                    )
+                ),
+                0,
+            ),
+            recent_authors=Coalesce(Subquery(authors), 0),
+        )
 
 
 class Group(models.Model):
@@ -57,6 +187,8 @@ class Group(models.Model):
     slug = models.SlugField(unique=True, max_length=20)
     description = models.TextField()
 
+    objects = GroupQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -77,12 +209,40 @@ class Comment(models.Model):
         help_text="Автор публикации",
     )
     text = models.TextField("Текст комментария", help_text="Текст комментария")
+    text_html = models.TextField(
+        "Текст комментария в HTML",
+        blank=True,
+        editable=False,
+        help_text="Готовая к выводу разметка текста",
+    )
     created = models.DateTimeField(
         "Дата комментирования",
         auto_now_add=True,
         help_text="Дата комментирования",
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["post", "created", "id"],
+                name="comment_post_created_idx",
+            )
+        ]
+
+    def save(self, *args, **kwargs):
+        self.text_html = markup.render(self.text)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "text" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "text_html"}
+        super().save(*args, **kwargs)
+
+
+def _returns_from_upsert(connection):
+    """Whether INSERT ... ON CONFLICT DO NOTHING RETURNING is available"""
+    if connection.vendor == "sqlite":
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return connection.vendor == "postgresql"
+
 
 class Follow(models.Model):
     user = models.ForeignKey(
@@ -98,6 +258,338 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ["user", "author"]
+        # The unique index covers lookups by user; this one by author.
+        indexes = [
+            models.Index(fields=["author", "user"], name="follow_author_idx")
+        ]
 
     def __str__(self):
         return f"{self.user.username} follows {self.author.username}"
+
+    @classmethod
+    def add(cls, user_id, author_id):
+        """Follow an author with one INSERT, return whether it was new.
+
+        A concurrent follow of the same author trips unique_together;
+        that one is taken as already following instead of as an error.
+        """
+        if user_id == author_id:
+            return False
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, author_id=author_id)
+        except IntegrityError:
+            return False
+        return True
+
+    @classmethod
+    def add_many(cls, user_id, author_ids):
+        """Follow several authors with one INSERT, return the new ones.
+
+        The new ones are the rows the INSERT itself reports back, so of
+        two concurrent calls following the same author only one counts
+        it. Unlike add() this sends no signals: the caller backfills the
+        timeline and bumps the follow version. The counters are recounted
+        rather than shifted, so a concurrent follow cannot skew them.
+        """
+        author_ids = sorted(set(author_ids) - {user_id})
+        if not author_ids:
+            return []
+        connection = connections[router.db_for_write(cls)]
+        if _returns_from_upsert(connection):
+            added = cls._insert_returning(connection, user_id, author_ids)
+        else:
+            added = cls._insert_and_reselect(connection, user_id, author_ids)
+        if added:
+            AuthorStats.recount_follows([user_id, *added])
+        return added
+
+    @classmethod
+    def _insert_returning(cls, connection, user_id, author_ids):
+        quote = connection.ops.quote_name
+        rows = ", ".join(["(%s, %s)"] * len(author_ids))
+        params = [value for pk in author_ids for value in (user_id, pk)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(cls._meta.db_table)} "
+                f"({quote('user_id')}, {quote('author_id')}) VALUES {rows} "
+                f"ON CONFLICT DO NOTHING RETURNING {quote('author_id')}",
+                params,
+            )
+            return sorted(pk for pk, in cursor.fetchall())
+
+    @classmethod
+    def _insert_and_reselect(cls, connection, user_id, author_ids):
+        # Rows past the highest id before the INSERT are taken as its own.
+        # A concurrent call may claim the same row, which the timeline
+        # backfill tolerates since it skips entries that already exist.
+        with transaction.atomic(using=connection.alias):
+            follows = cls.objects.using(connection.alias)
+            last = follows.aggregate(last=models.Max("pk"))["last"] or 0
+            follows.bulk_create(
+                [cls(user_id=user_id, author_id=pk) for pk in author_ids],
+                ignore_conflicts=True,
+            )
+            return sorted(
+                follows.filter(
+                    user_id=user_id, author_id__in=author_ids, pk__gt=last
+                ).values_list("author_id", flat=True)
+            )
+
+
+class AuthorStats(models.Model):
+    """Denormalized author counters shown on the author card"""
+
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="stats",
+        verbose_name="Автор",
+    )
+    posts_count = models.PositiveIntegerField("Записей", default=0)
+    followers_count = models.PositiveIntegerField("Подписчиков", default=0)
+    following_count = models.PositiveIntegerField("Подписок", default=0)
+    celebrity = models.BooleanField(
+        "Записи подтягиваются при чтении",
+        default=False,
+        help_text="Записи не рассылаются подписчикам, а добавляются в их "
+        "ленты при чтении",
+    )
+
+    def __str__(self):
+        return f"{self.author_id}: {self.posts_count} posts"
+
+    @classmethod
+    def collect(cls, author_ids):
+        """Count the real values for a batch of authors, three queries total"""
+        counters = {
+            pk: {"posts_count": 0, "followers_count": 0, "following_count": 0}
+            for pk in author_ids
+        }
+        sources = [
+            ("posts_count", Post.objects, "author"),
+            ("followers_count", Follow.objects, "author"),
+            ("following_count", Follow.objects, "user"),
+        ]
+        for name, manager, field in sources:
+            rows = (
+                manager.filter(**{f"{field}__in": author_ids})
+                .order_by()
+                .values(field)
+                .annotate(total=Count("pk"))
+                .values_list(field, "total")
+            )
+            for pk, total in rows:
+                counters[pk][name] = total
+        return counters
+
+    @classmethod
+    def for_author(cls, author):
+        """Fetch the counters, materializing them on first access"""
+        stats = cls.objects.filter(author=author).first()
+        if stats is None:
+            stats, _ = cls.objects.get_or_create(
+                author=author, defaults=cls.collect([author.pk])[author.pk]
+            )
+        return stats
+
+    @classmethod
+    def recount_follows(cls, author_ids):
+        """Recount both follow counters of a batch of authors, one UPDATE"""
+
+        def count(field):
+            return Subquery(
+                Follow.objects.filter(**{field: OuterRef("author")})
+                .order_by()
+                .values(field)
+                .annotate(total=Count("pk"))
+                .values("total")
+            )
+
+        cls.objects.filter(author_id__in=author_ids).update(
+            followers_count=Coalesce(count("author"), 0),
+            following_count=Coalesce(count("user"), 0),
+        )
+
+    @classmethod
+    def bump(cls, author_id, field, delta):
+        """Shift a counter with a single UPDATE, never going below zero"""
+        if author_id is None:
+            return
+        cls.objects.filter(author_id=author_id).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+
+
+class TimelineEntry(models.Model):
+    """A post pushed into a follower's home timeline on write"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="timeline",
+        verbose_name="Читатель",
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name="Публикация",
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Автор",
+    )
+    # A copy of Post.pub_date: the feed is a range over this index alone.
+    pub_date = models.DateTimeField("Дата публикации")
+
+    class Meta:
+        unique_together = ["user", "post"]
+        indexes = [
+            models.Index(fields=["user", "author"]),
+            models.Index(
+                fields=["user", "-pub_date", "-post"],
+                name="timeline_user_pub_date_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} <- {self.post_id}"
+
+
+class ImageJob(models.Model):
+    """Image processing task waiting for the process_image_jobs worker"""
+
+    THUMBNAILS = "thumbnails"
+    REENCODE = "reencode"
+    KINDS = [(THUMBNAILS, "Миниатюры"), (REENCODE, "Перекодирование")]
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [
+        (PENDING, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Готово"),
+        (FAILED, "Ошибка"),
+    ]
+
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name="image_jobs",
+        verbose_name="Публикация",
+    )
+    kind = models.CharField("Задача", max_length=20, choices=KINDS)
+    status = models.CharField(
+        "Состояние", max_length=10, choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField("Попыток", default=0)
+    error = models.TextField("Ошибка", blank=True)
+    created = models.DateTimeField("Создана", auto_now_add=True)
+    updated = models.DateTimeField("Обновлена", auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created"])]
+
+    def __str__(self):
+        return f"{self.kind} for post {self.post_id}: {self.status}"
+
+
+def _add(model, keys, **deltas):
+    """Add ``deltas`` to the counters of a rollup row, True if created"""
+    changes = {
+        field: Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+        if delta
+    }
+    if not changes or model.objects.filter(**keys).update(**changes):
+        return False
+    if any(delta < 0 for delta in deltas.values()):
+        # Nothing to take away from: the row predates the rollup.
+        return False
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**changes)
+        return False
+    return True
+
+
+class GroupActivity(models.Model):
+    """Posts and comments of one author in a group on one day"""
+
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Группа",
+    )
+    day = models.DateField("День")
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name="Автор",
+    )
+    actions = models.PositiveIntegerField("Записей и комментариев", default=0)
+
+    class Meta:
+        unique_together = ["group", "day", "author"]
+
+    def __str__(self):
+        return f"{self.group_id} {self.day} {self.author_id}: {self.actions}"
+
+
+class GroupStats(models.Model):
+    """Daily activity rollup of a group, kept current by signals"""
+
+    group = models.ForeignKey(
+        Group,
+        on_delete=models.CASCADE,
+        related_name="daily_stats",
+        verbose_name="Группа",
+    )
+    day = models.DateField("День")
+    posts_count = models.PositiveIntegerField("Записей", default=0)
+    comments_count = models.PositiveIntegerField("Комментариев", default=0)
+    authors_count = models.PositiveIntegerField("Авторов", default=0)
+
+    class Meta:
+        unique_together = ["group", "day"]
+
+    def __str__(self):
+        return f"{self.group_id} {self.day}: {self.posts_count} posts"
+
+    @classmethod
+    def record(cls, group_id, when, author_id, posts=0, comments=0):
+        """Count ``posts`` and ``comments`` (or remove them if negative).
+
+        ``when`` is the day itself or an aware datetime within it.
+        """
+        if group_id is None:
+            return
+        if isinstance(when, dt.datetime):
+            when = timezone.localdate(when)
+        keys = {"group_id": group_id, "day": when}
+        activity = {**keys, "author_id": author_id}
+        authors = 0
+        if _add(GroupActivity, activity, actions=posts + comments):
+            authors = 1
+        elif posts + comments < 0:
+            deleted, _ = GroupActivity.objects.filter(
+                **activity, actions=0
+            ).delete()
+            authors = -deleted
+        _add(
+            cls,
+            keys,
+            posts_count=posts,
+            comments_count=comments,
+            authors_count=authors,
+        )
@@ -0,0 +1,161 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+
+POSTS_PER_PAGE = 10
+COMMENTS_PER_PAGE = 50
+# Bounds of the 64-bit keys every supported database uses.
+MIN_INT, MAX_INT = -(2 ** 63), 2 ** 63 - 1
+
+
+class CursorPaginator:
+    """Keyset paginator seeking by the ordering fields instead of OFFSET.
+
+    Pages are addressed by opaque cursors holding the ordering values of
+    the first/last row of the neighbouring page, so every page costs one
+    indexed range query no matter how deep it is. A regular ``Paginator``
+    is kept in ``self.paginator`` for templates and code that want the
+    totals; its COUNT(*) only runs if somebody actually asks for them.
+    """
+
+    def __init__(self, object_list, per_page, ordering=("-pub_date", "-id")):
+        self.ordering = ordering
+        self.object_list = object_list.order_by(*ordering)
+        self.per_page = per_page
+        self.paginator = Paginator(self.object_list, per_page)
+
+    @staticmethod
+    def _reverse(name):
+        return name[1:] if name.startswith("-") else "-" + name
+
+    def _fields(self):
+        return [name.lstrip("-") for name in self.ordering]
+
+    def _values(self, obj):
+        return [getattr(obj, name) for name in self._fields()]
+
+    def encode(self, direction, number, obj):
+        values = [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in self._values(obj)
+        ]
+        payload = json.dumps([direction, number, values]).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+    def decode(self, cursor):
+        padded = cursor + "=" * (-len(cursor) % 4)
+        try:
+            direction, number, values = json.loads(
+                base64.urlsafe_b64decode(padded.encode())
+            )
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise ValueError("Malformed cursor")
+        if (
+            direction not in ("next", "prev")
+            or type(number) is not int
+            or not isinstance(values, list)
+            or len(values) != len(self.ordering)
+        ):
+            raise ValueError("Malformed cursor")
+        opts = self.object_list.model._meta
+        fields = [opts.get_field(name) for name in self._fields()]
+        try:
+            values = [
+                field.to_python(value) for field, value in zip(fields, values)
+            ]
+            for value in values:
+                # Out-of-range integers would fail in the database driver.
+                if value is None or (
+                    isinstance(value, int) and not MIN_INT <= value <= MAX_INT
+                ):
+                    raise ValidationError("Bad cursor value")
+        except (TypeError, OverflowError, ValidationError):
+            raise ValueError("Malformed cursor")
+        return direction, max(number, 1), values
+
+    def _seek(self, values, backwards):
+        """Build ``(a, b) > (x, y)`` in ordering terms as a Q object"""
+        fields = self._fields()
+        query = Q()
+        for position, name in enumerate(self.ordering):
+            descending = name.startswith("-") != backwards
+            lookup = "__lt" if descending else "__gt"
+            step = dict(zip(fields[:position], values[:position]))
+            step[fields[position] + lookup] = values[position]
+            query |= Q(**step)
+        return query
+
+    def rows_after(self, values, backwards, limit):
+        """Up to ``limit`` rows past ``values``, nearest first.
+
+        Past means after in the ordering, or before when ``backwards``;
+        without ``values`` the rows start at the corresponding end.
+        """
+        queryset = self.object_list
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, backwards))
+        if backwards:
+            queryset = queryset.order_by(
+                *[self._reverse(name) for name in self.ordering]
+            )
+        return list(queryset[:limit])
+
+    def get_page(self, cursor=None):
+        try:
+            direction, number, values = self.decode(cursor or "")
+        except ValueError:
+            direction, number, values = "next", 1, None
+        backwards = direction == "prev"
+        rows = self.rows_after(values, backwards, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if backwards:
+            rows.reverse()
+            has_previous, has_next = has_more, True
+        else:
+            has_previous, has_next = values is not None, has_more
+
+        page = Page(rows, number, self.paginator)
+        page.next_cursor = page.previous_cursor = None
+        if rows and has_next:
+            page.next_cursor = self.encode("next", number + 1, rows[-1])
+        if rows and has_previous:
+            page.previous_cursor = self.encode(
+                "prev", max(number - 1, 1), rows[0]
+            )
+        return page
+
+    def get_window(self, cursor=None):
+        """Rows after a "next" cursor as a QuerySet, and the next cursor.
+
+        Forward-only counterpart of get_page() for incrementally loaded
+        lists: the rows stay a (fetched) QuerySet, and whether more rows
+        follow is one EXISTS query that only runs after a full window.
+        """
+        try:
+            direction, number, values = self.decode(cursor or "")
+        except ValueError:
+            direction, number, values = "next", 1, None
+        queryset = self.object_list
+        if values is not None and direction == "next":
+            queryset = queryset.filter(self._seek(values, False))
+        else:
+            number = 1
+        rows = queryset[: self.per_page]
+        next_cursor = None
+        if len(rows) == self.per_page:
+            last = rows[self.per_page - 1]
+            seek = self._seek(self._values(last), False)
+            if self.object_list.filter(seek).exists():
+                next_cursor = self.encode("next", number + 1, last)
+        return rows, next_cursor
+
+
+def paginate(request, object_list, per_page=POSTS_PER_PAGE):
+    """Return the page of ``object_list`` addressed by ``?cursor=``"""
+    paginator = CursorPaginator(object_list, per_page)
+    return paginator.get_page(request.GET.get("cursor"))
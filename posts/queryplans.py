@@ -0,0 +1,91 @@
+"""EXPLAIN-based checks that the feed queries stay on indexes"""
+import re
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Post
+from .paginator import POSTS_PER_PAGE, CursorPaginator
+
+# Tables large enough that a full scan of them is a regression.
+HOT_TABLES = {
+    "posts_post",
+    "posts_comment",
+    "posts_follow",
+    "posts_timelineentry",
+}
+
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$")
+_POSTGRES_SCAN = re.compile(r"Seq Scan on (\w+)")
+
+
+def explain(sql):
+    """Plan of ``sql`` as a list of text lines"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute(f"EXPLAIN {sql}")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def sequential_scans(plan):
+    """Hot tables the plan reads in full instead of through an index"""
+    pattern = _SQLITE_SCAN if connection.vendor == "sqlite" else _POSTGRES_SCAN
+    tables = set()
+    for line in plan:
+        match = pattern.search(line.strip())
+        if match and match.group(1) in HOT_TABLES:
+            tables.add(match.group(1))
+    return tables
+
+
+def view_targets(user, group, post):
+    """URLs of every feed and post page worth checking, by name"""
+    middle = Post.objects.order_by("-pub_date", "-id")[
+        Post.objects.count() // 2
+    ]
+    paginator = CursorPaginator(Post.objects.all(), POSTS_PER_PAGE)
+    deep_cursor = paginator.encode("next", 2, middle)
+    return {
+        "index": reverse("index"),
+        "index_deep_page": f"{reverse('index')}?cursor={deep_cursor}",
+        "group_posts": reverse("group_posts", args=[group.slug]),
+        "profile": reverse("profile", args=[post.author.username]),
+        "post_view": reverse(
+            "post_view", args=[post.author.username, post.pk]
+        ),
+        "follow_index": reverse("follow_index"),
+    }
+
+
+def check_view(client, url, repeat=5):
+    """Time ``url`` and explain every SELECT it issues"""
+    timings = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append(time.perf_counter() - start)
+    report = {
+        "url": url,
+        "status": response.status_code,
+        "median_ms": round(sorted(timings)[len(timings) // 2] * 1000, 2),
+        "queries": [],
+    }
+    for query in queries.captured_queries:
+        sql = query["sql"]
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = explain(sql)
+        report["queries"].append(
+            {
+                "sql": sql,
+                "time": query["time"],
+                "plan": plan,
+                "sequential_scans": sorted(sequential_scans(plan)),
+            }
+        )
+    return report
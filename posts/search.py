@@ -0,0 +1,153 @@
+"""Full-text search over posts and their comments.
+
+Posts and comments share one index table, ``posts_search``: an FTS5
+virtual table on SQLite and a tsvector column with a GIN index on
+PostgreSQL (created by migration 0013). Rows are keyed by an id that
+encodes the kind of the indexed object, so updates and deletes are
+primary-key operations on both backends. Signals keep the index in sync;
+rebuild_search_index fills it for existing data.
+"""
+import re
+
+from django.db import connection
+
+TABLE = "posts_search"
+POST, COMMENT = 0, 1
+# Text search configuration used on PostgreSQL.
+CONFIG = "russian"
+MAX_RESULTS = 1000
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def _row_id(kind, pk):
+    return pk * 2 + kind
+
+
+def is_supported():
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def _fts5_query(text):
+    """Quote every word so user input can never be FTS5 syntax"""
+    return " ".join(f'"{term}"' for term in _TERM.findall(text))
+
+
+def index(kind, pk, post_id, text):
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute(
+                f"INSERT OR REPLACE INTO {TABLE} (rowid, post_id, document) "
+                "VALUES (%s, %s, %s)",
+                [_row_id(kind, pk), post_id, text],
+            )
+        else:
+            cursor.execute(
+                f"INSERT INTO {TABLE} (id, post_id, document) "
+                "VALUES (%s, %s, to_tsvector(%s, %s)) "
+                "ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document",
+                [_row_id(kind, pk), post_id, CONFIG, text],
+            )
+
+
+def index_many(rows):
+    """Bulk version of index() taking (kind, pk, post_id, text) tuples"""
+    if not is_supported() or not rows:
+        return
+    if connection.vendor == "sqlite":
+        sql = (
+            f"INSERT OR REPLACE INTO {TABLE} (rowid, post_id, document) "
+            "VALUES (%s, %s, %s)"
+        )
+        params = [
+            (_row_id(kind, pk), post_id, text)
+            for kind, pk, post_id, text in rows
+        ]
+    else:
+        sql = (
+            f"INSERT INTO {TABLE} (id, post_id, document) "
+            "VALUES (%s, %s, to_tsvector(%s, %s)) "
+            "ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document"
+        )
+        params = [
+            (_row_id(kind, pk), post_id, CONFIG, text)
+            for kind, pk, post_id, text in rows
+        ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def remove(kind, pk):
+    if not is_supported():
+        return
+    key = "rowid" if connection.vendor == "sqlite" else "id"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE {key} = %s", [_row_id(kind, pk)]
+        )
+
+
+def clear():
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+
+
+def search_posts(text, limit, offset=0):
+    """Ids of posts matching ``text`` in their own or comment text.
+
+    Results are ordered by relevance of the best matching document.
+    """
+    if not is_supported():
+        from .models import Post
+
+        matches = Post.objects.filter(text__icontains=text).values_list(
+            "pk", flat=True
+        )
+        return list(matches[offset : offset + limit])
+    if connection.vendor == "sqlite":
+        query = _fts5_query(text)
+        if not query:
+            return []
+        sql = (
+            f"SELECT post_id, MIN(rank) AS score FROM {TABLE} "
+            f"WHERE {TABLE} MATCH %s GROUP BY post_id "
+            "ORDER BY score, post_id DESC LIMIT %s OFFSET %s"
+        )
+    else:
+        query = text
+        sql = (
+            "SELECT post_id, MAX(ts_rank(document, query)) AS score "
+            f"FROM {TABLE}, websearch_to_tsquery('{CONFIG}', %s) query "
+            "WHERE document @@ query GROUP BY post_id "
+            "ORDER BY score DESC, post_id DESC LIMIT %s OFFSET %s"
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, limit, offset])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_ids(kind, text, limit=MAX_RESULTS):
+    """Primary keys of posts or comments whose own text matches"""
+    if not is_supported():
+        return None
+    if connection.vendor == "sqlite":
+        query = _fts5_query(text)
+        if not query:
+            return []
+        sql = (
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s "
+            "AND rowid %% 2 = %s ORDER BY rank LIMIT %s"
+        )
+    else:
+        query = text
+        sql = (
+            f"SELECT id FROM {TABLE} WHERE document @@ "
+            f"websearch_to_tsquery('{CONFIG}', %s) AND id %% 2 = %s LIMIT %s"
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, kind, limit])
+        return [row_id // 2 for (row_id,) in cursor.fetchall()]
@@ -0,0 +1,171 @@
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import search, timeline
+from .cache import FEED, FOLLOW, GROUP, bump_version
+from .models import (
+    AuthorStats,
+    Comment,
+    Follow,
+    Group,
+    GroupStats,
+    Post,
+    User,
+)
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(author=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.bump(instance.author_id, "posts_count", 1)
+        timeline.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    AuthorStats.bump(instance.author_id, "posts_count", -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.bump(instance.author_id, "followers_count", 1)
+        AuthorStats.bump(instance.user_id, "following_count", 1)
+        timeline.backfill(instance.user_id, instance.author_id)
+        timeline.rebalance([instance.author_id])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    AuthorStats.bump(instance.author_id, "followers_count", -1)
+    AuthorStats.bump(instance.user_id, "following_count", -1)
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, **kwargs):
+    if created:
+        Post.bump_comment_count(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Post.bump_comment_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def post_group_stats(sender, instance, created, **kwargs):
+    if created:
+        GroupStats.record(
+            instance.group_id, instance.pub_date, instance.author_id, posts=1
+        )
+        instance._loaded_group_id = instance.group_id
+        return
+    previous = getattr(instance, "_loaded_group_id", instance.group_id)
+    if previous == instance.group_id:
+        return
+    # The post moved: carry it and its comments over to the new group.
+    moves = [(instance.pub_date, instance.author_id, 1, 0)]
+    comments = (
+        instance.comments.order_by()
+        .values("author", day=TruncDate("created"))
+        .annotate(count=Count("pk"))
+    )
+    for row in comments:
+        moves.append((row["day"], row["author"], 0, row["count"]))
+    for when, author_id, posts, comments_count in moves:
+        GroupStats.record(
+            previous, when, author_id, -posts, -comments_count
+        )
+        GroupStats.record(
+            instance.group_id, when, author_id, posts, comments_count
+        )
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Post)
+def post_group_stats_removed(sender, instance, **kwargs):
+    GroupStats.record(
+        instance.group_id, instance.pub_date, instance.author_id, posts=-1
+    )
+
+
+def _post_group_id(comment):
+    if Comment.post.is_cached(comment):
+        return comment.post.group_id
+    return (
+        Post.objects.filter(pk=comment.post_id)
+        .values_list("group_id", flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Comment)
+def comment_group_stats(sender, instance, created, **kwargs):
+    if created:
+        GroupStats.record(
+            _post_group_id(instance),
+            instance.created,
+            instance.author_id,
+            comments=1,
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_group_stats_removed(sender, instance, **kwargs):
+    GroupStats.record(
+        _post_group_id(instance),
+        instance.created,
+        instance.author_id,
+        comments=-1,
+    )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def feed_changed(sender, **kwargs):
+    bump_version(FEED)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, **kwargs):
+    bump_version(FEED, GROUP)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follows_changed(sender, **kwargs):
+    bump_version(FOLLOW)
+
+
+@receiver(post_save, sender=Post)
+def post_indexed(sender, instance, **kwargs):
+    search.index(search.POST, instance.pk, instance.pk, instance.text)
+
+
+@receiver(post_delete, sender=Post)
+def post_unindexed(sender, instance, **kwargs):
+    search.remove(search.POST, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_indexed(sender, instance, **kwargs):
+    search.index(
+        search.COMMENT, instance.pk, instance.post_id, instance.text
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_unindexed(sender, instance, **kwargs):
+    search.remove(search.COMMENT, instance.pk)
@@ -0,0 +1,181 @@
+"""Synthetic content for query-plan checks and load benchmarks"""
+import contextlib
+import io
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+
+from .models import Comment, Follow, Group, Post, TimelineEntry
+
+User = get_user_model()
+
+WORDS = (
+    "кошка собака город река лес море солнце дождь книга музыка дорога "
+    "утро вечер зима лето друг работа отпуск кофе поезд горы небо снег "
+    "python django база индекс запрос кеш лента подписка новость фото"
+).split()
+
+
+@contextlib.contextmanager
+def scratch_caches():
+    """Run the block against private in-process copies of every cache.
+
+    Tiered caches keep their tiers over an L2 and L1 of their own; every
+    other alias, the rate-limit counters included, becomes locmem. So
+    the fragments and versions of the synthetic data, a cold run's
+    clear() and the counters never reach the shared cache.
+    """
+    scratch = {}
+    for alias, config in settings.CACHES.items():
+        if config["BACKEND"] == "yatube.cache.TieredCache":
+            options = dict(config.get("OPTIONS", {}))
+            options["L1_NAME"] = f"scratch-{alias}"
+            scratch[alias] = {**config, "OPTIONS": options}
+        else:
+            scratch[alias] = {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": f"scratch-{alias}",
+            }
+    with override_settings(CACHES=scratch):
+        try:
+            yield
+        finally:
+            for alias in scratch:
+                caches[alias].clear()
+
+
+@contextlib.contextmanager
+def scratch_database(verbosity=0):
+    """Run the block against a throwaway test database and private caches"""
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(
+        verbosity=verbosity, autoclobber=True, serialize=False
+    )
+    try:
+        with scratch_caches():
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def _text(rnd, words):
+    return " ".join(rnd.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed(
+    users=100,
+    groups=10,
+    posts=1000,
+    comments=2000,
+    follows=500,
+    batch_size=1000,
+    random_seed=0,
+):
+    """Bulk-insert a reproducible data set and fill the derived tables.
+
+    Returns the created users, groups and post ids for picking targets.
+    """
+    rnd = random.Random(random_seed)
+    User.objects.bulk_create(
+        [
+            User(username=f"bench_{i}", password="!")
+            for i in range(users)
+        ],
+        batch_size=batch_size,
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith="bench_").values_list(
+            "pk", flat=True
+        )
+    )
+    Group.objects.bulk_create(
+        [
+            Group(title=f"Группа {i}", slug=f"bench-{i}", description="")
+            for i in range(groups)
+        ]
+    )
+    group_ids = list(
+        Group.objects.filter(slug__startswith="bench-").values_list(
+            "pk", flat=True
+        )
+    )
+
+    Post.objects.bulk_create(
+        (
+            Post(
+                text=_text(rnd, rnd.randint(5, 40)),
+                author_id=rnd.choice(user_ids),
+                group_id=rnd.choice(group_ids + [None]),
+            )
+            for _ in range(posts)
+        ),
+        batch_size=batch_size,
+    )
+    posts_by_author = defaultdict(list)
+    post_ids = []
+    for pk, author_id, pub_date in Post.objects.values_list(
+        "pk", "author_id", "pub_date"
+    ):
+        posts_by_author[author_id].append((pk, pub_date))
+        post_ids.append(pk)
+
+    if post_ids:
+        Comment.objects.bulk_create(
+            (
+                Comment(
+                    post_id=rnd.choice(post_ids),
+                    author_id=rnd.choice(user_ids),
+                    text=_text(rnd, rnd.randint(3, 15)),
+                )
+                for _ in range(comments)
+            ),
+            batch_size=batch_size,
+        )
+        Post.objects.refresh_comment_counts()
+
+    pairs = set()
+    limit = min(follows, len(user_ids) * (len(user_ids) - 1))
+    while len(pairs) < limit:
+        user_id, author_id = rnd.sample(user_ids, 2)
+        pairs.add((user_id, author_id))
+    Follow.objects.bulk_create(
+        [Follow(user_id=u, author_id=a) for u, a in pairs],
+        batch_size=batch_size,
+    )
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=u, post_id=pk, author_id=a, pub_date=d)
+            for u, a in pairs
+            for pk, d in posts_by_author[a]
+        ),
+        batch_size=batch_size,
+    )
+
+    call_command("rebuild_author_stats", stdout=io.StringIO())
+    call_command("rebuild_group_stats", stdout=io.StringIO())
+    call_command("rebuild_text_html", stdout=io.StringIO())
+    call_command("rebuild_search_index", stdout=io.StringIO())
+    return {"users": user_ids, "groups": group_ids, "posts": post_ids}
+
+
+def busiest_targets():
+    """The reader, group and post with the most rows behind their pages"""
+    reader = (
+        User.objects.annotate(total=Count("follower"))
+        .order_by("-total")
+        .first()
+    )
+    group = Group.objects.annotate(total=Count("posts")).latest("total")
+    post = (
+        Post.objects.annotate(total=Count("comments"))
+        .select_related("author")
+        .latest("total")
+    )
+    return reader, group, post
@@ -0,0 +1,25 @@
+from django import template
+
+from posts.cache import get_version
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def cache_version(context, name):
+    """Generation counter ``name``, read from the cache once per request.
+
+    Every post_item.html of a feed page asks for the same counters.
+    """
+    request = context.get("request")
+    if request is None:
+        return get_version(name)
+    versions = request.__dict__.setdefault("_cache_versions", {})
+    if name not in versions:
+        versions[name] = get_version(name)
+    return versions[name]
+
+
+@register.filter
+def authored_by(post, user):
+    return post.author_id == user.pk
@@ -1,18 +1,85 @@
+import asyncio
+import base64
 import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
 
 from django import forms
+from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.core.files.images import ImageFile
-from django.test import Client, TestCase
-from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.template import engines
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from django.utils import timezone
 from PIL import Image
 
-from posts.models import Comment, Follow, Group, Post
+from posts import (
+    api,
+    async_views,
+    benchmark,
+    images,
+    markup,
+    queryplans,
+    search,
+    synthetic,
+    transfer,
+)
+from posts.models import (
+    AuthorStats,
+    Comment,
+    Follow,
+    Group,
+    GroupActivity,
+    GroupStats,
+    ImageJob,
+    Post,
+    TimelineEntry,
+)
+from posts.paginator import CursorPaginator
+from posts.templatetags import post_cache
+from yatube import metrics, querycheck, ratelimit, routers, templating
+from yatube.db import pool
+from yatube.cache import TieredCache
 
 User = get_user_model()
 
 
+
+async def sleepy_view(request):
+    await asyncio.sleep(0.3)
+    return HttpResponse()
+
+
+# Routes of ASGIMiddlewareTest.
+urlpatterns = [path("sleep/", sleepy_view)]
+
+
 class PostsAppTest(TestCase):
     def setUp(self):
         cache.clear()
@@ -149,36 +216,51 @@ class PostsAppTest(TestCase):
         )
 
     def test_cached_index_page(self):
-        testpost1 = Post.objects.create(
+        testpost = Post.objects.create(
             text="test text",
             author=self.user,
             group=self.group,
             image=self.create_test_image(),
         )
         first_response = self.login_client.get(reverse("index"))
-        cached_data = first_response.content
 
-        testpost2 = Post.objects.create(
+        # Bypasses signals, so the cached fragment must still be served
+        Post.objects.filter(pk=testpost.pk).update(text="silent edit")
+        second_response = self.login_client.get(reverse("index"))
+        self.assertEqual(first_response.content, second_response.content)
+
+        Post.objects.create(
             text="cache test",
             author=self.user,
             group=self.group,
             image=self.create_test_image(),
         )
-
-        second_response = self.login_client.get(reverse("index"))
-        self.assertEqual(first_response.content, second_response.content)
-
-        cache.clear()
         third_response = self.login_client.get(reverse("index"))
-        self.assertNotEqual(first_response.content, third_response.content)
+        self.assertContains(third_response, "cache test")
 
+    def test_cached_pages_do_not_share_fragments(self):
+        for i in range(15):
+            Post.objects.create(text=f"post {i}", author=self.user)
+        first_page = self.login_client.get(reverse("index"))
+        cursor = first_page.context["page"].next_cursor
+        second_page = self.login_client.get(
+            reverse("index"), {"cursor": cursor}
+        )
+        self.assertContains(first_page, "post 14")
+        self.assertNotContains(second_page, "post 14")
+        self.assertContains(second_page, "post 0")
+
+        other = User.objects.create_user(username="Other")
+        self.client.force_login(other)
+        response = self.client.get(reverse("index"))
+        self.assertNotContains(response, "Редактировать")
 
     def test_follow(self):
         testuser_to_follow = User.objects.create_user(username="Testuser2")
         nonfollower = User.objects.create_user(username="Testuser3")
 
         # Checking that Follow is created
-        self.login_client.get(
+        self.login_client.post(
             reverse("profile_follow", args=[testuser_to_follow.username])
         )
         self.assertEqual(Follow.objects.count(), 1)
@@ -197,7 +279,7 @@ class PostsAppTest(TestCase):
         self.assertEqual(response.context.get("paginator").count, 0)
 
         # Checking that Follow is deleted
-        self.login_client.get(
+        self.login_client.post(
             reverse("profile_unfollow", args=[testuser_to_follow.username])
         )
         self.assertEqual(Follow.objects.count(), 0)
@@ -221,3 +303,1730 @@ class PostsAppTest(TestCase):
             follow=True,
         )
         self.assertEqual(Comment.objects.count(), 0)
+
+
+class CursorPaginatorTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="Testuser")
+        for i in range(25):
+            Post.objects.create(text=f"post {i}", author=self.user)
+        self.expected = list(
+            Post.objects.order_by("-pub_date", "-id").values_list(
+                "id", flat=True
+            )
+        )
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        pages = [paginator.get_page()]
+        while pages[-1].next_cursor:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+
+        seen = [post.id for page in pages for post in page]
+        self.assertEqual(seen, self.expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3])
+        self.assertIsNone(pages[0].previous_cursor)
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual(back.number, 2)
+        self.assertEqual(
+            [post.id for post in back], [post.id for post in pages[1]]
+        )
+        first = paginator.get_page(back.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertIsNone(first.previous_cursor)
+
+    def test_deep_page_without_count_or_offset(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        cursor = paginator.get_page().next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            page = paginator.get_page(cursor)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]["sql"].upper()
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn("OFFSET", sql)
+        self.assertEqual(len(page), 10)
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse("index"), {"cursor": "garbage"})
+        self.assertEqual(response.status_code, 200)
+        page = response.context["page"]
+        self.assertEqual(page.number, 1)
+        self.assertEqual([post.id for post in page], self.expected[:10])
+
+    def test_crafted_cursors_fall_back_to_first_page(self):
+        group = Group.objects.create(title="group", slug="group")
+        post = Post.objects.create(text="post", author=self.user, group=group)
+        Follow.objects.create(
+            user=User.objects.create_user(username="Reader"), author=self.user
+        )
+        self.client.force_login(User.objects.get(username="Reader"))
+        payloads = [
+            ["next", 1, ["bad", 1]],
+            ["next", [1], ["2021-01-01T00:00:00+00:00", 1]],
+            ["next", 1, 5],
+            ["prev", 1, [{}, []]],
+            ["next", 1, [None, None]],
+            ["next", 1, ["2021-01-01T00:00:00+00:00", 10 ** 30]],
+            ["next", 1, ["2021-01-01T00:00:00+00:00", 1e400]],
+            {"a": 1, "b": 2, "c": 3},
+        ]
+        cursors = [
+            base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+            for payload in payloads
+        ]
+        urls = [
+            (reverse("index"), "cursor"),
+            (reverse("group_posts", args=["group"]), "cursor"),
+            (reverse("profile", args=["Testuser"]), "cursor"),
+            (reverse("follow_index"), "cursor"),
+            (reverse("post_view", args=["Testuser", post.pk]), "comments"),
+            (reverse("post_comments", args=["Testuser", post.pk]), "cursor"),
+        ]
+        for url, parameter in urls:
+            for cursor in cursors:
+                with self.subTest(url=url, cursor=cursor):
+                    cache.clear()
+                    response = self.client.get(url, {parameter: cursor})
+                    self.assertEqual(response.status_code, 200)
+
+
+class FeedQueriesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Testuser")
+        self.author = User.objects.create_user(username="Author")
+        self.group = Group.objects.create(
+            title="testgroup", slug="tst", description="group for test"
+        )
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.force_login(self.user)
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(
+                text=f"post {i}", author=self.author, group=self.group
+            )
+            Comment.objects.create(post=post, author=self.user, text="hi")
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        # session, user, page of posts (+ group or author lookup)
+        budgets = {
+            reverse("index"): 3,
+            reverse("group_posts", args=[self.group.slug]): 4,
+            # timeline and pulled keys, then the page of posts by id
+            reverse("follow_index"): 5,
+            # author lookup, follow check and the author card counters
+            reverse("profile", args=[self.author.username]): 6,
+        }
+        for total in (1, 10):
+            self.create_posts(total - Post.objects.count())
+            for url, budget in budgets.items():
+                with self.subTest(url=url, posts=total):
+                    cache.clear()
+                    with self.assertNumQueries(budget):
+                        response = self.client.get(url)
+                    self.assertEqual(len(response.context["page"]), total)
+                    self.assertContains(response, "Комментариев: 1")
+
+
+class AuthorStatsTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="Author")
+        self.reader = User.objects.create_user(username="Reader")
+
+    def counters(self, user):
+        stats = AuthorStats.objects.get(author=user)
+        return stats.posts_count, stats.followers_count, stats.following_count
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(text="test text", author=self.author)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.counters(self.author), (1, 1, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 1))
+
+        post.delete()
+        follow.delete()
+        self.assertEqual(self.counters(self.author), (0, 0, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 0))
+
+    def test_new_users_start_with_zero_counters(self):
+        self.assertEqual(self.counters(self.author), (0, 0, 0))
+
+    def test_first_access_counts_existing_rows(self):
+        AuthorStats.objects.all().delete()
+        Post.objects.create(text="test text", author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        stats = AuthorStats.for_author(self.author)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+
+    def test_rebuild_command_reconciles(self):
+        Post.objects.create(text="test text", author=self.author)
+        AuthorStats.objects.filter(author=self.author).update(posts_count=7)
+        AuthorStats.objects.filter(author=self.reader).delete()
+        call_command("rebuild_author_stats", stdout=io.StringIO())
+        self.assertEqual(self.counters(self.author), (1, 0, 0))
+        self.assertEqual(self.counters(self.reader), (0, 0, 0))
+
+
+class GroupStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="Author")
+        self.reader = User.objects.create_user(username="Reader")
+        self.group = Group.objects.create(
+            title="testgroup", slug="tst", description="group for test"
+        )
+        self.other = Group.objects.create(
+            title="other", slug="other", description="another group"
+        )
+
+    def rollup(self, group):
+        return list(
+            GroupStats.objects.filter(group=group).values_list(
+                "posts_count", "comments_count", "authors_count"
+            )
+        )
+
+    def test_rollup_follows_writes(self):
+        post = Post.objects.create(
+            text="test text", author=self.author, group=self.group
+        )
+        Post.objects.create(
+            text="more text", author=self.author, group=self.group
+        )
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text="comment"
+        )
+        self.assertEqual(self.rollup(self.group), [(2, 1, 2)])
+
+        comment.delete()
+        self.assertEqual(self.rollup(self.group), [(2, 0, 1)])
+        post.delete()
+        self.assertEqual(self.rollup(self.group), [(1, 0, 1)])
+
+    def test_moving_a_post_moves_its_activity(self):
+        post = Post.objects.create(
+            text="test text", author=self.author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text="comment")
+        post = Post.objects.get(pk=post.pk)
+        post.group = self.other
+        post.save()
+        self.assertEqual(self.rollup(self.group), [(0, 0, 0)])
+        self.assertEqual(self.rollup(self.other), [(1, 1, 2)])
+
+    def test_activity_annotations_and_top_groups(self):
+        post = Post.objects.create(
+            text="test text", author=self.author, group=self.other
+        )
+        Comment.objects.create(post=post, author=self.reader, text="comment")
+        Comment.objects.create(post=post, author=self.author, text="reply")
+        other = Group.objects.with_activity().get(pk=self.other.pk)
+        self.assertEqual(
+            (
+                other.recent_posts,
+                other.recent_comments,
+                other.recent_authors,
+            ),
+            (1, 2, 2),
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("top_groups"))
+        self.assertEqual(
+            [group.slug for group in response.context["groups"]],
+            ["other", "tst"],
+        )
+        response = self.client.get(reverse("group_posts", args=["other"]))
+        self.assertContains(response, "комментариев 2")
+
+    def test_rebuild_command_reconciles(self):
+        post = Post.objects.create(
+            text="test text", author=self.author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text="comment")
+        expected = self.rollup(self.group)
+        GroupStats.objects.update(posts_count=7)
+        GroupActivity.objects.all().delete()
+        GroupStats.objects.create(
+            group=self.other, day=timezone.localdate(), posts_count=3
+        )
+        call_command(
+            "rebuild_group_stats", batch_size=1, stdout=io.StringIO()
+        )
+        self.assertEqual(self.rollup(self.group), expected)
+        self.assertEqual(GroupActivity.objects.count(), 2)
+        self.assertFalse(GroupStats.objects.filter(group=self.other))
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.star = User.objects.create_user(username="Star")
+        self.client.force_login(self.reader)
+
+    def feed_texts(self):
+        response = self.client.get(reverse("follow_index"))
+        return [post.text for post in response.context["page"]]
+
+    def test_fan_out_backfill_and_prune(self):
+        Post.objects.create(text="before follow", author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text="after follow", author=self.author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+        self.assertEqual(self.feed_texts(), ["after follow", "before follow"])
+
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader))
+        self.assertEqual(self.feed_texts(), [])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=0)
+    def test_celebrity_posts_are_merged_on_read(self):
+        Follow.objects.create(user=self.reader, author=self.star)
+        Post.objects.create(text="star post", author=self.star)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.reader))
+        self.assertEqual(self.feed_texts(), ["star post"])
+
+    def test_timeline_page_is_an_index_range(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        for number in range(3):
+            Post.objects.create(text=f"post {number}", author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("follow_index"))
+        plans = [
+            queryplans.explain(query["sql"])
+            for query in queries.captured_queries
+            if query["sql"].startswith('SELECT "posts_timelineentry"')
+        ]
+        self.assertEqual(len(plans), 1)
+        self.assertFalse(
+            [line for line in plans[0] if "TEMP B-TREE" in line], plans[0]
+        )
+        self.assertTrue(
+            [line for line in plans[0] if "timeline_user_pub_date" in line],
+            plans[0],
+        )
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_pages_merge_pushed_and_pulled_posts(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.reader, author=self.star)
+        Follow.objects.create(user=self.author, author=self.star)
+        self.assertTrue(AuthorStats.objects.get(author=self.star).celebrity)
+        for number in range(15):
+            author = self.star if number % 3 else self.author
+            Post.objects.create(text=f"post {number}", author=author)
+        response = self.client.get(reverse("follow_index"))
+        page = response.context["page"]
+        texts = [post.text for post in page]
+        response = self.client.get(
+            reverse("follow_index"), {"cursor": page.next_cursor}
+        )
+        texts += [post.text for post in response.context["page"]]
+        self.assertEqual(
+            texts, [f"post {number}" for number in range(14, -1, -1)]
+        )
+        self.assertIsNone(response.context["page"].next_cursor)
+
+    def celebrity(self):
+        return AuthorStats.objects.get(author=self.star).celebrity
+
+    def resume_fan_out(self):
+        call_command("resume_fan_out", stdout=io.StringIO())
+
+    @override_settings(
+        TIMELINE_FANOUT_THRESHOLD=2, TIMELINE_FANOUT_RESUME_RATIO=0.5
+    )
+    def test_crossing_the_threshold_switches_the_author(self):
+        fans = [User.objects.create_user(username=f"Fan{i}") for i in "12"]
+        Follow.objects.create(user=self.reader, author=self.star)
+        Post.objects.create(text="pushed", author=self.star)
+        for fan in fans:
+            Follow.objects.create(user=fan, author=self.star)
+        self.assertTrue(self.celebrity())
+        Post.objects.create(text="pulled", author=self.star)
+        self.assertFalse(
+            TimelineEntry.objects.filter(post__text="pulled").exists()
+        )
+        self.assertEqual(self.feed_texts(), ["pulled", "pushed"])
+
+        # Inside the band the author stays pulled.
+        Follow.objects.filter(user=fans[1]).delete()
+        self.resume_fan_out()
+        self.assertTrue(self.celebrity())
+
+        Follow.objects.filter(user=fans[0]).delete()
+        self.assertTrue(self.celebrity())
+        self.assertFalse(
+            TimelineEntry.objects.filter(post__text="pulled").exists()
+        )
+        self.resume_fan_out()
+        self.assertFalse(self.celebrity())
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.filter(user=self.reader).values_list(
+                    "post__text", flat=True
+                )
+            ),
+            {"pushed", "pulled"},
+        )
+        self.assertEqual(self.feed_texts(), ["pulled", "pushed"])
+
+
+class TieredCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def worker(self, name, **options):
+        options.setdefault("STAMP_CHECK_INTERVAL", 0)
+        options["L1_NAME"] = f"{self.id()}.{name}"
+        return TieredCache("shared", {"OPTIONS": options})
+
+    def test_write_in_one_worker_invalidates_the_other(self):
+        first, second = self.worker("first"), self.worker("second")
+        first.set("key", "old")
+        self.assertEqual(second.get("key"), "old")
+        self.assertEqual(second.get("key"), "old")
+
+        first.set("key", "new")
+        self.assertEqual(second.get("key"), "new")
+        first.delete("key")
+        self.assertIsNone(second.get("key"))
+        self.assertEqual(second.stats()["l1"]["stale"], 2)
+
+    def test_counters_are_shared_exactly(self):
+        first, second = self.worker("first"), self.worker("second")
+        first.add("counter", 1)
+        second.incr("counter")
+        first.incr("counter")
+        self.assertEqual(second.get("counter"), 3)
+
+    def test_concurrent_increments_are_not_lost(self):
+        cache.add("counter", 0, 60)
+
+        def hit():
+            for _ in range(25):
+                cache.incr("counter")
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get("counter"), 200)
+
+    def test_l1_is_bounded(self):
+        worker = self.worker("bounded", L1_MAX_ENTRIES=2)
+        for key in "abc":
+            worker.set(key, key.upper())
+        stats = worker.stats()
+        self.assertEqual(stats["l1"]["entries"], 2)
+        self.assertEqual(stats["l1"]["evictions"], 1)
+        self.assertEqual(worker.get("a"), "A")
+
+
+class ImageJobTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Testuser")
+        self.client.force_login(self.user)
+
+    def create_post_with_image(self):
+        image = PostsAppTest.create_test_image()
+        upload = SimpleUploadedFile(
+            "test.jpg", image.read(), content_type="image/jpeg"
+        )
+        self.client.post(
+            reverse("new_post"), {"text": "with image", "image": upload}
+        )
+        return Post.objects.get(text="with image")
+
+    def run_worker(self):
+        call_command(
+            "process_image_jobs", "--once", "--workers=1", stdout=io.StringIO()
+        )
+
+    def test_saving_an_image_queues_a_job(self):
+        post = self.create_post_with_image()
+        job = ImageJob.objects.get(post=post)
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertEqual(images.claim(10), [job.pk])
+        self.assertEqual(images.claim(10), [])
+
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, post.image.url)
+
+    def test_worker_stores_thumbnail_urls(self):
+        post = self.create_post_with_image()
+        thumbnail = mock.Mock(url="/media/cache/card.jpg")
+        with mock.patch("posts.images.get_thumbnail", return_value=thumbnail):
+            self.run_worker()
+
+        post.refresh_from_db()
+        self.assertEqual(set(post.thumbnails), set(images.THUMBNAIL_VARIANTS))
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.DONE)
+        response = self.client.get(reverse("index"))
+        self.assertContains(response, "/media/cache/card.jpg")
+
+    def test_failing_job_is_retried_then_given_up(self):
+        self.create_post_with_image()
+        with mock.patch(
+            "posts.images.get_thumbnail", side_effect=OSError("broken")
+        ):
+            self.run_worker()
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.FAILED)
+        self.assertEqual(job.attempts, images.MAX_ATTEMPTS)
+        self.assertIn("broken", job.error)
+
+
+class ImagePipelineTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = self.settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user(username="Testuser")
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def upload(size=(50, 50), mode="RGB", image_format="PNG"):
+        file_obj = io.BytesIO()
+        Image.new(mode, size, "black").save(file_obj, format=image_format)
+        return SimpleUploadedFile(
+            f"test.{image_format.lower()}", file_obj.getvalue()
+        )
+
+    def create_post(self, text, upload):
+        response = self.client.post(
+            reverse("new_post"), {"text": text, "image": upload}
+        )
+        self.assertEqual(response.status_code, 302)
+        return Post.objects.get(text=text)
+
+    def run_worker(self):
+        thumbnail = mock.Mock(url="/media/cache/card.jpg")
+        with mock.patch("posts.images.get_thumbnail", return_value=thumbnail):
+            call_command(
+                "process_image_jobs",
+                "--once",
+                "--workers=1",
+                stdout=io.StringIO(),
+            )
+
+    def test_limits_are_checked_before_saving(self):
+        limits = {
+            "MAX_UPLOAD_BYTES": {"MAX_UPLOAD_BYTES": 10},
+            "MAX_UPLOAD_PIXELS": {"MAX_UPLOAD_PIXELS": 100},
+        }
+        for name, values in limits.items():
+            with self.subTest(limit=name), mock.patch.multiple(
+                images, **values
+            ), mock.patch.object(Image.Image, "verify") as verify:
+                response = self.client.post(
+                    reverse("new_post"),
+                    {"text": "too big", "image": self.upload()},
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context["form"].errors["image"])
+                verify.assert_not_called()
+        self.assertFalse(Post.objects.exists())
+
+    def test_worker_stores_a_smaller_jpeg_without_metadata(self):
+        post = self.create_post(
+            "large", self.upload(size=(3200, 100), mode="RGBA")
+        )
+        original = post.image.name
+        self.run_worker()
+
+        post.refresh_from_db()
+        self.assertTrue(post.image.name.startswith(images.CONTENT_PREFIX))
+        self.assertFalse(post.image.storage.exists(original))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (images.MAX_SIDE, 50))
+            self.assertNotIn("exif", image.info)
+        self.assertEqual(ImageJob.objects.get().status, ImageJob.DONE)
+
+    def test_identical_images_share_a_file(self):
+        first = self.create_post("first", self.upload())
+        second = self.create_post("second", self.upload())
+        self.run_worker()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+
+        storage, name = first.image.storage, first.image.name
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_replaced_image_is_released(self):
+        post = self.create_post("replaced", self.upload())
+        self.run_worker()
+        post.refresh_from_db()
+        storage, name = post.image.storage, post.image.name
+        response = self.client.post(
+            reverse("post_edit", args=[self.user.username, post.pk]),
+            {"text": "replaced", "image": self.upload(size=(60, 60))},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(storage.exists(name))
+        self.assertEqual(ImageJob.objects.latest("pk").kind, ImageJob.REENCODE)
+
+    def test_unprocessed_upload_is_released(self):
+        post = self.create_post("raw", self.upload())
+        storage, raw = post.image.storage, post.image.name
+        url = reverse("post_edit", args=[self.user.username, post.pk])
+        self.client.post(
+            url, {"text": "raw", "image": self.upload(size=(60, 60))}
+        )
+        self.assertFalse(storage.exists(raw))
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+        post.refresh_from_db()
+        replaced = post.image.name
+        self.client.post(url, {"text": "raw", "image-clear": "on"})
+        self.assertFalse(storage.exists(replaced))
+        self.assertFalse(ImageJob.objects.exists())
+
+
+class SearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="Testuser")
+        self.cat = Post.objects.create(
+            text="Рыжая кошка спит", author=self.user
+        )
+        self.dog = Post.objects.create(text="Собака лает", author=self.user)
+        Comment.objects.create(
+            post=self.dog, author=self.user, text="А кошка убежала"
+        )
+
+    def found(self, query):
+        response = self.client.get(reverse("search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [post.text for post in response.context["posts"]]
+
+    def test_posts_are_found_by_text_and_comments(self):
+        self.assertCountEqual(
+            self.found("кошка"), [self.cat.text, self.dog.text]
+        )
+        self.assertEqual(self.found("рыжая кошка"), [self.cat.text])
+        self.assertEqual(self.found('"OR* (NEAR'), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.cat.text = "Рыжий кот"
+        self.cat.save()
+        self.assertEqual(self.found("кошка"), [self.dog.text])
+        self.dog.delete()
+        self.assertEqual(self.found("кошка"), [])
+        self.assertEqual(self.found("кот"), [self.cat.text])
+
+    def test_rebuild_command_restores_the_index(self):
+        search.clear()
+        self.assertEqual(self.found("лает"), [])
+        call_command("rebuild_search_index", stdout=io.StringIO())
+        self.assertEqual(self.found("лает"), [self.dog.text])
+
+    def test_admin_search_uses_the_index(self):
+        post_admin = admin.site._registry[Post]
+        queryset, _ = post_admin.get_search_results(
+            None, Post.objects.all(), "кошка"
+        )
+        self.assertEqual(list(queryset), [self.cat])
+
+
+class QueryPlanTest(TestCase):
+    def test_sequential_scan_detection(self):
+        self.assertEqual(
+            queryplans.sequential_scans(["SCAN posts_post"]), {"posts_post"}
+        )
+        self.assertEqual(
+            queryplans.sequential_scans(
+                ["SCAN posts_post USING INDEX post_pub_date_idx"]
+            ),
+            set(),
+        )
+
+    def test_feed_queries_use_indexes(self):
+        synthetic.seed(users=20, groups=3, posts=200, comments=300, follows=60)
+        reader = Follow.objects.first().user
+        self.client.force_login(reader)
+        targets = queryplans.view_targets(
+            reader, Group.objects.first(), Post.objects.first()
+        )
+        for name, url in targets.items():
+            with self.subTest(view=name):
+                report = queryplans.check_view(self.client, url, repeat=1)
+                self.assertEqual(report["status"], 200)
+                for query in report["queries"]:
+                    self.assertEqual(
+                        query["sequential_scans"], [], query["plan"]
+                    )
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="Author")
+        self.reader = User.objects.create_user(username="Reader")
+        self.group = Group.objects.create(
+            title="testgroup", slug="tst", description="group for test"
+        )
+        self.posts = [
+            Post.objects.create(
+                text=f"post {i}\nсо второй строкой, \"кавычками\"",
+                author=self.author,
+                group=self.group if i % 2 else None,
+            )
+            for i in range(3)
+        ]
+        Comment.objects.create(
+            post=self.posts[0], author=self.reader, text="comment"
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def snapshot(self):
+        return (
+            list(
+                Post.objects.order_by("pk").values_list(
+                    "pk", "text", "pub_date", "author__username", "group__slug"
+                )
+            ),
+            list(Comment.objects.values_list("post_id", "text", "created")),
+            list(
+                Follow.objects.values_list(
+                    "user__username", "author__username"
+                )
+            ),
+        )
+
+    def wipe(self):
+        for model in (Post, Group, Follow, User):
+            model.objects.all().delete()
+
+    def test_round_trip(self):
+        for fmt in transfer.FORMATS:
+            with self.subTest(format=fmt):
+                before = self.snapshot()
+                directory = os.path.join(self.directory, fmt)
+                call_command(
+                    "export_content",
+                    directory,
+                    format=fmt,
+                    batch_size=2,
+                    stdout=io.StringIO(),
+                )
+                self.wipe()
+                call_command(
+                    "import_content",
+                    directory,
+                    batch_size=2,
+                    stdout=io.StringIO(),
+                )
+                self.assertEqual(self.snapshot(), before)
+                self.assertEqual(
+                    AuthorStats.objects.get(
+                        author__username="Author"
+                    ).followers_count,
+                    1,
+                )
+                self.assertTrue(
+                    TimelineEntry.objects.filter(
+                        user__username="Reader"
+                    ).exists()
+                )
+                self.assertEqual(
+                    search.search_posts("comment", 10), [self.posts[0].pk]
+                )
+
+    def test_follows_of_deleted_authors_are_skipped(self):
+        gone = User.objects.create_user(username="Gone")
+        Follow.objects.create(user=self.reader, author=gone)
+        gone.delete()
+        for fmt in transfer.FORMATS:
+            with self.subTest(format=fmt):
+                directory = os.path.join(self.directory, fmt)
+                transfer.export_content(directory, fmt=fmt)
+                path = os.path.join(directory, f"follows.{fmt}")
+                with open(path, "a", encoding="utf-8", newline="") as stream:
+                    stream.write(
+                        "Reader,\r\n"
+                        if fmt == "csv"
+                        else '{"user": "Reader", "author": null}\n'
+                    )
+                self.wipe()
+                transfer.import_content(directory)
+                self.assertEqual(
+                    list(
+                        Follow.objects.values_list(
+                            "user__username", "author__username"
+                        )
+                    ),
+                    [("Reader", "Author")],
+                )
+                self.assertFalse(User.objects.filter(username="").exists())
+
+    def test_imported_images_are_queued_for_reencoding(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(image="posts/a.png")
+        transfer.export_content(self.directory)
+        self.wipe()
+        transfer.import_content(self.directory)
+        job = ImageJob.objects.get()
+        self.assertEqual(
+            (job.post_id, job.kind), (self.posts[0].pk, ImageJob.REENCODE)
+        )
+
+    def test_import_refuses_a_database_with_content(self):
+        transfer.export_content(self.directory)
+        with self.assertRaises(ValueError):
+            transfer.import_content(self.directory)
+        self.assertEqual(Post.objects.count(), len(self.posts))
+
+    def test_import_resumes_from_checkpoint(self):
+        transfer.export_content(self.directory, batch_size=2)
+        self.wipe()
+        checkpoint = {"done": ["groups"], "stage": "posts", "position": 1}
+        with open(
+            os.path.join(self.directory, transfer.IMPORT_CHECKPOINT), "w"
+        ) as stream:
+            json.dump(checkpoint, stream)
+        transfer.import_content(self.directory, resume=True)
+        self.assertFalse(Group.objects.exists())
+        self.assertEqual(
+            list(Post.objects.order_by("pk").values_list("pk", flat=True)),
+            [post.pk for post in self.posts[1:]],
+        )
+
+    def test_interrupted_export_is_truncated_on_resume(self):
+        transfer.export_content(self.directory, batch_size=2)
+        path = os.path.join(self.directory, "posts.ndjson")
+        with open(path, encoding="utf-8") as stream:
+            complete = stream.read()
+        with open(path, "a", encoding="utf-8") as stream:
+            stream.write('{"id": 1, "tex')
+        lines = complete.splitlines(keepends=True)
+        first_batch = len("".join(lines[:2]).encode())
+        checkpoint = {
+            "done": ["groups"],
+            "stage": "posts",
+            "position": [self.posts[1].pk, first_batch],
+        }
+        with open(
+            os.path.join(self.directory, transfer.EXPORT_CHECKPOINT), "w"
+        ) as stream:
+            json.dump(checkpoint, stream)
+        transfer.export_content(self.directory, batch_size=2, resume=True)
+        with open(path, encoding="utf-8") as stream:
+            self.assertEqual(stream.read(), complete)
+
+
+class BenchmarkTest(TestCase):
+    def test_scratch_caches_are_private(self):
+        cache.set("live", "value")
+        with synthetic.scratch_caches():
+            self.assertIsNone(cache.get("live"))
+            cache.set("synthetic", "value")
+            cache.clear()
+            # The counters land in a private cache with an atomic incr.
+            self.assertEqual(ratelimit.check("scratch", 1, "10/m"), 0)
+        self.assertEqual(cache.get("live"), "value")
+        self.assertIsNone(cache.get("synthetic"))
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(samples, 50), 50)
+        self.assertEqual(benchmark.percentile(samples, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+    def test_run_reports_every_view(self):
+        synthetic.seed(users=10, groups=2, posts=30, comments=30, follows=20)
+        views = benchmark.run(repeat=2, warmup=0)
+        self.assertEqual(
+            set(views),
+            {
+                "index",
+                "group_posts",
+                "profile",
+                "post_view",
+                "follow_index",
+                "add_comment",
+                "new_post",
+            },
+        )
+        for name, view in views.items():
+            with self.subTest(view=name):
+                expected = 200 if view["method"] == "GET" else 302
+                self.assertEqual(view["status"], [expected])
+                self.assertGreater(view["queries"], 0)
+                self.assertLessEqual(view["p50_ms"], view["p99_ms"])
+
+    def test_ratelimit_check_is_measured(self):
+        report = benchmark.measure_ratelimit(repeat=50)
+        self.assertEqual(
+            report["backend"],
+            "django.core.cache.backends.locmem.LocMemCache",
+        )
+        self.assertLessEqual(report["p50_ms"], report["p99_ms"])
+
+    @override_settings(RATELIMIT_CACHE="default")
+    def test_ratelimit_check_on_the_file_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            benchmark.measure_ratelimit(repeat=1)
+
+
+class TemplatingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(username="Author")
+        for number in range(3):
+            Post.objects.create(text=f"post {number}", author=author)
+
+    def test_profile_attributes_time_to_includes_and_tags(self):
+        with templating.profile() as profile:
+            self.client.get(reverse("index"))
+        calls = {
+            key: entry[0] for key, entry in profile.entries.items()
+        }
+        self.assertEqual(
+            calls[("index.html", "include includes/post_item.html")], 3
+        )
+        self.assertEqual(calls[("includes/post_item.html", "cache")], 3)
+        self.assertIn(("includes/post_item.html", "filter localtime"), calls)
+        template, node, *_ = profile.top(1)[0]
+        self.assertTrue(template and node)
+
+    @override_settings(TEMPLATE_PROFILING=True)
+    def test_middleware_reports_server_timing(self):
+        response = Client().get(reverse("index"))
+        self.assertIn('tpl1;desc="', response["Server-Timing"])
+
+    def test_warm_up_parses_templates_once(self):
+        options = dict(
+            settings.TEMPLATES[0]["OPTIONS"],
+            loaders=[
+                (
+                    "django.template.loaders.cached.Loader",
+                    settings.TEMPLATE_LOADERS,
+                )
+            ],
+        )
+        templates = [dict(settings.TEMPLATES[0], OPTIONS=options)]
+        with self.settings(TEMPLATES=templates):
+            self.assertGreater(templating.warm_up(), 10)
+            loader = engines.all()[0].engine.template_loaders[0]
+            self.assertIn(
+                "includes/post_item.html",
+                {key.split("-")[0] for key in loader.get_template_cache},
+            )
+
+    def test_feed_reads_each_cache_version_once(self):
+        with mock.patch(
+            "posts.templatetags.post_cache.get_version",
+            wraps=post_cache.get_version,
+        ) as get_version:
+            self.client.get(reverse("index"))
+        names = [call.args[0] for call in get_version.call_args_list]
+        self.assertEqual(names.count("group"), 1)
+
+
+class TextHtmlTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(
+            text="<b>first</b>\nsecond", author=self.author
+        )
+
+    def test_saving_renders_text(self):
+        self.assertEqual(
+            self.post.text_html, "&lt;b&gt;first&lt;/b&gt;<br>second"
+        )
+        comment = Comment.objects.create(
+            post=self.post, author=self.author, text="a\nb"
+        )
+        self.assertEqual(comment.text_html, "a<br>b")
+
+    def test_editing_renders_again(self):
+        self.post.text = "edited"
+        self.post.save(update_fields=["text"])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text_html, "edited")
+
+    def test_command_fills_missing_renditions(self):
+        Post.objects.filter(pk=self.post.pk).update(text_html="")
+        Post.objects.filter(pk=self.post.pk).update(text="old")
+        call_command("rebuild_text_html", stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.text_html, markup.render("old"))
+
+    def test_page_prints_stored_rendition(self):
+        Post.objects.filter(pk=self.post.pk).update(text_html="<i>stored</i>")
+        response = self.client.get(
+            reverse("post_view", args=[self.author.username, self.post.pk])
+        )
+        self.assertContains(response, "<i>stored</i>")
+
+
+@override_settings(
+    RATELIMIT_ENABLED=True,
+    RATELIMITS={"comment": {"user": "2/m", "ip": "3/m"}},
+)
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        ratelimit.counters().clear()
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(text="test text", author=self.author)
+        self.url = reverse(
+            "add_comment", args=[self.author.username, self.post.pk]
+        )
+
+    def comment_as(self, username):
+        client = Client()
+        client.force_login(User.objects.get_or_create(username=username)[0])
+        return client.post(self.url, {"text": "comment"})
+
+    def test_user_limit(self):
+        for _ in range(2):
+            self.assertEqual(self.comment_as("Reader").status_code, 302)
+        response = self.comment_as("Reader")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        self.assertEqual(Comment.objects.count(), 2)
+
+    def test_address_limit(self):
+        for username in ("First", "Second", "Third"):
+            self.assertEqual(self.comment_as(username).status_code, 302)
+        self.assertEqual(self.comment_as("Fourth").status_code, 429)
+
+    def test_reading_the_form_is_not_counted(self):
+        client = Client()
+        client.force_login(self.author)
+        for _ in range(3):
+            client.get(self.url)
+        self.assertEqual(self.comment_as("Author").status_code, 302)
+
+    @override_settings(RATELIMIT_ENABLED=False)
+    def test_disabled(self):
+        for _ in range(4):
+            self.assertEqual(self.comment_as("Reader").status_code, 302)
+
+    def test_previous_window_fades_out(self):
+        for _ in range(10):
+            self.assertEqual(ratelimit.check("s", 1, "10/m", now=30), 0)
+        # Half of the previous window still overlaps at 90 seconds.
+        for _ in range(5):
+            self.assertEqual(ratelimit.check("s", 1, "10/m", now=90), 0)
+        self.assertEqual(ratelimit.check("s", 1, "10/m", now=90), 6)
+        self.assertEqual(ratelimit.check("s", 1, "10/m", now=130), 0)
+
+    def test_concurrent_hits_are_all_counted(self):
+        def hit():
+            for _ in range(50):
+                ratelimit.check("s", 1, "1000/m", now=30)
+
+        threads = [threading.Thread(target=hit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        key = ratelimit._key("s", 1, 0)
+        self.assertEqual(ratelimit.counters().get(key), 400)
+
+    @override_settings(RATELIMIT_CACHE="default")
+    def test_cache_without_atomic_incr_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.comment_as("Reader")
+        self.assertFalse(Comment.objects.exists())
+        errors = ratelimit.check_cache(None)
+        self.assertEqual([error.id for error in errors], ["yatube.E001"])
+
+    def test_default_counter_cache_passes_the_check(self):
+        with override_settings(DEBUG=True):
+            self.assertEqual(ratelimit.check_cache(None), [])
+        # Outside DEBUG, locmem counts in every worker on its own.
+        errors = ratelimit.check_cache(None)
+        self.assertEqual([error.id for error in errors], ["yatube.W001"])
+
+
+class FollowTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def followers(self):
+        return AuthorStats.for_author(self.author).followers_count
+
+    def test_follow_is_idempotent(self):
+        url = reverse("profile_follow", args=["Author"])
+        for _ in range(2):
+            response = self.client.post(url)
+            self.assertRedirects(response, reverse("profile", args=["Author"]))
+        self.assertEqual(Follow.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.followers(), 1)
+
+    def test_duplicate_insert_is_not_an_error(self):
+        self.assertTrue(Follow.add(self.user.pk, self.author.pk))
+        self.assertFalse(Follow.add(self.user.pk, self.author.pk))
+        self.assertFalse(Follow.add(self.user.pk, self.user.pk))
+        self.assertEqual(Follow.objects.count(), 1)
+
+    def test_get_does_not_change_follows(self):
+        for name in ("profile_follow", "profile_unfollow"):
+            response = self.client.get(reverse(name, args=["Author"]))
+            self.assertEqual(response.status_code, 405)
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unknown_author(self):
+        for name in ("profile_follow", "profile_unfollow"):
+            response = self.client.post(reverse(name, args=["Nobody"]))
+            self.assertEqual(response.status_code, 404)
+
+    def test_unfollow(self):
+        Follow.objects.create(user=self.user, author=self.author)
+        self.client.post(reverse("profile_unfollow", args=["Author"]))
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(self.followers(), 0)
+
+    def test_follow_many(self):
+        other = User.objects.create_user(username="Other")
+        Follow.objects.create(user=self.user, author=self.author)
+        Post.objects.create(text="old post", author=other)
+        response = self.client.post(
+            reverse("follow_many"),
+            {"author": ["Author", "Other", "Nobody", "Reader"]},
+        )
+        self.assertEqual(
+            response.json(), {"followed": ["Other"], "unknown": ["Nobody"]}
+        )
+        self.assertEqual(
+            set(self.user.follower.values_list("author", flat=True)),
+            {self.author.pk, other.pk},
+        )
+        stats = AuthorStats.for_author(self.user)
+        self.assertEqual(stats.following_count, 2)
+        self.assertEqual(AuthorStats.for_author(other).followers_count, 1)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, author=other).exists()
+        )
+
+    def test_add_many_reports_only_its_own_inserts(self):
+        other = User.objects.create_user(username="Other")
+        for returning in (True, False):
+            with self.subTest(returning=returning), mock.patch(
+                "posts.models._returns_from_upsert", return_value=returning
+            ):
+                Follow.objects.all().delete()
+                Follow.objects.create(user=self.user, author=self.author)
+                authors = [self.author.pk, other.pk, self.user.pk]
+                self.assertEqual(
+                    Follow.add_many(self.user.pk, authors), [other.pk]
+                )
+                self.assertEqual(Follow.add_many(self.user.pk, authors), [])
+                self.assertEqual(self.user.follower.count(), 2)
+
+    @mock.patch("posts.views.BULK_FOLLOW_LIMIT", 1)
+    def test_follow_many_limit(self):
+        response = self.client.post(
+            reverse("follow_many"), {"author": ["Author", "Other"]}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Follow.objects.exists())
+
+
+class APITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.author = User.objects.create_user(username="Author")
+        self.group = Group.objects.create(
+            title="testgroup", slug="tst", description="group for test"
+        )
+        self.posts = [
+            Post.objects.create(
+                text=f"post {number}", author=self.author, group=self.group
+            )
+            for number in range(12)
+        ]
+        self.post = self.posts[-1]
+        Comment.objects.create(post=self.post, author=self.author, text="hi")
+
+    def test_feeds_page_with_cursors(self):
+        urls = [
+            reverse("api:posts"),
+            reverse("api:group_posts", args=["tst"]),
+            reverse("api:author_posts", args=["Author"]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.client.get(url).json()
+                self.assertEqual(len(data["results"]), 10)
+                self.assertEqual(data["results"][0]["text"], "post 11")
+                self.assertIsNone(data["previous"])
+                data = self.client.get(url, {"cursor": data["next"]}).json()
+                self.assertEqual(
+                    [item["id"] for item in data["results"]],
+                    [post.pk for post in self.posts[1::-1]],
+                )
+
+    def test_fields_limit_loaded_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("api:posts"), {"fields": "id,author"}
+            )
+        self.assertEqual(
+            response.json()["results"][0],
+            {"id": self.post.pk, "author": "Author"},
+        )
+        select = queries.captured_queries[-1]["sql"]
+        self.assertIn('"auth_user"."username"', select)
+        self.assertNotIn('"posts_post"."text"', select)
+        self.assertNotIn("posts_group", select)
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse("api:posts"), {"fields": "secret"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("secret", response.json()["error"])
+
+    def test_post_detail_and_comments(self):
+        data = self.client.get(
+            reverse("api:post_detail", args=[self.post.pk])
+        ).json()
+        self.assertEqual(data["group"], "tst")
+        self.assertEqual(data["comment_count"], 1)
+        self.assertEqual(data["pub_date"], self.post.pub_date.isoformat())
+        data = self.client.get(
+            reverse("api:post_comments", args=[self.post.pk]),
+            {"fields": "text,author"},
+        ).json()
+        self.assertEqual(
+            data["results"], [{"text": "hi", "author": "Author"}]
+        )
+        self.assertIsNone(data["next"])
+
+    def test_missing_post(self):
+        response = self.client.get(reverse("api:post_detail", args=[0]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+    def test_follow_feed(self):
+        url = reverse("api:follow_posts")
+        self.assertEqual(self.client.get(url).status_code, 401)
+        reader = User.objects.create_user(username="Reader")
+        Follow.objects.create(user=reader, author=self.author)
+        self.client.force_login(reader)
+        data = self.client.get(url, {"fields": "id"}).json()
+        self.assertEqual(data["results"][0], {"id": self.post.pk})
+
+    def test_conditional_get_and_writes(self):
+        url = reverse("api:posts")
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+    def test_crafted_cursors(self):
+        cursor = base64.urlsafe_b64encode(
+            json.dumps(["next", [1], {"a": None}]).encode()
+        ).decode()
+        urls = [
+            reverse("api:posts"),
+            reverse("api:author_posts", args=["Author"]),
+            reverse("api:post_comments", args=[self.post.pk]),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, {"cursor": cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.json()["results"])
+
+        with mock.patch(
+            "posts.paginator.CursorPaginator.decode",
+            side_effect=ValidationError("bad"),
+        ):
+            response = self.client.get(
+                reverse("api:posts"), {"cursor": cursor}
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response["Content-Type"], "application/json")
+
+    def test_serializers_agree(self):
+        data = {"text": "Привет", "items": [1, None]}
+        with mock.patch.object(api, "orjson", None):
+            fallback = api.dumps(data)
+        self.assertEqual(json.loads(fallback), json.loads(api.dumps(data)))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username="Admin", is_staff=True)
+        self.user = User.objects.create_user(username="Testuser")
+
+    def scrape(self, **headers):
+        response = self.client.get(reverse("metrics"), **headers)
+        return response, response.content.decode()
+
+    def test_request_is_measured(self):
+        Post.objects.create(text="test text", author=self.user)
+        self.client.get(reverse("index"))
+        self.client.force_login(self.admin)
+        response, text = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('yatube_request_queries_count{view="index"}', text)
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket{view="index",'
+            'method="GET",le="+Inf"}',
+            text,
+        )
+        self.assertIn(
+            'yatube_responses_total{view="index",status="200"}', text
+        )
+        self.assertIn('yatube_cache_lookups_total{view="index",', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_seconds", "Test.", (1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe((), value)
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'test_seconds_bucket{le="1"} 2',
+                'test_seconds_bucket{le="2"} 3',
+                'test_seconds_bucket{le="+Inf"} 4',
+                "test_seconds_sum 6.0",
+                "test_seconds_count 4",
+            ],
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_endpoint_is_restricted(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.scrape()[0].status_code, 403)
+        response, _ = self.scrape(HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+        response, _ = self.scrape(HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+
+class QueryCheckTest(TestCase):
+    def test_fingerprint_ignores_literals(self):
+        self.assertEqual(
+            querycheck.fingerprint(
+                "SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' "
+                "LIMIT 21"
+            ),
+            "SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?",
+        )
+
+    @override_settings(QUERY_DUPLICATES_THRESHOLD=2)
+    def test_middleware_logs_repeated_queries(self):
+        author = User.objects.create_user(username="Author")
+        post = Post.objects.create(text="test text", author=author)
+        for i in range(3):
+            Comment.objects.create(post=post, author=author, text=f"{i}")
+
+        def view(request):
+            return HttpResponse(
+                [comment.author.username for comment in Comment.objects.all()]
+            )
+
+        middleware = querycheck.DuplicateQueryMiddleware(view)
+        with self.assertLogs("yatube.querycheck", "WARNING") as logs:
+            middleware(RequestFactory().get("/"))
+        self.assertIn("3x SELECT", logs.output[0])
+        self.assertIn("posts/tests.py", logs.output[0])
+
+
+class CommentThreadTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(text="test text", author=self.author)
+        self.comments = [
+            Comment.objects.create(
+                post=self.post, author=self.author, text=f"comment {i}"
+            )
+            for i in range(5)
+        ]
+
+    def test_counter_follows_comments(self):
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 5)
+        self.comments[0].delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 4)
+
+    def test_saving_post_keeps_concurrent_comments(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        Comment.objects.create(post=self.post, author=self.author, text="new")
+        stale.text = "edited"
+        stale.save()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 6)
+        self.assertEqual(self.post.text, "edited")
+
+    def test_refresh_comment_counts(self):
+        Post.objects.update(comment_count=0)
+        Post.objects.refresh_comment_counts()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 5)
+
+    @mock.patch("posts.views.COMMENTS_PER_PAGE", 2)
+    def test_comments_load_in_windows(self):
+        args = [self.author.username, self.post.pk]
+        response = self.client.get(reverse("post_view", args=args))
+        self.assertEqual(
+            [c.text for c in response.context["items"]],
+            ["comment 0", "comment 1"],
+        )
+        cursor = response.context["next_comments"]
+        texts = []
+        while cursor:
+            batch = self.client.get(
+                reverse("post_comments", args=args), {"cursor": cursor}
+            ).json()
+            texts += [comment["text"] for comment in batch["comments"]]
+            self.assertIn(batch["comments"][0]["text"], batch["html"])
+            cursor = batch["next"]
+        self.assertEqual(texts, ["comment 2", "comment 3", "comment 4"])
+
+        response = self.client.get(
+            reverse("post_view", args=args),
+            {"comments": response.context["next_comments"]},
+        )
+        self.assertEqual(
+            [c.text for c in response.context["items"]],
+            ["comment 2", "comment 3"],
+        )
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(text="test text", author=self.author)
+        self.urls = [
+            reverse("index"),
+            reverse("profile", args=[self.author.username]),
+            reverse("post_view", args=[self.author.username, self.post.pk]),
+        ]
+
+    def test_unchanged_page_is_not_rendered(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(response.content)
+
+    def test_writes_change_the_tag(self):
+        etags = [self.client.get(url)["ETag"] for url in self.urls]
+        Comment.objects.create(post=self.post, author=self.author, text="new")
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_tag_depends_on_viewer_and_query(self):
+        url = reverse("index")
+        anonymous = self.client.get(url)["ETag"]
+        paged = self.client.get(url, {"cursor": "x"})["ETag"]
+        self.assertNotEqual(paged, anonymous)
+        self.client.force_login(self.author)
+        self.assertNotEqual(self.client.get(url)["ETag"], anonymous)
+
+
+class AsyncViewTest(TransactionTestCase):
+    """Async views with their queries spread over the view threads"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.reader = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(text="async text", author=self.author)
+        Follow.objects.create(user=self.reader, author=self.author)
+
+    def get(self, view, *args, user=None, **headers):
+        request = self.factory.get("/", **headers)
+        request.session = SessionStore()
+        request.user = user or AnonymousUser()
+        return async_to_sync(view)(request, *args)
+
+    def test_profile_gathers_page_stats_and_follow_status(self):
+        response = self.get(
+            async_views.profile, self.author.username, user=self.reader
+        )
+        self.assertContains(response, "async text")
+        self.assertContains(
+            response, reverse("profile_unfollow", args=["Author"])
+        )
+
+    def test_queries_of_view_threads_are_counted(self):
+        request_metrics = metrics.RequestMetrics()
+        token = metrics._current.set(request_metrics)
+        try:
+            self.get(async_views.post_view, "Author", self.post.pk)
+        finally:
+            metrics._current.reset(token)
+        self.assertGreater(request_metrics.queries, 0)
+
+    def test_unchanged_page_is_not_rendered(self):
+        etag = self.get(async_views.index)["ETag"]
+        response = self.get(async_views.index, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_index_requires_login(self):
+        response = self.get(async_views.follow_index)
+        self.assertEqual(response.status_code, 302)
+        response = self.get(async_views.follow_index, user=self.reader)
+        self.assertContains(response, "async text")
+
+
+@override_settings(
+    ROOT_URLCONF=__name__,
+    MIDDLEWARE=[
+        name
+        for name in settings.MIDDLEWARE
+        if name not in settings.SYNC_ONLY_MIDDLEWARE
+    ],
+)
+class ASGIMiddlewareTest(SimpleTestCase):
+    def test_concurrent_requests_overlap(self):
+        client = AsyncClient()
+
+        async def fetch_all():
+            return await asyncio.gather(
+                *(client.get("/sleep/") for _ in range(4))
+            )
+
+        start = time.perf_counter()
+        responses = async_to_sync(fetch_all)()
+        elapsed = time.perf_counter() - start
+        self.assertEqual([r.status_code for r in responses], [200] * 4)
+        # One at a time the four would take 1.2 seconds.
+        self.assertLess(elapsed, 0.9)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        routers._down_until.clear()
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, write=False):
+        """Serve ``request`` recording where a read after it would go"""
+        seen = {}
+
+        def view(request):
+            seen["first"] = self.router.db_for_read(Post)
+            if write:
+                self.router.db_for_write(Post)
+            seen["after"] = self.router.db_for_read(Post)
+            return HttpResponse()
+
+        response = routers.ReplicaMiddleware(view)(request)
+        return seen, response
+
+    @mock.patch("yatube.routers._is_available", return_value=True)
+    def test_reads_of_get_requests_use_a_replica(self, available):
+        seen, response = self.route(self.factory.get("/"))
+        self.assertEqual(seen, {"first": "replica1", "after": "replica1"})
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.router.db_for_read(Post), "default")
+
+    @mock.patch("yatube.routers._is_available", return_value=True)
+    def test_writes_pin_the_visitor_to_the_primary(self, available):
+        seen, response = self.route(self.factory.get("/"), write=True)
+        self.assertEqual(seen, {"first": "replica1", "after": "default"})
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get("/")
+        request.COOKIES[routers.PIN_COOKIE] = "1"
+        seen, _ = self.route(request)
+        self.assertEqual(seen["first"], "default")
+        seen, _ = self.route(self.factory.post("/"))
+        self.assertEqual(seen["first"], "default")
+
+    @override_settings(DATABASE_REPLICAS=["replica1", "replica2"])
+    def test_only_the_picked_replica_is_connected_to(self):
+        with mock.patch(
+            "yatube.routers._is_available", return_value=True
+        ) as available:
+            seen, _ = self.route(self.factory.get("/"))
+        available.assert_called_once_with(seen["first"])
+
+        with mock.patch(
+            "yatube.routers._is_available",
+            side_effect=lambda alias: alias == "replica2",
+        ):
+            for _ in range(5):
+                seen, _ = self.route(self.factory.get("/"))
+                self.assertEqual(seen["first"], "replica2")
+
+    @override_settings(DATABASE_REPLICAS=["unreachable"])
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with self.assertLogs("yatube.routers", "WARNING"):
+            seen, _ = self.route(self.factory.get("/"))
+        self.assertEqual(seen["first"], "default")
+        self.assertIn("unreachable", routers._down_until)
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "No DB_REPLICAS configured")
+class ReplicaReadTest(TransactionTestCase):
+    databases = "__all__"
+
+    def test_feed_is_read_from_replica(self):
+        author = User.objects.create_user(username="Author")
+        Post.objects.create(text="replicated", author=author)
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with CaptureQueriesContext(replica) as queries:
+            response = self.client.get(reverse("index"))
+        self.assertContains(response, "replicated")
+        self.assertTrue(queries.captured_queries)
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.opened = []
+        self.now = 1000.0
+        patcher = mock.patch("yatube.db.pool.time")
+        clock = patcher.start()
+        clock.monotonic.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+
+    def connect(self):
+        connection = FakeConnection(len(self.opened))
+        self.opened.append(connection)
+        return connection
+
+    def make_pool(self, **options):
+        return pool.ConnectionPool(self.connect, **options)
+
+    def test_released_connection_is_reused(self):
+        connections_pool = self.make_pool()
+        first = connections_pool.acquire()
+        connections_pool.release(first)
+        self.assertIs(connections_pool.acquire(), first)
+        self.assertEqual(connections_pool.stats["opened"], 1)
+        self.assertEqual(connections_pool.stats["checkouts"], 2)
+
+    def test_exhausted_pool_times_out(self):
+        connections_pool = self.make_pool(max_size=2, timeout=0)
+        connections_pool.acquire()
+        connections_pool.acquire()
+        with self.assertRaises(pool.PoolTimeout):
+            connections_pool.acquire()
+        self.assertEqual(connections_pool.size, 2)
+        self.assertEqual(connections_pool.stats["timeouts"], 1)
+
+    def test_release_wakes_a_waiting_thread(self):
+        connections_pool = self.make_pool(max_size=1, timeout=5)
+        held = connections_pool.acquire()
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(connections_pool.acquire())
+        )
+        waiter.start()
+        while not connections_pool.stats["waits"]:
+            threading.Event().wait(0.001)
+        connections_pool.release(held)
+        waiter.join(5)
+        self.assertEqual(acquired, [held])
+        self.assertEqual(connections_pool.stats["opened"], 1)
+
+    def test_old_connections_are_replaced(self):
+        connections_pool = self.make_pool(max_lifetime=60)
+        first = connections_pool.acquire()
+        connections_pool.release(first)
+        self.now += 61
+        second = connections_pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections_pool.size, 1)
+
+    def test_idle_connections_beyond_min_size_are_closed(self):
+        connections_pool = self.make_pool(min_size=1, max_idle=60)
+        first = connections_pool.acquire()
+        second = connections_pool.acquire()
+        connections_pool.release(first)
+        connections_pool.release(second)
+        self.now += 61
+        self.assertIs(connections_pool.acquire(), second)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections_pool.size, 1)
+
+    def test_failed_health_check_discards_connection(self):
+        connections_pool = pool.ConnectionPool(
+            self.connect,
+            check=lambda connection: connection.number != 0,
+            check_after=30,
+        )
+        first = connections_pool.acquire()
+        connections_pool.release(first)
+        self.now += 31
+        second = connections_pool.acquire()
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections_pool.stats["failed_checks"], 1)
+
+    def test_broken_connection_is_not_reused(self):
+        connections_pool = self.make_pool()
+        first = connections_pool.acquire()
+        connections_pool.release(first, broken=True)
+        self.assertTrue(first.closed)
+        self.assertEqual(connections_pool.size, 0)
+        self.assertIsNot(connections_pool.acquire(), first)
+
+    def test_metrics_report_pools(self):
+        connections_pool = self.make_pool()
+        connections_pool.release(connections_pool.acquire())
+        pools = {"default:yatube": connections_pool}
+        with mock.patch.dict(pool._pools, pools):
+            text = metrics.render()
+        self.assertIn(
+            'yatube_db_pool_events_total{pool="default:yatube",'
+            'event="checkouts"} 1',
+            text,
+        )
+        self.assertIn(
+            'yatube_db_pool_connections{pool="default:yatube",'
+            'state="idle"} 1',
+            text,
+        )
@@ -0,0 +1,224 @@
+"""Fan-out-on-write home timelines.
+
+Posts of regular authors are pushed into every follower's timeline when
+they are published, so reading the follow feed is a keyset range over
+the reader's own TimelineEntry rows. Authors with more followers than
+TIMELINE_FANOUT_THRESHOLD are skipped on write and merged in on read
+instead, so a single post never has to be copied a million times. The
+``celebrity`` flag of AuthorStats records which way an author is served.
+It is set as soon as the follower count goes over the threshold, but
+only cleared by the resume_fan_out command once the count has fallen to
+TIMELINE_FANOUT_RESUME_RATIO of it: the band keeps authors hovering at
+the threshold from switching back and forth, and pushing the posts of
+the pulled period to every follower never runs inside a request.
+"""
+from django.conf import settings
+from django.db.models import Max, Q
+
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .paginator import POSTS_PER_PAGE, CursorPaginator, paginate
+
+BATCH_SIZE = 1000
+
+
+def is_enabled():
+    return getattr(settings, "TIMELINE_FANOUT", False)
+
+
+def _threshold():
+    return getattr(settings, "TIMELINE_FANOUT_THRESHOLD", 5000)
+
+
+def resume_threshold():
+    """Follower count at which a pulled author is fanned out again"""
+    ratio = getattr(settings, "TIMELINE_FANOUT_RESUME_RATIO", 0.8)
+    return int(_threshold() * ratio)
+
+
+def is_celebrity(author_id):
+    return AuthorStats.objects.filter(
+        author_id=author_id, celebrity=True
+    ).exists()
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def _push(user_ids, posts):
+    """Insert every (pk, author_id, pub_date) of ``posts`` for the users"""
+    batch = []
+    for user_id in user_ids:
+        for post_id, author_id, pub_date in posts:
+            batch.append(
+                TimelineEntry(
+                    user_id=user_id,
+                    post_id=post_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+            )
+            if len(batch) >= BATCH_SIZE:
+                _insert(batch)
+                batch = []
+    _insert(batch)
+
+
+def _followers(author_id, after=0):
+    return (
+        Follow.objects.filter(author_id=author_id, pk__gt=after)
+        .values_list("user_id", flat=True)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+
+
+def _posts_of(author_ids):
+    return Post.objects.filter(author_id__in=author_ids).values_list(
+        "pk", "author_id", "pub_date"
+    )
+
+
+def fan_out(post):
+    """Push a freshly published post to every follower of its author"""
+    if not is_enabled() or is_celebrity(post.author_id):
+        return
+    _push(
+        _followers(post.author_id),
+        [(post.pk, post.author_id, post.pub_date)],
+    )
+
+
+def backfill(user_id, author_id):
+    """Copy the existing posts of a newly followed author"""
+    if not is_enabled() or author_id is None or is_celebrity(author_id):
+        return
+    _push([user_id], _posts_of([author_id]))
+
+
+def backfill_many(user_id, author_ids):
+    """backfill() for several newly followed authors at once"""
+    if not is_enabled() or not author_ids:
+        return
+    _push(
+        [user_id],
+        _posts_of(author_ids).exclude(author__stats__celebrity=True),
+    )
+
+
+def rebalance(author_ids):
+    """Stop fanning out authors whose follower count went over the threshold.
+
+    The entries pushed so far stay and are merged with the pulled posts
+    on read. Going back is left to resume_fan_out().
+    """
+    if not is_enabled() or not author_ids:
+        return
+    AuthorStats.objects.filter(
+        author_id__in=author_ids,
+        celebrity=False,
+        followers_count__gt=_threshold(),
+    ).update(celebrity=True)
+
+
+def resumable_authors():
+    """Pulled authors whose follower count fell to resume_threshold()"""
+    return AuthorStats.objects.filter(
+        celebrity=True, followers_count__lte=resume_threshold()
+    ).values_list("author_id", flat=True)
+
+
+def resume_fan_out(author_id):
+    """Push all posts of a pulled author to every follower, then flip it.
+
+    The author stays pulled while the posts are copied, so the feeds are
+    complete throughout; the posts and follows that arrived meanwhile are
+    pushed once more after the flip. Returns whether the author flipped.
+    """
+    if not is_enabled():
+        return False
+    last_post = _posts_of([author_id]).aggregate(last=Max("pk"))["last"]
+    last_follow = Follow.objects.filter(author_id=author_id).aggregate(
+        last=Max("pk")
+    )["last"]
+    _push(_followers(author_id), _posts_of([author_id]))
+    flipped = AuthorStats.objects.filter(
+        author_id=author_id,
+        celebrity=True,
+        followers_count__lte=resume_threshold(),
+    ).update(celebrity=False)
+    if flipped:
+        _push(_followers(author_id, last_follow or 0), _posts_of([author_id]))
+        _push(
+            _followers(author_id),
+            _posts_of([author_id]).filter(pk__gt=last_post or 0),
+        )
+    return bool(flipped)
+
+
+def prune(user_id, author_id):
+    """Drop the posts of an unfollowed author from the timeline"""
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def _pulled_authors(user):
+    return Follow.objects.filter(
+        user=user, author__stats__celebrity=True
+    ).values("author")
+
+
+def feed_for(user, posts=None):
+    """Posts of the authors ``user`` follows, newest first"""
+    posts = Post.objects.all() if posts is None else posts
+    if not is_enabled():
+        return posts.filter(author__following__user=user)
+    pushed = TimelineEntry.objects.filter(user=user).values("post")
+    return posts.filter(
+        Q(pk__in=pushed) | Q(author__in=_pulled_authors(user))
+    )
+
+
+class FeedPaginator(CursorPaginator):
+    """Follow feed pages merged from the timeline and the pulled authors.
+
+    Each source is a keyset range over its own (pub_date, post) index
+    that reads keys only; the page is then loaded from ``posts`` by
+    primary key. Totals still come from feed_for(), and only if asked.
+    """
+
+    def __init__(self, user, posts, per_page):
+        super().__init__(feed_for(user, posts), per_page)
+        self.posts = posts
+        self.sources = [
+            CursorPaginator(
+                TimelineEntry.objects.filter(user=user).values_list(
+                    "pub_date", "post_id"
+                ),
+                per_page,
+                ordering=("-pub_date", "-post_id"),
+            ),
+            CursorPaginator(
+                Post.objects.filter(
+                    author__in=_pulled_authors(user)
+                ).values_list("pub_date", "id"),
+                per_page,
+            ),
+        ]
+
+    def rows_after(self, values, backwards, limit):
+        keys = set()
+        for source in self.sources:
+            keys.update(source.rows_after(values, backwards, limit))
+        keys = sorted(keys, reverse=not backwards)[:limit]
+        found = self.posts.in_bulk([pk for _, pk in keys])
+        return [found[pk] for _, pk in keys if pk in found]
+
+
+def paginate_feed(request, user, posts=None, per_page=POSTS_PER_PAGE):
+    """The follow feed page of ``user`` addressed by ``?cursor=``"""
+    posts = Post.objects.for_feed() if posts is None else posts
+    if not is_enabled():
+        return paginate(request, feed_for(user, posts), per_page)
+    paginator = FeedPaginator(user, posts, per_page)
+    return paginator.get_page(request.GET.get("cursor"))
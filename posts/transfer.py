@@ -0,0 +1,462 @@
+"""Streaming export and import of community content.
+
+Groups, posts, comments and follows are written to one file per model,
+as NDJSON or CSV, in primary key order and in fixed-size batches, so
+neither direction ever holds more than one batch in memory. Users are
+referenced by username and groups by slug; group, post and comment ids
+are preserved, so comments keep pointing at their posts and replaying a
+batch is a no-op. Both directions record a checkpoint after every batch
+and can resume an interrupted run from it. Since ids are kept, an import
+only starts on a database without groups, posts and comments.
+"""
+import contextlib
+import csv
+import io
+import itertools
+import json
+import os
+import shutil
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils._os import safe_join
+from django.utils.dateparse import parse_datetime
+
+from . import search, timeline
+from .cache import FEED, FOLLOW, GROUP, bump_version
+from .models import Comment, Follow, Group, ImageJob, Post
+
+User = get_user_model()
+
+FORMATS = ("ndjson", "csv")
+BATCH_SIZE = 1000
+MEDIA_DIR = "media"
+EXPORT_CHECKPOINT = ".export-checkpoint.json"
+IMPORT_CHECKPOINT = ".import-checkpoint.json"
+
+# Rows of every exported file, its columns and the lookups they are read
+# from, in import order: each stage only refers to rows of the stages
+# before it.
+COLUMNS = {
+    "groups": (
+        Group.objects.all(),
+        {
+            "id": "pk",
+            "title": "title",
+            "slug": "slug",
+            "description": "description",
+        },
+    ),
+    "posts": (
+        Post.objects.all(),
+        {
+            "id": "pk",
+            "text": "text",
+            "pub_date": "pub_date",
+            "edit_date": "edit_date",
+            "author": "author__username",
+            "group": "group__slug",
+            "image": "image",
+        },
+    ),
+    "comments": (
+        Comment.objects.all(),
+        {
+            "id": "pk",
+            "post": "post_id",
+            "author": "author__username",
+            "text": "text",
+            "created": "created",
+        },
+    ),
+    "follows": (
+        # Follows of a deleted author keep their row with no author.
+        Follow.objects.exclude(author=None),
+        {"user": "user__username", "author": "author__username"},
+    ),
+}
+
+
+def _path(directory, stage, fmt):
+    return os.path.join(directory, f"{stage}.{fmt}")
+
+
+def _load_checkpoint(path, resume):
+    if resume and os.path.exists(path):
+        with open(path, encoding="utf-8") as stream:
+            return json.load(stream)
+    return {"done": [], "stage": None, "position": None}
+
+
+def _save_checkpoint(path, state):
+    """Replace the checkpoint atomically, so a crash never corrupts it"""
+    with open(path + ".tmp", "w", encoding="utf-8") as stream:
+        json.dump(state, stream)
+    os.replace(path + ".tmp", path)
+
+
+def _position(state, stage, default):
+    return state["position"] if state["stage"] == stage else default
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _serialize(value):
+    # isoformat() keeps microseconds, unlike DjangoJSONEncoder.
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+class _Writer:
+    """Append records to an NDJSON or CSV file of the given columns"""
+
+    def __init__(self, path, fmt, columns, size):
+        if size:
+            # Drop whatever a crashed run wrote after its last checkpoint.
+            with open(path, "r+b") as stream:
+                stream.truncate(size)
+        self.stream = open(
+            path, "a" if size else "w", encoding="utf-8", newline=""
+        )
+        self.fmt = fmt
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.stream, columns)
+            if not size:
+                self.csv.writeheader()
+
+    def write(self, record):
+        record = {key: _serialize(value) for key, value in record.items()}
+        if self.fmt == "csv":
+            self.csv.writerow(record)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False))
+            self.stream.write("\n")
+
+    def flush(self):
+        """Persist everything written so far and return the file size"""
+        self.stream.flush()
+        os.fsync(self.stream.fileno())
+        return self.stream.tell()
+
+    def close(self):
+        self.stream.close()
+
+
+def _read(path, fmt):
+    if fmt == "csv":
+        csv.field_size_limit(2 ** 31 - 1)
+        with open(path, encoding="utf-8", newline="") as stream:
+            yield from csv.DictReader(stream)
+    else:
+        with open(path, encoding="utf-8") as stream:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _bundle_media(directory, name):
+    target = safe_join(os.path.join(directory, MEDIA_DIR), name)
+    if os.path.exists(target) or not default_storage.exists(name):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with default_storage.open(name) as source:
+        with open(target + ".tmp", "wb") as copy:
+            shutil.copyfileobj(source, copy)
+    os.replace(target + ".tmp", target)
+
+
+def _restore_media(directory, name):
+    source = safe_join(os.path.join(directory, MEDIA_DIR), name)
+    if os.path.exists(source) and not default_storage.exists(name):
+        with open(source, "rb") as stream:
+            default_storage.save(name, File(stream))
+
+
+def export_content(
+    directory,
+    fmt="ndjson",
+    batch_size=BATCH_SIZE,
+    media=False,
+    resume=False,
+    log=None,
+):
+    """Write every stage to ``directory``, one keyset batch at a time"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}")
+    os.makedirs(directory, exist_ok=True)
+    checkpoint_path = os.path.join(directory, EXPORT_CHECKPOINT)
+    state = _load_checkpoint(checkpoint_path, resume)
+    for stage, (queryset, columns) in COLUMNS.items():
+        if stage in state["done"]:
+            continue
+        last_pk, size = _position(state, stage, [0, 0])
+        rows = queryset.order_by("pk").values_list(
+            "pk", *columns.values()
+        )
+        writer = _Writer(_path(directory, stage, fmt), fmt, columns, size)
+        total = 0
+        try:
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                for pk, *values in batch:
+                    record = dict(zip(columns, values))
+                    writer.write(record)
+                    if media and record.get("image"):
+                        _bundle_media(directory, record["image"])
+                last_pk = batch[-1][0]
+                total += len(batch)
+                state.update(stage=stage, position=[last_pk, writer.flush()])
+                _save_checkpoint(checkpoint_path, state)
+        finally:
+            writer.close()
+        state["done"].append(stage)
+        _save_checkpoint(checkpoint_path, state)
+        if log:
+            log(f"Exported {total} {stage}")
+    os.remove(checkpoint_path)
+
+
+@contextlib.contextmanager
+def _keep_timestamps(model):
+    """Let bulk_create store imported dates instead of the current time"""
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False)
+        or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _user_ids(usernames):
+    """Map usernames to ids, creating accounts without a password"""
+    usernames = set(usernames)
+    ids = dict(
+        User.objects.filter(username__in=usernames).values_list(
+            "username", "pk"
+        )
+    )
+    missing = usernames - ids.keys()
+    if missing:
+        User.objects.bulk_create(
+            [
+                User(username=name, password=make_password(None))
+                for name in missing
+            ],
+            ignore_conflicts=True,
+        )
+        ids.update(
+            User.objects.filter(username__in=missing).values_list(
+                "username", "pk"
+            )
+        )
+    return ids
+
+
+def _import_groups(records, directory, media):
+    Group.objects.bulk_create(
+        [
+            Group(
+                id=int(r["id"]),
+                title=r["title"],
+                slug=r["slug"],
+                description=r["description"],
+            )
+            for r in records
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _import_posts(records, directory, media):
+    authors = _user_ids(r["author"] for r in records)
+    groups = dict(
+        Group.objects.filter(
+            slug__in={r["group"] for r in records if r["group"]}
+        ).values_list("slug", "pk")
+    )
+    posts = [
+        Post(
+            id=int(r["id"]),
+            text=r["text"],
+            pub_date=parse_datetime(r["pub_date"]),
+            edit_date=parse_datetime(r["edit_date"]),
+            author_id=authors[r["author"]],
+            group_id=groups.get(r["group"]),
+            image=r["image"] or "",
+        )
+        for r in records
+    ]
+    with _keep_timestamps(Post):
+        Post.objects.bulk_create(posts, ignore_conflicts=True)
+    search.index_many([(search.POST, p.pk, p.pk, p.text) for p in posts])
+
+    with_images = [post for post in posts if post.image]
+    if media:
+        for post in with_images:
+            _restore_media(directory, post.image.name)
+    queued = set(
+        ImageJob.objects.filter(
+            post__in=with_images, status=ImageJob.PENDING
+        ).values_list("post_id", flat=True)
+    )
+    ImageJob.objects.bulk_create(
+        ImageJob(post_id=post.pk, kind=ImageJob.REENCODE)
+        for post in with_images
+        if post.pk not in queued
+    )
+
+
+def _import_comments(records, directory, media):
+    authors = _user_ids(r["author"] for r in records)
+    posts = set(
+        Post.objects.filter(
+            pk__in={int(r["post"]) for r in records}
+        ).values_list("pk", flat=True)
+    )
+    comments = [
+        Comment(
+            id=int(r["id"]),
+            post_id=int(r["post"]),
+            author_id=authors[r["author"]],
+            text=r["text"],
+            created=parse_datetime(r["created"]),
+        )
+        for r in records
+        if int(r["post"]) in posts
+    ]
+    with _keep_timestamps(Comment):
+        Comment.objects.bulk_create(comments, ignore_conflicts=True)
+    Post.objects.filter(
+        pk__in={comment.post_id for comment in comments}
+    ).refresh_comment_counts()
+    search.index_many(
+        [(search.COMMENT, c.pk, c.post_id, c.text) for c in comments]
+    )
+
+
+def _complete_follows(records):
+    # NDJSON has null and CSV an empty string for a missing user.
+    return [r for r in records if r["user"] and r["author"]]
+
+
+def _import_follows(records, directory, media):
+    records = _complete_follows(records)
+    users = _user_ids(
+        name for r in records for name in (r["user"], r["author"])
+    )
+    Follow.objects.bulk_create(
+        [
+            Follow(user_id=users[r["user"]], author_id=users[r["author"]])
+            for r in records
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _backfill_timelines(records, directory, media):
+    records = _complete_follows(records)
+    users = _user_ids(
+        name for r in records for name in (r["user"], r["author"])
+    )
+    for r in records:
+        timeline.backfill(users[r["user"]], users[r["author"]])
+
+
+LOADERS = {
+    "groups": _import_groups,
+    "posts": _import_posts,
+    "comments": _import_comments,
+    "follows": _import_follows,
+}
+
+
+def _detect_format(directory):
+    for fmt in FORMATS:
+        if any(
+            os.path.exists(_path(directory, stage, fmt)) for stage in COLUMNS
+        ):
+            return fmt
+    raise FileNotFoundError(f"No exported content in {directory}")
+
+
+def _reset_sequences():
+    models = [User, Group, Post, Comment, Follow]
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def import_content(
+    directory, batch_size=BATCH_SIZE, media=False, resume=False, log=None
+):
+    """Load an export_content() directory with batched bulk inserts.
+
+    Every batch is committed on its own and followed by a checkpoint. The
+    derived data that signals normally maintain is filled afterwards:
+    author counters, home timelines and cache versions. The search index,
+    comment counters and image jobs are written along with each batch.
+    Rows whose id is taken are skipped, so a fresh import refuses to start
+    on a database that already has content.
+    """
+    fmt = _detect_format(directory)
+    checkpoint_path = os.path.join(directory, IMPORT_CHECKPOINT)
+    state = _load_checkpoint(checkpoint_path, resume)
+    if not state["done"] and state["stage"] is None and any(
+        model.objects.exists() for model in (Group, Post, Comment)
+    ):
+        raise ValueError(
+            "The database already has groups, posts or comments; "
+            "import into an empty one"
+        )
+
+    def run(stage, source, load):
+        path = _path(directory, source, fmt)
+        if stage in state["done"] or not os.path.exists(path):
+            return
+        done = _position(state, stage, 0)
+        records = itertools.islice(_read(path, fmt), done, None)
+        for batch in _batches(records, batch_size):
+            with transaction.atomic():
+                load(batch, directory, media)
+            done += len(batch)
+            state.update(stage=stage, position=done)
+            _save_checkpoint(checkpoint_path, state)
+        state["done"].append(stage)
+        _save_checkpoint(checkpoint_path, state)
+        if log:
+            log(f"Imported {done} {stage}")
+
+    for stage, load in LOADERS.items():
+        run(stage, stage, load)
+    _reset_sequences()
+    call_command("rebuild_author_stats", stdout=io.StringIO())
+    call_command("rebuild_group_stats", stdout=io.StringIO())
+    call_command("rebuild_text_html", stdout=io.StringIO())
+    # Fan-out needs the follower counters to skip celebrity authors.
+    if timeline.is_enabled():
+        run("timelines", "follows", _backfill_timelines)
+    bump_version(FEED, GROUP, FOLLOW)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint_path)
@@ -1,15 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
+from . import async_views
 from . import views as posts_views
 
+# The read-heavy feed pages, async under ASGI.
+feed_views = async_views if settings.ASYNC_VIEWS else posts_views
+
 urlpatterns = [
-    path("group/<slug:slug>/", posts_views.group_posts, name="group_posts"),
+    path("group/", posts_views.top_groups, name="top_groups"),
+    path("group/<slug:slug>/", feed_views.group_posts, name="group_posts"),
     path("new/", posts_views.new_post, name="new_post"),
-    path("follow/", posts_views.follow_index, name="follow_index"),
-    path("<str:username>/", posts_views.profile, name="profile"),
+    path("search/", posts_views.search_posts, name="search"),
+    path("follow/", feed_views.follow_index, name="follow_index"),
+    path("follow/bulk/", posts_views.follow_many, name="follow_many"),
+    path("<str:username>/", feed_views.profile, name="profile"),
     path(
         "<str:username>/<int:post_id>/",
-        posts_views.post_view,
+        feed_views.post_view,
         name="post_view",
     ),
     path(
@@ -17,6 +25,11 @@ urlpatterns = [
         posts_views.post_edit,
         name="post_edit",
     ),
+    path(
+        "<str:username>/<int:post_id>/comments/",
+        posts_views.post_comments,
+        name="post_comments",
+    ),
     path(
         "<username>/<int:post_id>/comment",
         posts_views.add_comment,
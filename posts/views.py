@@ -1,38 +1,84 @@
 import datetime as dt
 
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.views.decorators.http import condition, require_POST
 
+from yatube.ratelimit import ratelimit
+
+from . import images, search, timeline
+from .cache import FEED, FOLLOW, GROUP, bump_version, page_etag
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import AuthorStats, Follow, Group, Post, User
+from .paginator import (
+    COMMENTS_PER_PAGE,
+    POSTS_PER_PAGE,
+    CursorPaginator,
+    paginate,
+)
+
+TOP_GROUPS = 20
+BULK_FOLLOW_LIMIT = 100
 
 
+@condition(etag_func=page_etag(FEED, GROUP))
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    post_list = Post.objects.for_feed()
+    page = paginate(request, post_list)
     return render(
-        request, "index.html", {"page": page, "paginator": paginator}
+        request, "index.html", {"page": page, "paginator": page.paginator}
     )
 
 
+@condition(etag_func=page_etag(FEED, GROUP))
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
-
+    group = get_object_or_404(Group.objects.with_activity(), slug=slug)
+    post_list = group.posts.for_feed()
+    page = paginate(request, post_list)
     return render(
         request,
         "posts/group.html",
-        {"group": group, "page": page, "paginator": paginator},
+        {"group": group, "page": page, "paginator": page.paginator},
+    )
+
+
+@condition(etag_func=page_etag(FEED, GROUP))
+def top_groups(request):
+    groups = Group.objects.with_activity().order_by(
+        "-recent_posts", "-recent_comments", "title"
+    )[:TOP_GROUPS]
+    return render(request, "posts/top_groups.html", {"groups": groups})
+
+
+def search_posts(request):
+    query = request.GET.get("q", "").strip()
+    try:
+        number = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        number = 1
+    offset = (number - 1) * POSTS_PER_PAGE
+    if query and offset < search.MAX_RESULTS:
+        post_ids = search.search_posts(query, POSTS_PER_PAGE + 1, offset)
+    else:
+        post_ids = []
+    found = Post.objects.for_feed().in_bulk(post_ids[:POSTS_PER_PAGE])
+    return render(
+        request,
+        "posts/search.html",
+        {
+            "query": query,
+            "posts": [found[pk] for pk in post_ids if pk in found],
+            "number": number,
+            "has_next": len(post_ids) > POSTS_PER_PAGE,
+        },
     )
 
 
 @login_required
+@ratelimit("post")
 def new_post(request):
     is_new_post = True
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -40,6 +86,8 @@ def new_post(request):
         new_post = form.save(commit=False)
         new_post.author = request.user
         new_post.save()
+        if new_post.image:
+            images.enqueue(new_post)
         return redirect("index")
     return render(
         request,
@@ -48,6 +96,7 @@ def new_post(request):
     )
 
 
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
 def profile(request, username):
     author = get_object_or_404(User, username=username)
     if request.user.is_authenticated:
@@ -55,31 +104,71 @@ def profile(request, username):
             user=request.user, author=author
         ).exists()
     following = request.user.is_authenticated and has_follows
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    post_list = author.posts.for_feed()
+    page = paginate(request, post_list)
     return render(
         request,
         "posts/profile.html",
         {
             "author": author,
+            "stats": AuthorStats.for_author(author),
             "page": page,
-            "paginator": paginator,
+            "paginator": page.paginator,
             "following": following,
         },
     )
 
 
+def _comment_thread(post, cursor=None):
+    """A window of the post comments in posting order and the next cursor"""
+    paginator = CursorPaginator(
+        post.comments.select_related("author"),
+        COMMENTS_PER_PAGE,
+        ordering=("created", "id"),
+    )
+    return paginator.get_window(cursor)
+
+
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.for_feed(), id=post_id)
     author = post.author
-    comments = post.comments.all()
+    comments, next_cursor = _comment_thread(post, request.GET.get("comments"))
     form = CommentForm()
     return render(
         request,
         "posts/view_post.html",
-        {"author": author, "post": post, "items": comments, "form": form},
+        {
+            "author": author,
+            "stats": AuthorStats.for_author(author),
+            "post": post,
+            "items": comments,
+            "next_comments": next_cursor,
+            "form": form,
+        },
+    )
+
+
+def post_comments(request, username, post_id):
+    """The next window of comments for incremental loading, as JSON"""
+    post = get_object_or_404(Post.objects.only("pk"), id=post_id)
+    comments, next_cursor = _comment_thread(post, request.GET.get("cursor"))
+    return JsonResponse(
+        {
+            "comments": [
+                {
+                    "id": comment.id,
+                    "author": comment.author.username,
+                    "text": comment.text,
+                    "created": comment.created.isoformat(),
+                }
+                for comment in comments
+            ],
+            "html": render_to_string(
+                "includes/comment_list.html", {"items": comments}, request
+            ),
+            "next": next_cursor,
+        }
     )
 
 
@@ -90,12 +179,19 @@ def post_edit(request, username, post_id):
     author = post.author
     if request.user != author:
         return redirect("post_view", username=author.username, post_id=post.id)
+    previous_image = post.image.name
     form = PostForm(
         request.POST or None, files=request.FILES or None, instance=post
     )
 
     if form.is_valid():
+        if "image" in form.changed_data:
+            post.thumbnails = {}
         form.save()
+        if "image" in form.changed_data:
+            images.discard(post, previous_image)
+            if post.image:
+                images.enqueue(post)
         return redirect("post_view", username=author.username, post_id=post.id)
     return render(
         request,
@@ -118,10 +214,10 @@ def server_error(request):
 
 
 @login_required
+@ratelimit("comment")
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post.objects.select_related("author"), id=post_id)
+    post = get_object_or_404(Post.objects.for_feed(), id=post_id)
     author = post.author
-    comments = post.comments.all()
     form = CommentForm(request.POST or None)
     if form.is_valid():
         new_comment = form.save(commit=False)
@@ -129,39 +225,84 @@ def add_comment(request, username, post_id):
         new_comment.post = post
         new_comment.save()
         return redirect("post_view", username=author.username, post_id=post.id)
+    comments, next_cursor = _comment_thread(post)
     return render(
         request,
         "posts/view_post.html",
-        {"form": form, "author": author, "post": post, "items": comments},
+        {
+            "form": form,
+            "author": author,
+            "stats": AuthorStats.for_author(author),
+            "post": post,
+            "items": comments,
+            "next_comments": next_cursor,
+        },
     )
 
 
 @login_required
+@condition(etag_func=page_etag(FEED, GROUP, FOLLOW))
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    page = timeline.paginate_feed(request, request.user)
     return render(
-        request, "posts/follow.html", {"page": page, "paginator": paginator}
+        request,
+        "posts/follow.html",
+        {"page": page, "paginator": page.paginator},
     )
 
 
 @login_required
+@require_POST
+@ratelimit("follow")
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
-    user = get_object_or_404(User, username=request.user.username)
-    if (
-        author != user
-        and not Follow.objects.filter(author=author, user=user).exists()
-    ):
-        Follow.objects.create(author=author, user=user).save()
-    return redirect("profile", username=author.username)
+    author_id = (
+        User.objects.filter(username=username)
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if author_id is None:
+        raise Http404
+    Follow.add(request.user.pk, author_id)
+    return redirect("profile", username=username)
 
 
 @login_required
+@require_POST
+@ratelimit("follow")
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
-    user = get_object_or_404(User, username=request.user.username)
-    Follow.objects.filter(author=author, user=user).delete()
-    return redirect("profile", username=author.username)
+    deleted, _ = Follow.objects.filter(
+        user=request.user, author__username=username
+    ).delete()
+    if not deleted and not User.objects.filter(username=username).exists():
+        raise Http404
+    return redirect("profile", username=username)
+
+
+@login_required
+@require_POST
+@ratelimit("follow")
+def follow_many(request):
+    """Follow every author named in the "author" fields, as JSON"""
+    usernames = set(request.POST.getlist("author"))
+    if len(usernames) > BULK_FOLLOW_LIMIT:
+        return JsonResponse(
+            {"error": f"Не больше {BULK_FOLLOW_LIMIT} авторов за раз"},
+            status=400,
+        )
+    authors = dict(
+        User.objects.filter(username__in=usernames).values_list(
+            "pk", "username"
+        )
+    )
+    with transaction.atomic():
+        added = Follow.add_many(request.user.pk, list(authors))
+        timeline.backfill_many(request.user.pk, added)
+        timeline.rebalance(added)
+    if added:
+        bump_version(FOLLOW)
+    return JsonResponse(
+        {
+            "followed": sorted(authors[pk] for pk in added),
+            "unknown": sorted(usernames - set(authors.values())),
+        }
+    )
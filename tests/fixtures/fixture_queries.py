@@ -0,0 +1,22 @@
+import contextlib
+
+import pytest
+
+
+@pytest.fixture
+def query_budget():
+    """Fail the test when the block runs more queries than allowed or
+    repeats one query shape more than ``duplicates`` times"""
+    from yatube.querycheck import DEFAULT_THRESHOLD, QueryRecorder
+
+    @contextlib.contextmanager
+    def check(budget, duplicates=DEFAULT_THRESHOLD):
+        with QueryRecorder() as recorder:
+            yield recorder
+        if len(recorder) > budget or recorder.duplicates(duplicates):
+            pytest.fail(
+                f'Бюджет запросов: {budget}, повтор одного запроса не больше '
+                f'{duplicates} раз\n{recorder.report(duplicates)}'
+            )
+
+    return check
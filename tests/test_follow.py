@@ -59,9 +59,9 @@ class TestFollow:
         # assert author_field.on_delete == CASCADE, \
         #     'Свойство `author` модели `Follow` должно иметь аттрибут `on_delete=models.CASCADE`'
 
-    def check_url(self, client, url, str_url):
+    def check_url(self, client, url, str_url, method='get'):
         try:
-            response = client.get(f'{url}')
+            response = getattr(client, method)(f'{url}')
         except Exception as e:
             assert False, f'''Страница `{str_url}` работает неправильно. Ошибка: `{e}`'''
         if response.status_code in (301, 302) and response.url == f'{url}/':
@@ -89,15 +89,15 @@ class TestFollow:
     @pytest.mark.django_db(transaction=True)
     def test_follow_auth(self, user_client, user, post):
         assert user.follower.count() == 0, 'Проверьте, что правильно считается подписки'
-        self.check_url(user_client, f'/{post.author.username}/follow', '/<username>/follow/')
+        self.check_url(user_client, f'/{post.author.username}/follow/', '/<username>/follow/', 'post')
         assert user.follower.count() == 0, 'Проверьте, что нельзя подписаться на самого себя'
 
         user_1 = get_user_model().objects.create_user(username='TestUser_2344')
         user_2 = get_user_model().objects.create_user(username='TestUser_73485')
 
-        self.check_url(user_client, f'/{user_1.username}/follow', '/<username>/follow/')
+        self.check_url(user_client, f'/{user_1.username}/follow/', '/<username>/follow/', 'post')
         assert user.follower.count() == 1, 'Проверьте, что вы можете подписаться на пользователя'
-        self.check_url(user_client, f'/{user_1.username}/follow', '/<username>/follow/')
+        self.check_url(user_client, f'/{user_1.username}/follow/', '/<username>/follow/', 'post')
         assert user.follower.count() == 1, 'Проверьте, что вы можете подписаться на пользователя только один раз'
 
         image = tempfile.NamedTemporaryFile(suffix=".jpg").name
@@ -120,19 +120,19 @@ class TestFollow:
         assert len(response.context['page']) == 2, \
             'Проверьте, что на странице `/follow/` список статей авторов на которых подписаны'
 
-        self.check_url(user_client, f'/{user_2.username}/follow', '/<username>/follow/')
+        self.check_url(user_client, f'/{user_2.username}/follow/', '/<username>/follow/', 'post')
         assert user.follower.count() == 2, 'Проверьте, что вы можете подписаться на пользователя'
         response = self.check_url(user_client, f'/follow', '/follow/')
         assert len(response.context['page']) == 5, \
             'Проверьте, что на странице `/follow/` список статей авторов на которых подписаны'
 
-        self.check_url(user_client, f'/{user_1.username}/unfollow', '/<username>/unfollow/')
+        self.check_url(user_client, f'/{user_1.username}/unfollow/', '/<username>/unfollow/', 'post')
         assert user.follower.count() == 1, 'Проверьте, что вы можете отписаться от пользователя'
         response = self.check_url(user_client, f'/follow', '/follow/')
         assert len(response.context['page']) == 3, \
             'Проверьте, что на странице `/follow/` список статей авторов на которых подписаны'
 
-        self.check_url(user_client, f'/{user_2.username}/unfollow', '/<username>/unfollow/')
+        self.check_url(user_client, f'/{user_2.username}/unfollow/', '/<username>/unfollow/', 'post')
         assert user.follower.count() == 0, 'Проверьте, что вы можете отписаться от пользователя'
         response = self.check_url(user_client, f'/follow', '/follow/')
         assert len(response.context['page']) == 0, \
@@ -0,0 +1,114 @@
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from posts import api_urls
+from posts.models import Comment, Follow, Group, Post
+from posts.urls import urlpatterns
+
+AUTHORS = 3
+COMMENTS = 3
+
+# Наибольшее число запросов к базе на один запрос к странице с пустым
+# кешем, по имени адреса и методу.
+BUDGETS = {
+    ('index', 'get'): 3,
+    ('group_posts', 'get'): 4,
+    ('top_groups', 'get'): 3,
+    ('new_post', 'get'): 3,
+    ('new_post', 'post'): 7,
+    ('search', 'get'): 4,
+    ('follow_index', 'get'): 5,
+    ('profile', 'get'): 6,
+    ('post_view', 'get'): 5,
+    ('post_edit', 'get'): 4,
+    ('post_edit', 'post'): 9,
+    ('post_comments', 'get'): 2,
+    ('add_comment', 'post'): 8,
+    ('profile_follow', 'post'): 11,
+    ('profile_unfollow', 'post'): 7,
+    ('follow_many', 'post'): 10,
+    ('api:posts', 'get'): 1,
+    ('api:group_posts', 'get'): 2,
+    ('api:author_posts', 'get'): 2,
+    ('api:follow_posts', 'get'): 5,
+    ('api:post_detail', 'get'): 1,
+    ('api:post_comments', 'get'): 2,
+}
+
+
+@pytest.fixture
+def feed(user, django_user_model):
+    group = Group.objects.create(
+        title='Тестовая группа 2', slug='budget', description='Описание'
+    )
+    posts = []
+    for i in range(AUTHORS):
+        author = django_user_model.objects.create_user(username=f'author{i}')
+        Follow.objects.create(user=user, author=author)
+        post = Post.objects.create(
+            text=f'Пост {i}', author=author, group=group
+        )
+        for j in range(COMMENTS):
+            commenter = django_user_model.objects.create_user(
+                username=f'reader{i}_{j}'
+            )
+            Comment.objects.create(post=post, author=commenter, text='Текст')
+        posts.append(post)
+    own = Post.objects.create(text='Свой пост', author=user, group=group)
+    return {'group': group, 'post': posts[0], 'own': own}
+
+
+def request_for(name, method, feed):
+    post, own = feed['post'], feed['own']
+    author = post.author.username
+    urls = {
+        'index': reverse('index'),
+        'group_posts': reverse('group_posts', args=[feed['group'].slug]),
+        'top_groups': reverse('top_groups'),
+        'new_post': reverse('new_post'),
+        'search': reverse('search') + '?q=Пост',
+        'follow_index': reverse('follow_index'),
+        'profile': reverse('profile', args=[author]),
+        'post_view': reverse('post_view', args=[author, post.id]),
+        'post_edit': reverse('post_edit', args=[own.author.username, own.id]),
+        'post_comments': reverse('post_comments', args=[author, post.id]),
+        'add_comment': reverse('add_comment', args=[author, post.id]),
+        'profile_follow': reverse('profile_follow', args=['reader0_0']),
+        'profile_unfollow': reverse('profile_unfollow', args=[author]),
+        'follow_many': reverse('follow_many'),
+        'api:posts': reverse('api:posts'),
+        'api:group_posts': reverse(
+            'api:group_posts', args=[feed['group'].slug]
+        ),
+        'api:author_posts': reverse('api:author_posts', args=[author]),
+        'api:follow_posts': reverse('api:follow_posts'),
+        'api:post_detail': reverse('api:post_detail', args=[post.id]),
+        'api:post_comments': reverse('api:post_comments', args=[post.id]),
+    }
+    if name == 'follow_many':
+        return urls[name], {'author': ['reader0_0', 'reader1_0', author]}
+    data = {'text': 'Новый текст'} if method == 'post' else None
+    return urls[name], data
+
+
+def test_every_url_has_budget():
+    names = {name for name, _ in BUDGETS}
+    missing = {pattern.name for pattern in urlpatterns} | {
+        f'{api_urls.app_name}:{pattern.name}'
+        for pattern in api_urls.urlpatterns
+    }
+    missing -= names
+    assert not missing, f'Задайте бюджет запросов для адресов {missing}'
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('name,method', BUDGETS)
+def test_query_budget(name, method, user_client, feed, query_budget):
+    url, data = request_for(name, method, feed)
+    cache.clear()
+    with query_budget(BUDGETS[name, method]):
+        response = getattr(user_client, method)(url, data)
+    assert response.status_code in (200, 302), (
+        f'Страница `{url}` вернула код {response.status_code}'
+    )
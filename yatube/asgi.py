@@ -0,0 +1,13 @@
+import os
+
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+from django.core.asgi import get_asgi_application
+
+from yatube import templating
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "yatube.settings")
+os.environ.setdefault("ASYNC_VIEWS", "1")
+
+# Static files in place of the sync-only whitenoise middleware.
+application = ASGIStaticFilesHandler(get_asgi_application())
+templating.warm_up()
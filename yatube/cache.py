@@ -0,0 +1,238 @@
+"""Two-tier cache: a bounded in-process LRU in front of a shared cache.
+
+L1 lives in the worker process and answers repeated reads without any I/O.
+L2 is any regular Django cache alias (file based, memcached, Redis) shared
+by all workers. Every value written through this backend carries a random
+stamp that is also stored under a small companion key in L2; an L1 entry
+older than STAMP_CHECK_INTERVAL seconds is only trusted again after its
+stamp still matches the one in L2, so a write or delete in another worker
+invalidates our copy within that interval.
+
+Integers are stored in L2 as they are and never kept in L1, so ``incr``
+and ``decr`` go straight to the L2 backend. They stay exact across
+processes only if its ``add`` and ``incr`` are atomic: memcached and the
+FileBasedCache below are, Django's own file based and database backends
+read and then write, and locmem is atomic within one process only.
+Version counters and rate-limit buckets rely on that.
+"""
+import os
+import pickle
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+from django.core.cache import caches
+from django.core.cache.backends import filebased
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.files import locks
+
+from . import metrics
+
+Entry = namedtuple("Entry", "stamp expires value")
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class _Store:
+    """Process-wide L1 storage shared by all threads using one alias"""
+
+    def __init__(self):
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            "l1": {"hits": 0, "misses": 0, "evictions": 0, "stale": 0},
+            "l2": {"hits": 0, "misses": 0},
+        }
+
+
+def _get_store(name):
+    with _stores_lock:
+        return _stores.setdefault(name, _Store())
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._l2_alias = location or "shared"
+        self._l1_max_entries = int(options.get("L1_MAX_ENTRIES", 1000))
+        self._check_interval = float(options.get("STAMP_CHECK_INTERVAL", 1))
+        self._store = _get_store(options.get("L1_NAME", self._l2_alias))
+
+    @property
+    def _l2(self):
+        return caches[self._l2_alias]
+
+    @staticmethod
+    def _stamp_key(key):
+        return f"{key}:stamp"
+
+    def _count(self, tier, event):
+        self._store.stats[tier][event] += 1
+
+    def _l1_get(self, key):
+        now = time.monotonic()
+        with self._store.lock:
+            item = self._store.data.get(key)
+            if item is None:
+                self._count("l1", "misses")
+                return None
+            entry, checked_at = item
+            if entry.expires is not None and entry.expires <= time.time():
+                del self._store.data[key]
+                self._count("l1", "misses")
+                return None
+            if now - checked_at < self._check_interval:
+                self._store.data.move_to_end(key)
+                self._count("l1", "hits")
+                return entry
+        if self._l2.get(self._stamp_key(key)) != entry.stamp:
+            with self._store.lock:
+                self._store.data.pop(key, None)
+                self._count("l1", "stale")
+            return None
+        with self._store.lock:
+            self._store.data[key] = (entry, now)
+            self._store.data.move_to_end(key)
+            self._count("l1", "hits")
+        return entry
+
+    def _l1_set(self, key, entry):
+        with self._store.lock:
+            self._store.data[key] = (entry, time.monotonic())
+            self._store.data.move_to_end(key)
+            while len(self._store.data) > self._l1_max_entries:
+                self._store.data.popitem(last=False)
+                self._count("l1", "evictions")
+
+    def _l1_delete(self, key):
+        with self._store.lock:
+            self._store.data.pop(key, None)
+
+    def _pack(self, value, timeout):
+        return Entry(
+            uuid.uuid4().hex, self.get_backend_timeout(timeout), value
+        )
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        entry = self._l1_get(key)
+        if entry is not None:
+            metrics.record_cache_lookup(hit=True)
+            return entry.value
+        value = self._l2.get(key, self)
+        if value is self:
+            self._count("l2", "misses")
+            metrics.record_cache_lookup(hit=False)
+            return default
+        self._count("l2", "hits")
+        metrics.record_cache_lookup(hit=True)
+        if isinstance(value, Entry):
+            self._l1_set(key, value)
+            return value.value
+        return value
+
+    def _write(self, method, key, value, timeout):
+        if isinstance(value, int) and not isinstance(value, bool):
+            self._l1_delete(key)
+            return method(key, value, timeout)
+        entry = self._pack(value, timeout)
+        stored = method(key, entry, timeout)
+        if stored is False:
+            return False
+        self._l2.set(self._stamp_key(key), entry.stamp, timeout)
+        self._l1_set(key, entry)
+        return stored
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._write(self._l2.set, key, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return self._write(self._l2.add, key, value, timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._l1_delete(key)
+        self._l2.touch(self._stamp_key(key), timeout)
+        return self._l2.touch(key, timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._l1_delete(key)
+        self._l2.delete(self._stamp_key(key))
+        return self._l2.delete(key)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        self._l1_delete(key)
+        return self._l2.incr(key, delta)
+
+    def clear(self):
+        with self._store.lock:
+            self._store.data.clear()
+        self._l2.clear()
+
+    def stats(self):
+        """Hit, miss and eviction counters of both tiers in this process"""
+        with self._store.lock:
+            stats = {
+                tier: dict(counters)
+                for tier, counters in self._store.stats.items()
+            }
+            stats["l1"]["entries"] = len(self._store.data)
+        return stats
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """Django's file based cache with atomic ``add`` and ``incr``.
+
+    Both run under an exclusive lock on one of 256 lock files picked by
+    the key, which serializes them across the threads and processes of
+    one host. ``incr`` keeps the expiry of the counter.
+    """
+
+    @contextmanager
+    def _locked(self, key, version):
+        name = os.path.basename(self._key_to_file(key, version))
+        directory = os.path.join(self._dir, "locks")
+        os.makedirs(directory, 0o700, exist_ok=True)
+        with open(os.path.join(directory, f"{name[:2]}.lock"), "ab") as f:
+            locks.lock(f, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(f)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        with self._locked(key, version):
+            return super().add(key, value, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        with self._locked(key, version):
+            try:
+                with open(self._key_to_file(key, version), "rb") as f:
+                    expires = pickle.load(f)
+                    value = pickle.loads(zlib.decompress(f.read()))
+            except FileNotFoundError:
+                value = None
+            else:
+                if expires is not None and expires < time.time():
+                    value = None
+            if value is None:
+                raise ValueError(f"Key '{key}' not found")
+            value += delta
+            timeout = None if expires is None else expires - time.time()
+            self.set(key, value, timeout, version)
+            return value
@@ -0,0 +1,198 @@
+"""A thread-safe pool of DB-API connections shared by a worker process.
+
+Connections are handed out most recently used first, so a quiet worker
+keeps reusing one warm connection while the idle rest age out. A pool
+never holds more than ``max_size`` connections; callers beyond that wait
+up to ``timeout`` seconds for one to be released. Connections older
+than ``max_lifetime`` are replaced, ones idle for ``max_idle`` are
+closed while more than ``min_size`` remain, and one that sat idle for
+``check_after`` seconds is health-checked before it is handed out.
+"""
+import threading
+import time
+from collections import deque
+
+from django.db.utils import OperationalError
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        connect,
+        check=None,
+        close=None,
+        min_size=1,
+        max_size=10,
+        max_lifetime=1800,
+        max_idle=300,
+        check_after=30,
+        timeout=5,
+    ):
+        self._connect = connect
+        self._check = check or (lambda connection: True)
+        self._close = close or (lambda connection: connection.close())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        # Idle connections as (connection, released at), newest last.
+        self._idle = deque()
+        self._created = {}
+        self._size = 0
+        self._condition = threading.Condition()
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "opened": 0,
+            "closed": 0,
+            "failed_checks": 0,
+        }
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _expired(self, connection, now):
+        return now - self._created[id(connection)] > self.max_lifetime
+
+    def _discard(self, connection):
+        """Close a connection that already left the pool's books"""
+        self._created.pop(id(connection), None)
+        self.stats["closed"] += 1
+        try:
+            self._close(connection)
+        except Exception:
+            pass
+
+    def _take_idle(self, now):
+        """Pop the warmest usable idle connection; call under the lock"""
+        stale = []
+        connection = None
+        while self._idle:
+            candidate, released = self._idle.pop()
+            if self._expired(candidate, now):
+                stale.append(candidate)
+                continue
+            connection = (candidate, now - released)
+            break
+        # Trim from the cold end, keeping min_size connections around.
+        while (
+            self._idle
+            and self._size - len(stale) > self.min_size
+            and now - self._idle[0][1] > self.max_idle
+        ):
+            stale.append(self._idle.popleft()[0])
+        self._size -= len(stale)
+        return connection, stale
+
+    def acquire(self):
+        start = time.monotonic()
+        waited = False
+        while True:
+            create = False
+            with self._condition:
+                while True:
+                    now = time.monotonic()
+                    taken, stale = self._take_idle(now)
+                    if taken or self._size < self.max_size:
+                        break
+                    remaining = start + self.timeout - now
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection was released within "
+                            f"{self.timeout} seconds"
+                        )
+                    if not waited:
+                        waited = True
+                        self.stats["waits"] += 1
+                    self._condition.wait(remaining)
+                if not taken:
+                    create = True
+                    self._size += 1
+            for connection in stale:
+                self._discard(connection)
+
+            if create:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                with self._condition:
+                    self._created[id(connection)] = time.monotonic()
+                    self.stats["opened"] += 1
+                break
+            connection, idle_for = taken
+            if idle_for < self.check_after or self._check(connection):
+                break
+            with self._condition:
+                self._size -= 1
+                self.stats["failed_checks"] += 1
+                self._condition.notify()
+            self._discard(connection)
+
+        with self._condition:
+            self.stats["checkouts"] += 1
+            if waited:
+                self.stats["wait_seconds"] += time.monotonic() - start
+        return connection
+
+    def release(self, connection, broken=False):
+        now = time.monotonic()
+        with self._condition:
+            if broken or self._expired(connection, now):
+                self._size -= 1
+            else:
+                self._idle.append((connection, now))
+                connection = None
+            self._condition.notify()
+        if connection is not None:
+            self._discard(connection)
+
+    def close(self):
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+        for connection in idle:
+            self._discard(connection)
+
+
+def get_pool(name, factory):
+    """The process-wide pool called ``name``, created by ``factory()``"""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = factory()
+        return pool
+
+
+def discard_pool(name):
+    """Forget the pool called ``name`` and close its idle connections"""
+    with _pools_lock:
+        pool = _pools.pop(name, None)
+    if pool is not None:
+        pool.close()
+
+
+def pools():
+    with _pools_lock:
+        return dict(_pools)
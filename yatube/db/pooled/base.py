@@ -0,0 +1,121 @@
+"""PostgreSQL backend that borrows its connections from a pool.
+
+Set ENGINE to ``yatube.db.pooled`` and tune the pool with
+``OPTIONS["POOL"]`` (MIN_SIZE, MAX_SIZE, MAX_LIFETIME, MAX_IDLE,
+CHECK_AFTER and TIMEOUT, see yatube.db.pool.ConnectionPool). Closing the
+connection at the end of a request returns it to the pool instead, so
+keep CONN_MAX_AGE at 0 and let every request check one out.
+"""
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+
+from ..pool import ConnectionPool, discard_pool, get_pool, pools
+
+Database = base.Database
+
+POOL_OPTIONS = {
+    "MIN_SIZE": "min_size",
+    "MAX_SIZE": "max_size",
+    "MAX_LIFETIME": "max_lifetime",
+    "MAX_IDLE": "max_idle",
+    "CHECK_AFTER": "check_after",
+    "TIMEOUT": "timeout",
+}
+
+
+def pool_name(alias, database):
+    return f"{alias}:{database}"
+
+
+def _connect(conn_params):
+    connection = Database.connect(**conn_params)
+    # Same shortcut as Django's backend: JSONField decodes the text itself.
+    Database.extras.register_default_jsonb(
+        conn_or_curs=connection, loads=lambda value: value
+    )
+    return connection
+
+
+def _is_alive(connection):
+    if connection.closed:
+        return False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        if not connection.autocommit:
+            connection.rollback()
+    except Database.Error:
+        return False
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep DROP DATABASE from running.
+        suffix = pool_name("", test_database_name)
+        for name in pools():
+            if name.endswith(suffix):
+                discard_pool(name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop("POOL", None)
+        return conn_params
+
+    def _get_pool(self, conn_params):
+        options = self.settings_dict["OPTIONS"].get("POOL", {})
+        arguments = {
+            POOL_OPTIONS[key]: value for key, value in options.items()
+        }
+        return get_pool(
+            pool_name(self.alias, conn_params["database"]),
+            lambda: ConnectionPool(
+                connect=lambda: _connect(conn_params),
+                check=_is_alive,
+                **arguments,
+            ),
+        )
+
+    def get_new_connection(self, conn_params):
+        if self.alias == NO_DB_ALIAS:
+            # Maintenance connections to the "postgres" database.
+            return super().get_new_connection(conn_params)
+        self.pool = self._get_pool(conn_params)
+        connection = self.pool.acquire()
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.pool is None:
+            return super()._close()
+        connection, pool = self.connection, self.pool
+        self.pool = None
+        # Django keeps referring to a connection closed inside an atomic
+        # block, so that one must not be handed to anybody else.
+        broken = self.in_atomic_block or bool(connection.closed)
+        if not broken:
+            try:
+                if (
+                    connection.get_transaction_status()
+                    != Database.extensions.TRANSACTION_STATUS_IDLE
+                ):
+                    connection.rollback()
+            except Database.Error:
+                broken = True
+        pool.release(connection, broken=broken)
@@ -0,0 +1,384 @@
+"""Per-view request metrics exposed in the Prometheus text format.
+
+MetricsMiddleware measures every request, sync or async: total time,
+the number and duration of database queries, template rendering time
+(through the InstrumentedTemplates backend) and cache hits and misses
+reported by TieredCache. Every connection gets an execute wrapper when
+it opens, which counts a query towards the request whose context it
+runs in, on whatever thread. The numbers go into histograms and
+counters kept in the worker process and labelled by the resolved view
+name, so the cost per request is a few additions under a lock. The
+database connection pools report their checkouts and waits
+too. metrics_view renders everything for staff members or for a scraper
+that presents METRICS_TOKEN; every worker reports its own numbers.
+"""
+import asyncio
+import bisect
+import contextvars
+import hmac
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+
+from .db import pool
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+UNRESOLVED = "<unresolved>"
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ""
+    inner = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return "{" + inner + "}"
+
+
+def _format_number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            lines.append(
+                f"{self.name}{_format_labels(self.labels, labels)} {value}"
+            )
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.labels = labels
+        # Label values -> (non-cumulative bucket counts, [sum]).
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = ([0] * len(self.buckets), [0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            series = sorted(
+                (labels, list(counts), total[0])
+                for labels, (counts, total) in self.series.items()
+            )
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                label_text = _format_labels(
+                    self.labels, labels, le=_format_number(bound)
+                )
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labels, labels)
+            lines.append(
+                f"{self.name}_sum{label_text} {_format_number(total)}"
+            )
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "yatube_request_duration_seconds",
+    "Time spent producing the response.",
+    TIME_BUCKETS,
+    ("view", "method"),
+)
+REQUEST_QUERIES = Histogram(
+    "yatube_request_queries",
+    "Database queries issued per request.",
+    COUNT_BUCKETS,
+    ("view",),
+)
+DB_SECONDS = Histogram(
+    "yatube_request_db_seconds",
+    "Time spent in database queries per request.",
+    TIME_BUCKETS,
+    ("view",),
+)
+TEMPLATE_SECONDS = Histogram(
+    "yatube_request_template_seconds",
+    "Time spent rendering templates per request.",
+    TIME_BUCKETS,
+    ("view",),
+)
+RESPONSES = Counter(
+    "yatube_responses_total",
+    "Responses by view and status code.",
+    ("view", "status"),
+)
+CACHE_LOOKUPS = Counter(
+    "yatube_cache_lookups_total",
+    "Cache reads during requests by view and result.",
+    ("view", "result"),
+)
+METRICS = [
+    REQUEST_SECONDS,
+    REQUEST_QUERIES,
+    DB_SECONDS,
+    TEMPLATE_SECONDS,
+    RESPONSES,
+    CACHE_LOOKUPS,
+]
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_time", "template_time", "hits", "misses")
+
+    def __init__(self):
+        self.queries = self.hits = self.misses = 0
+        self.db_time = self.template_time = 0.0
+
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def current():
+    """Metrics of the request being served, or None outside of requests"""
+    return _current.get()
+
+
+def record_cache_lookup(hit):
+    metrics = _current.get()
+    if metrics is None:
+        return
+    if hit:
+        metrics.hits += 1
+    else:
+        metrics.misses += 1
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def _wrap_connection(sender, connection, **kwargs):
+    # First in line, so that execute_wrapper() blocks, which pop the
+    # last wrapper on exit, never take this one away.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _time_query)
+
+
+connection_created.connect(_wrap_connection)
+
+
+def _view_name(request):
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match else UNRESOLVED
+
+
+def _observe(request, response, metrics, elapsed):
+    view = _view_name(request)
+    REQUEST_SECONDS.observe((view, request.method), elapsed)
+    REQUEST_QUERIES.observe((view,), metrics.queries)
+    DB_SECONDS.observe((view,), metrics.db_time)
+    TEMPLATE_SECONDS.observe((view,), metrics.template_time)
+    RESPONSES.inc((view, str(response.status_code)))
+    if metrics.hits:
+        CACHE_LOOKUPS.inc((view, "hit"), metrics.hits)
+    if metrics.misses:
+        CACHE_LOOKUPS.inc((view, "miss"), metrics.misses)
+
+
+class MetricsMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "METRICS_ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets the handler await this middleware, like Django's own.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        _observe(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        _observe(request, response, metrics, time.perf_counter() - start)
+        return response
+
+
+class _TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - start
+
+
+class InstrumentedTemplates(DjangoTemplates):
+    """Django template backend that reports rendering time of requests"""
+
+    def from_string(self, template_code):
+        return _TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return _TimedTemplate(super().get_template(template_name))
+
+
+def _cache_tier_lines():
+    stats = getattr(caches["default"], "stats", None)
+    if stats is None:
+        return []
+    counter = Counter(
+        "yatube_cache_tier_events_total",
+        "Events of the two-tier cache in this worker.",
+        ("tier", "event"),
+    )
+    for tier, events in stats().items():
+        for event, value in events.items():
+            if event != "entries":
+                counter.inc((tier, event), value)
+    return counter.render()
+
+
+def _pool_lines():
+    events = Counter(
+        "yatube_db_pool_events_total",
+        "Events of the database connection pools in this worker.",
+        ("pool", "event"),
+    )
+    waited = Counter(
+        "yatube_db_pool_wait_seconds_total",
+        "Time requests spent waiting for a pooled connection.",
+        ("pool",),
+    )
+    connections = Gauge(
+        "yatube_db_pool_connections",
+        "Connections held by the database connection pools.",
+        ("pool", "state"),
+    )
+    for name, connection_pool in pool.pools().items():
+        for event, value in connection_pool.stats.items():
+            if event == "wait_seconds":
+                waited.inc((name,), value)
+            else:
+                events.inc((name, event), value)
+        idle = connection_pool.idle
+        connections.set((name, "idle"), idle)
+        connections.set((name, "in_use"), connection_pool.size - idle)
+    if not connections.values:
+        return []
+    return events.render() + waited.render() + connections.render()
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_cache_tier_lines())
+    lines.extend(_pool_lines())
+    return "\n".join(lines) + "\n"
+
+
+def _authorized(request):
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, "METRICS_TOKEN", "")
+    supplied = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(supplied, f"Bearer {token}")
+
+
+def metrics_view(request):
+    if not _authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
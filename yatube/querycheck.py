@@ -0,0 +1,156 @@
+"""Detection of repeated queries, the signature of N+1 access patterns.
+
+QueryRecorder wraps the database connections, reduces every statement to
+a fingerprint (literals and parameter lists collapsed) and remembers the
+template line and project code line that issued it. Queries sharing a
+fingerprint more than ``threshold`` times within one block are reported
+as duplicates. Tests use it through the ``query_budget`` pytest fixture;
+DuplicateQueryMiddleware logs duplicates of live requests when
+QUERY_DUPLICATES_THRESHOLD is set.
+"""
+import contextlib
+import logging
+import os
+import re
+import sys
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Node
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 2
+
+Query = namedtuple("Query", "sql fingerprint location")
+Duplicate = namedtuple("Duplicate", "fingerprint count locations")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+# Database instrumentation that sits between the caller and the driver.
+_SKIPPED_MODULES = {__name__, "yatube.metrics"}
+
+
+def fingerprint(sql):
+    """The shape of a statement with every literal replaced by ``?``"""
+    shape = _STRING.sub("?", sql)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _LIST.sub("(...)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def _is_project_code(frame):
+    filename = frame.f_code.co_filename
+    return (
+        filename.startswith(settings.BASE_DIR)
+        and "site-packages" not in filename
+        and frame.f_globals.get("__name__") not in _SKIPPED_MODULES
+    )
+
+
+def location(frame=None):
+    """Innermost template line and project code line of the call stack"""
+    frame = frame or sys._getframe(1)
+    template = code = None
+    while frame is not None and (template is None or code is None):
+        node = frame.f_locals.get("self")
+        # type() rather than isinstance(): lazy objects such as
+        # request.user would evaluate, and query, on isinstance().
+        if template is None and issubclass(type(node), Node):
+            origin = getattr(node, "origin", None)
+            token = getattr(node, "token", None)
+            if origin is not None and token is not None:
+                template = f"{origin.template_name}:{token.lineno}"
+        if code is None and _is_project_code(frame):
+            filename = frame.f_code.co_filename
+            code = (
+                f"{os.path.relpath(filename, settings.BASE_DIR)}:"
+                f"{frame.f_lineno} in {frame.f_code.co_name}"
+            )
+        frame = frame.f_back
+    return " / ".join(place for place in (template, code) if place)
+
+
+class QueryRecorder:
+    """Record the shape and origin of every query run inside the block"""
+
+    def __init__(self, locate=True):
+        self.locate = locate
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = contextlib.ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(
+            Query(
+                sql,
+                fingerprint(sql),
+                location(sys._getframe(1)) if self.locate else "",
+            )
+        )
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def duplicates(self, threshold=DEFAULT_THRESHOLD):
+        """Fingerprints issued more than ``threshold`` times, most first"""
+        counts = Counter(query.fingerprint for query in self.queries)
+        return [
+            Duplicate(
+                shape,
+                count,
+                Counter(
+                    query.location
+                    for query in self.queries
+                    if query.fingerprint == shape
+                ),
+            )
+            for shape, count in counts.most_common()
+            if count > threshold
+        ]
+
+    def report(self, threshold=DEFAULT_THRESHOLD):
+        lines = [f"{len(self)} queries"]
+        for duplicate in self.duplicates(threshold):
+            lines.append(f"{duplicate.count}x {duplicate.fingerprint}")
+            for place, count in duplicate.locations.most_common():
+                lines.append(f"    {count}x from {place or 'unknown'}")
+        return "\n".join(lines)
+
+
+class DuplicateQueryMiddleware:
+    """Log requests that repeat a query shape more than the threshold"""
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, "QUERY_DUPLICATES_THRESHOLD", None)
+        if self.threshold is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        if recorder.duplicates(self.threshold):
+            logger.warning(
+                "Repeated queries in %s %s\n%s",
+                request.method,
+                request.path,
+                recorder.report(self.threshold),
+            )
+        return response
@@ -0,0 +1,169 @@
+"""Sliding-window rate limits for write views.
+
+Every scope in RATELIMITS sets a rate such as "10/m" for the signed-in
+user and another for the client address, so that neither one account
+nor a host full of them can flood the tables and the cache versions a
+write bumps. Counts live in the RATELIMIT_CACHE alias under one key per
+window, updated with ``incr``; the estimate weighs the previous window
+by how much of it still overlaps the sliding one, which smooths out the
+burst a fixed window allows at its edges. A request costs one increment
+and one read per key. Requests over a limit are answered 429 with
+Retry-After and still count, so a client that keeps hammering stays
+throttled.
+
+Limiting refuses to run on a cache without a native atomic ``incr``:
+get-then-set backends lose hits under concurrency, and file based ones
+also cost a disk round trip per key. The "ratelimit" alias the settings
+define counts in locmem unless RATELIMIT_CACHE_BACKEND points it at
+memcached or Redis; outside DEBUG the check warns about the former,
+since every worker process then counts on its own.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.shortcuts import render
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+ATOMIC_BACKENDS = {
+    "django.core.cache.backends.memcached.MemcachedCache",
+    "django.core.cache.backends.memcached.PyLibMCCache",
+    "django_redis.cache.RedisCache",
+    # Atomic under a lock, but every worker process counts on its own.
+    "django.core.cache.backends.locmem.LocMemCache",
+}
+
+
+def parse_rate(rate):
+    """A rate such as "10/m" as (requests, period in seconds)"""
+    count, _, period = rate.partition("/")
+    return int(count), PERIODS[period]
+
+
+def _key(scope, ident, window):
+    return f"ratelimit:{scope}:{ident}:{window}"
+
+
+def _alias():
+    alias = getattr(settings, "RATELIMIT_CACHE", "default")
+    config = settings.CACHES[alias]
+    if config["BACKEND"] == "yatube.cache.TieredCache":
+        # Integers never enter L1, so count in the L2 alias directly.
+        return config.get("LOCATION") or "shared"
+    return alias
+
+
+def counters():
+    """The cache of the counters; refuses one without an atomic incr"""
+    alias = _alias()
+    backend = settings.CACHES[alias]["BACKEND"]
+    if backend not in ATOMIC_BACKENDS:
+        raise ImproperlyConfigured(
+            f"Rate limiting needs a cache with an atomic incr, but the "
+            f"{alias!r} cache uses {backend}. Point RATELIMIT_CACHE at a "
+            f"memcached or Redis cache or turn RATELIMIT_ENABLED off."
+        )
+    return caches[alias]
+
+
+@checks.register(checks.Tags.caches)
+def check_cache(app_configs, **kwargs):
+    if not getattr(settings, "RATELIMIT_ENABLED", False):
+        return []
+    try:
+        counters()
+    except ImproperlyConfigured as error:
+        return [checks.Error(str(error), id="yatube.E001")]
+    backend = settings.CACHES[_alias()]["BACKEND"]
+    if not settings.DEBUG and backend.endswith(".LocMemCache"):
+        return [
+            checks.Warning(
+                "Rate limits are counted per worker process in locmem; "
+                "set RATELIMIT_CACHE_BACKEND and RATELIMIT_CACHE_LOCATION "
+                "to a memcached or Redis cache.",
+                id="yatube.W001",
+            )
+        ]
+    return []
+
+
+def _hit(cache, key, period):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The first hit of a window. The next window still reads the
+        # counter, so it is kept for two.
+        if cache.add(key, 1, 2 * period):
+            return 1
+        return cache.incr(key)
+
+
+def check(scope, ident, rate, now=None):
+    """Count a request, return 0 or the seconds to wait before the next"""
+    cache = counters()
+    limit, period = parse_rate(rate)
+    now = time.time() if now is None else now
+    window, elapsed = divmod(now, period)
+    window = int(window)
+    current = _hit(cache, _key(scope, ident, window), period)
+    previous = cache.get(_key(scope, ident, window - 1), 0)
+    weight = 1 - elapsed / period
+    if previous * weight + current <= limit:
+        return 0
+    if current > limit:
+        # Over the limit even without the previous window.
+        return max(math.ceil(period - elapsed), 1)
+    # The previous window fades out linearly over this one.
+    fades_at = period * (1 - (limit - current) / previous)
+    return max(math.ceil(fades_at - elapsed), 1)
+
+
+def client_address(request):
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def identities(request):
+    """(name, ident) pairs a request is counted against"""
+    if request.user.is_authenticated:
+        yield "user", request.user.pk
+    yield "ip", client_address(request)
+
+
+def ratelimit(scope, methods=("POST",)):
+    """Throttle ``methods`` requests to a view by RATELIMITS[scope]"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (
+                not getattr(settings, "RATELIMIT_ENABLED", False)
+                or request.method not in methods
+            ):
+                return view(request, *args, **kwargs)
+            rates = settings.RATELIMITS[scope]
+            retry_after = max(
+                (
+                    check(f"{scope}:{name}", ident, rates[name])
+                    for name, ident in identities(request)
+                    if name in rates
+                ),
+                default=0,
+            )
+            if retry_after:
+                response = render(
+                    request,
+                    "misc/429.html",
+                    {"retry_after": retry_after},
+                    status=429,
+                )
+                response["Retry-After"] = str(retry_after)
+                return response
+            return view(request, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,142 @@
+"""Read replica routing with read-your-writes stickiness.
+
+ReplicaMiddleware lets reads of GET and HEAD requests go to one of the
+DATABASE_REPLICAS aliases, chosen once per request. Everything else
+reads from the primary: other methods, management commands, workers and
+any read after the request has written. A write also sets a cookie that
+pins the visitor to the primary for REPLICA_PIN_SECONDS, long enough
+for the replicas to catch up with what they just did. A replica that
+cannot be connected to is skipped for REPLICA_RETRY_SECONDS.
+"""
+import asyncio
+import contextvars
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.utils import ConnectionDoesNotExist
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "primary_db"
+
+_down_until = {}
+
+
+class RequestState:
+    __slots__ = ("use_replica", "replica", "wrote")
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.replica = None
+        self.wrote = False
+
+
+_state = contextvars.ContextVar("replica_state", default=None)
+
+
+def replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def _is_available(alias):
+    if _down_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connection = connections[alias]
+        if connection.connection is None:
+            connection.ensure_connection()
+    except (ConnectionDoesNotExist, DatabaseError) as error:
+        retry = getattr(settings, "REPLICA_RETRY_SECONDS", 30)
+        _down_until[alias] = time.monotonic() + retry
+        logger.warning("Replica %s is unavailable: %s", alias, error)
+        return False
+    return True
+
+
+def _pick_replica():
+    """A random replica, connecting to the others only if it is down"""
+    aliases = list(replicas())
+    random.shuffle(aliases)
+    for alias in aliases:
+        if _is_available(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = _pick_replica()
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication.
+        return False if db in replicas() else None
+
+
+class ReplicaMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets the handler await this middleware, like Django's own.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    @staticmethod
+    def _state_for(request):
+        return RequestState(
+            use_replica=bool(replicas())
+            and request.method in ("GET", "HEAD")
+            and PIN_COOKIE not in request.COOKIES
+        )
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        state = self._state_for(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, response)
+
+    async def __acall__(self, request):
+        state = self._state_for(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._pin(state, response)
+
+    @staticmethod
+    def _pin(state, response):
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 10),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -8,7 +9,8 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 SECRET_KEY = os.environ.get('SECRET_KEY')
 
-DEBUG = TEMPLATE_DEBUG = True
+# Development defaults (sqlite, no rate limits) unless DEBUG=0.
+DEBUG = TEMPLATE_DEBUG = os.environ.get("DEBUG", "1") == "1"
 
 ALLOWED_HOSTS = ["*"]
 
@@ -29,6 +31,10 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "yatube.metrics.MetricsMiddleware",
+    "yatube.templating.TemplateProfileMiddleware",
+    "yatube.querycheck.DuplicateQueryMiddleware",
+    "yatube.routers.ReplicaMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -42,12 +48,26 @@ MIDDLEWARE = [
 ROOT_URLCONF = "yatube.urls"
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+# Keep parsed templates in memory instead of re-reading them per request.
+TEMPLATE_CACHE = (
+    os.environ.get("TEMPLATE_CACHE", "0" if DEBUG else "1") == "1"
+)
+TEMPLATE_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+if TEMPLATE_CACHE:
+    TEMPLATE_LOADERS = [
+        ("django.template.loaders.cached.Loader", TEMPLATE_LOADERS)
+    ]
+# Report the costliest template nodes of every response in Server-Timing.
+TEMPLATE_PROFILING = os.environ.get("TEMPLATE_PROFILING", "0") == "1"
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "BACKEND": "yatube.metrics.InstrumentedTemplates",
         "DIRS": [TEMPLATES_DIR],
-        "APP_DIRS": True,
         "OPTIONS": {
+            "loaders": TEMPLATE_LOADERS,
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
@@ -59,6 +79,22 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "yatube.wsgi.application"
+ASGI_APPLICATION = "yatube.asgi.application"
+# Serve the feed pages with the async views; asgi.py turns this on.
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS", "0") == "1"
+# Threads running the ORM calls of async views, per process; 0 runs
+# them on the request thread.
+ASYNC_VIEW_THREADS = int(os.environ.get("ASYNC_VIEW_THREADS", 8))
+# A sync-only middleware makes Django run the whole chain on one thread,
+# a request at a time. These are left out under ASGI, where asgi.py serves
+# the static files itself; DuplicateQueryMiddleware is sync only too and
+# meant for WSGI.
+SYNC_ONLY_MIDDLEWARE = [
+    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+]
+if ASYNC_VIEWS:
+    MIDDLEWARE = [m for m in MIDDLEWARE if m not in SYNC_ONLY_MIDDLEWARE]
 
 
 DB = {
@@ -69,14 +105,46 @@ DB = {
         "PORT": os.environ.get('DB_PORT'),
         "USER": os.environ.get('DB_USER'),
         "PASSWORD": os.environ.get('DB_PASSWORD'),
+        # Connections go back to the pool after each request.
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {
+            "POOL": {
+                "MIN_SIZE": int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+                "MAX_SIZE": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+                "MAX_LIFETIME": 1800,
+                "MAX_IDLE": 300,
+                "CHECK_AFTER": 30,
+                "TIMEOUT": float(os.environ.get("DB_POOL_TIMEOUT", 5)),
+            },
+        },
     },
     "sqlite": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
     },
 }
+# Set DB_POOL=0 to connect per request with the stock backend.
+if os.environ.get("DB_POOL", "1") == "1":
+    DB["postgres"]["ENGINE"] = "yatube.db.pooled"
+else:
+    del DB["postgres"]["OPTIONS"]["POOL"]
 DATABASES = {}
 DATABASES['default'] = DB['sqlite'] if DEBUG else DB['postgres']
+# Read replicas, comma separated: PostgreSQL hosts, or SQLite files when
+# DEBUG is on. Tests run replicas as mirrors of the default database.
+DATABASE_REPLICAS = []
+for number, location in enumerate(
+    filter(None, os.environ.get("DB_REPLICAS", "").split(",")), start=1
+):
+    replica = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    replica["NAME" if DEBUG else "HOST"] = location.strip()
+    DATABASES[f"replica{number}"] = replica
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["yatube.routers.ReplicaRouter"]
+# Reads of a visitor stay on the primary this long after they write.
+REPLICA_PIN_SECONDS = 10
+# A replica that refused a connection is skipped for this long.
+REPLICA_RETRY_SECONDS = 30
 
 
 
@@ -117,12 +185,65 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 
 SITE_ID = 1
 
+# Every worker keeps a small LRU of its own in front of the "shared" cache,
+# which any Django backend can serve (memcached or Redis in production).
 CACHES = {
     "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+        "BACKEND": "yatube.cache.TieredCache",
+        "LOCATION": "shared",
+        "OPTIONS": {
+            "L1_MAX_ENTRIES": 1000,
+            "STAMP_CHECK_INTERVAL": 1,
+        },
+    },
+    "shared": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND",
+            "yatube.cache.FileBasedCache",
+        ),
+        "LOCATION": os.environ.get(
+            "CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "yatube")
+        ),
+    },
+    # Rate limit counters, see RATELIMIT_CACHE: memcached or Redis through
+    # RATELIMIT_CACHE_BACKEND and RATELIMIT_CACHE_LOCATION in production,
+    # a per-process locmem cache while developing.
+    "ratelimit": {
+        "BACKEND": os.environ.get(
+            "RATELIMIT_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.environ.get("RATELIMIT_CACHE_LOCATION", "ratelimit"),
+    },
 }
 
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
+
+# Push new posts into follower timelines on write; authors with more
+# followers than the threshold are merged into the follow feed on read
+# until the resume_fan_out command finds them back under this share of it.
+TIMELINE_FANOUT = True
+TIMELINE_FANOUT_THRESHOLD = 5000
+TIMELINE_FANOUT_RESUME_RATIO = 0.8
+# Per-view request metrics served at /metrics/ to staff members and to
+# scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_ENABLED = True
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+# Log requests that issue one query shape more often than this (N+1);
+# None disables the check.
+QUERY_DUPLICATES_THRESHOLD = None
+# Throttle writes per signed-in user and per client address, see
+# yatube.ratelimit; off by default while developing.
+RATELIMIT_ENABLED = (
+    os.environ.get("RATELIMIT_ENABLED", "0" if DEBUG else "1") == "1"
+)
+RATELIMITS = {
+    "post": {"user": "10/m", "ip": "30/m"},
+    "comment": {"user": "20/m", "ip": "60/m"},
+    "follow": {"user": "60/m", "ip": "180/m"},
+}
+# The counters need a cache with a native atomic incr, memcached or
+# Redis; the file based shared cache is refused while limiting is on.
+RATELIMIT_CACHE = os.environ.get("RATELIMIT_CACHE", "ratelimit")
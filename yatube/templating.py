@@ -0,0 +1,194 @@
+"""Template warm-up for the cached loader and a per-node render profiler.
+
+With TEMPLATE_CACHE on, every template is parsed once per process and
+kept by the cached loader; warm_up() parses them all when a server
+starts instead of on the first requests that need them.
+
+The profiler times every rendered node, so the cost of a page can be
+attributed to templates, includes and tags such as url, thumbnail or
+cache, and to filters such as localtime. Its hook stays dormant outside
+of a profile() block, which is opened by the profile_templates command
+and, when TEMPLATE_PROFILING is on, by TemplateProfileMiddleware for
+every request; the middleware reports the most expensive nodes in a
+Server-Timing header.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates
+from django.template.base import Node, TextNode, VariableNode
+from django.template.loader_tags import IncludeNode
+from django.template.loaders.cached import Loader as CachedLoader
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENTRIES = 10
+
+_active = contextvars.ContextVar("template_profile", default=None)
+_render_annotated = Node.render_annotated
+
+
+def _template_names(directory):
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, directory).replace(os.sep, "/")
+
+
+def warm_up():
+    """Parse every template into the cached loaders, return how many"""
+    count = 0
+    for engine in engines.all():
+        if not isinstance(engine, DjangoTemplates):
+            continue
+        for loader in engine.engine.template_loaders:
+            if not isinstance(loader, CachedLoader):
+                continue
+            for source in loader.loaders:
+                for directory in source.get_dirs():
+                    for name in _template_names(directory):
+                        try:
+                            loader.get_template(name)
+                        except (TemplateDoesNotExist, UnicodeDecodeError):
+                            continue
+                        except TemplateSyntaxError:
+                            logger.exception("Cannot parse %s", name)
+                            continue
+                        count += 1
+    return count
+
+
+def label(node):
+    """What a node does, in terms of the template source"""
+    if isinstance(node, IncludeNode):
+        return "include " + node.template.token.strip("'\"")
+    if isinstance(node, VariableNode):
+        filters = [
+            func.__name__ for func, _ in node.filter_expression.filters
+        ]
+        return "filter " + "|".join(filters) if filters else "variable"
+    token = getattr(node, "token", None)
+    if token is not None and token.contents:
+        return token.contents.split()[0]
+    return type(node).__name__
+
+
+class RenderProfile:
+    """Calls, total and own (children excluded) seconds by node"""
+
+    def __init__(self):
+        # (template name, label) -> [calls, total seconds, own seconds]
+        self.entries = {}
+        self._children = []
+
+    def render(self, node, context):
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return _render_annotated(node, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            origin = getattr(node, "origin", None)
+            key = (origin.template_name if origin else "", label(node))
+            entry = self.entries.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += elapsed - children
+
+    def merge(self, other):
+        for key, (calls, total, own) in other.entries.items():
+            entry = self.entries.setdefault(key, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] += own
+
+    def top(self, limit=None):
+        """Entries as (template, label, calls, total, own), costliest first"""
+        rows = sorted(
+            (
+                (template, name, calls, total, own)
+                for (template, name), (calls, total, own) in (
+                    self.entries.items()
+                )
+            ),
+            key=lambda row: row[4],
+            reverse=True,
+        )
+        return rows[:limit]
+
+
+def _profiled_render_annotated(node, context):
+    profile = _active.get()
+    if profile is None or isinstance(node, TextNode):
+        return _render_annotated(node, context)
+    return profile.render(node, context)
+
+
+def install():
+    """Route node rendering through the profiler hook, once per process"""
+    Node.render_annotated = _profiled_render_annotated
+
+
+@contextlib.contextmanager
+def profile():
+    """Profile the templates rendered by this thread inside the block"""
+    install()
+    render_profile = RenderProfile()
+    token = _active.set(render_profile)
+    try:
+        yield render_profile
+    finally:
+        _active.reset(token)
+
+
+def _server_timing(render_profile):
+    metrics = []
+    for number, (template, name, calls, _, own) in enumerate(
+        render_profile.top(SERVER_TIMING_ENTRIES), start=1
+    ):
+        description = f"{template} {name} x{calls}".replace('"', "'")
+        metrics.append(
+            f'tpl{number};desc="{description}";dur={own * 1000:.2f}'
+        )
+    return ", ".join(metrics)
+
+
+class TemplateProfileMiddleware:
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "TEMPLATE_PROFILING", False):
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Lets the handler await this middleware, like Django's own.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        with profile() as render_profile:
+            response = self.get_response(request)
+        return _add_server_timing(response, render_profile)
+
+    async def __acall__(self, request):
+        with profile() as render_profile:
+            response = await self.get_response(request)
+        return _add_server_timing(response, render_profile)
+
+
+def _add_server_timing(response, render_profile):
+    if render_profile.entries:
+        response["Server-Timing"] = _server_timing(render_profile)
+    return response
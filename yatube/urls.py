@@ -6,15 +6,19 @@ from django.contrib.flatpages import views as flatpages_views
 from django.urls import include, path
 
 from posts import views as posts_views
+from posts.urls import feed_views
+from yatube import metrics
 
 urlpatterns = [
     path("404", posts_views.page_not_found),
     path("500", posts_views.server_error),
     path("admin/", admin.site.urls),
+    path("metrics/", metrics.metrics_view, name="metrics"),
     path("about/", include("django.contrib.flatpages.urls")),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),
-    path("", posts_views.index, name="index"),
+    path("api/v1/", include("posts.api_urls")),
+    path("", feed_views.index, name="index"),
     path("", include("posts.urls")),
 ]
 